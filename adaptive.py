@@ -0,0 +1,280 @@
+"""Adaptive thresholding with reusable, type-preserving work buffers.
+
+Two methods are available, matching those of
+``skimage.filter.threshold_adaptive``:
+
+- ``'gaussian'``: compare each pixel to a Gaussian-weighted local mean.
+- ``'mean'``: compare each pixel to the unweighted mean of a
+  ``block_size``-wide box around it. The box sums are computed with running
+  sums (a separable summed-area table), so the cost is independent of
+  ``block_size``. For integer images the sums are exact integers.
+
+In both cases each pixel is compared to its local mean in floating point,
+as scikit-image does, by `above_local_mean`. The box mean used here is the
+exact sum divided once by the block volume. scikit-image averages with
+floating point convolutions, whose rounding errors can move the mean by a
+few units in the last place. The two thresholds can therefore only differ
+for pixels within that distance of their local threshold: in practice,
+pixels of flat integer regions, which exactly equal their mean.
+
+Work buffers are kept in a `Workspace`, which by default is reused across
+calls in the same thread, so a batch of images of the same shape allocates
+them only once.
+"""
+
+import threading
+
+import numpy as np
+from scipy import ndimage as nd
+
+
+class Workspace(object):
+    """A set of named work buffers, reallocated only when their shape or
+    type changes.
+    """
+    def __init__(self):
+        self._buffers = {}
+
+    def buffer(self, name, shape, dtype):
+        """Return an uninitialised buffer with the given shape and type."""
+        shape, dtype = tuple(shape), np.dtype(dtype)
+        buf = self._buffers.get(name)
+        if buf is None or buf.shape != shape or buf.dtype != dtype:
+            buf = self._buffers[name] = np.empty(shape, dtype)
+        return buf
+
+    def clear(self):
+        """Release all buffers."""
+        self._buffers.clear()
+
+
+_local = threading.local()
+
+
+def default_workspace():
+    """Return the workspace shared by all calls in the current thread."""
+    if not hasattr(_local, 'workspace'):
+        _local.workspace = Workspace()
+    return _local.workspace
+
+
+def accumulator_dtype(dtype, block_size, ndim=2):
+    """Choose the narrowest type that holds sums over a block exactly.
+
+    Running sums may overflow; because integer overflow wraps around,
+    differences of running sums are still exact as long as each block sum
+    fits in the accumulator.
+
+    Parameters
+    ----------
+    dtype : numpy dtype
+        The image type.
+    block_size : int
+        The width of the block along each axis.
+    ndim : int, optional
+        The number of image dimensions.
+
+    Returns
+    -------
+    acc_dtype : numpy dtype
+        int32 or int64 for integer images, float64 otherwise.
+    """
+    dtype = np.dtype(dtype)
+    if dtype.kind not in 'biu':
+        return np.dtype(np.float64)
+    if dtype.kind == 'b':
+        max_abs = 1
+    else:
+        info = np.iinfo(dtype)
+        max_abs = max(abs(int(info.min)), int(info.max))
+    if max_abs * block_size ** ndim < 2 ** 31:
+        return np.dtype(np.int32)
+    return np.dtype(np.int64)
+
+
+def radius(block_size, method='gaussian'):
+    """The distance beyond which pixels don't affect the local threshold.
+
+    Parameters
+    ----------
+    block_size : int
+        The block size passed to `threshold_adaptive`.
+    method : {'gaussian', 'mean'}, optional
+        The thresholding method.
+
+    Returns
+    -------
+    radius : int
+        The radius of influence.
+    """
+    if method == 'mean':
+        return block_size // 2
+    sigma = (block_size - 1) / 6.0
+    return int(4.0 * sigma + 0.5)
+
+
+def _window_sum_axis(values, axis, block_size, padded, out):
+    """Sum `values` over windows of `block_size` along `axis`.
+
+    Values beyond the edges are mirrored (``scipy.ndimage`` mode
+    'reflect'). `padded` must have length ``n + block_size`` along `axis`,
+    and `out` the shape of `values`.
+    """
+    left = block_size // 2
+    right = block_size - 1 - left
+    n = values.shape[axis]
+    x = np.moveaxis(values, axis, 0)
+    b = np.moveaxis(padded, axis, 0)
+    b[0] = 0
+    if left <= n and right <= n:
+        b[1 + left:1 + left + n] = x
+        b[1:1 + left] = x[:left][::-1]
+        b[1 + left + n:] = x[::-1][:right]
+    else:  # blocks larger than the image need repeated reflection
+        b[1:] = np.pad(x, [(left, right)] + [(0, 0)] * (x.ndim - 1),
+                       mode='symmetric')
+    np.cumsum(b, axis=0, out=b)
+    np.subtract(b[block_size:block_size + n], b[:n],
+                out=np.moveaxis(out, axis, 0))
+    return out
+
+
+def block_sums(image, block_size, workspace=None):
+    """Sum an image over a box of width `block_size` around each pixel.
+
+    Parameters
+    ----------
+    image : array
+        The input image.
+    block_size : int
+        The width of the box along each axis.
+    workspace : `Workspace`, optional
+        Buffers to use. Default: `default_workspace()`.
+
+    Returns
+    -------
+    sums : array
+        The box sums, in `accumulator_dtype`. This is a workspace buffer,
+        overwritten by the next call using the same workspace.
+    """
+    if workspace is None:
+        workspace = default_workspace()
+    acc = accumulator_dtype(image.dtype, block_size, image.ndim)
+    current = image
+    for axis in range(image.ndim):
+        pad_shape = list(image.shape)
+        pad_shape[axis] += block_size
+        padded = workspace.buffer('padded-%i' % axis, pad_shape, acc)
+        out = workspace.buffer('sums-%i' % (axis % 2), image.shape, acc)
+        current = _window_sum_axis(current, axis, block_size, padded, out)
+    return current
+
+
+def check_block_size(block_size):
+    """Raise a ValueError unless `block_size` is odd.
+
+    An even box has no central pixel, so the box mean would be shifted by
+    half a pixel. The Gaussian method only derives its sigma from the
+    block size, so any size works there.
+    """
+    if block_size % 2 == 0:
+        raise ValueError('The block size must be odd, got %i.' % block_size)
+
+
+def local_mean(image, block_size, method='gaussian', workspace=None,
+               dtype=np.float64, out=None):
+    """Compute the local mean against which `threshold_adaptive` compares.
+
+    Parameters
+    ----------
+    image : array
+        The input image.
+    block_size : int
+        The size of the neighbourhood. It must be odd for the 'mean'
+        method.
+    method : {'gaussian', 'mean'}, optional
+        The thresholding method.
+    workspace : `Workspace`, optional
+        Buffers to use. Default: `default_workspace()`.
+    dtype : numpy float dtype, optional
+        The output type.
+    out : array, optional
+        The output array. Default: a new array.
+
+    Returns
+    -------
+    mean : array of float
+        The local mean.
+    """
+    if out is None:
+        out = np.empty(image.shape, dtype)
+    if method == 'mean':
+        check_block_size(block_size)
+        sums = block_sums(image, block_size, workspace)
+        return np.divide(sums, float(block_size) ** image.ndim, out=out)
+    elif method == 'gaussian':
+        sigma = (block_size - 1) / 6.0
+        nd.gaussian_filter(image, sigma, output=out, mode='reflect')
+        return out
+    raise ValueError("Unknown adaptive threshold method: %s" % method)
+
+
+def above_local_mean(image, mean, offset=0.0, workspace=None):
+    """Find the pixels brighter than their local mean minus an offset.
+
+    Parameters
+    ----------
+    image : array
+        The input image.
+    mean : array of float
+        Its local mean, from `local_mean`. It is not modified.
+    offset : float, optional
+        Subtract this from the local mean to obtain the local threshold.
+    workspace : `Workspace`, optional
+        Buffers to use. Default: `default_workspace()`.
+
+    Returns
+    -------
+    image_t : array of bool
+        The thresholded image. This is a new array.
+    """
+    if offset == 0:
+        return image > mean
+    if workspace is None:
+        workspace = default_workspace()
+    threshold = workspace.buffer('threshold', mean.shape, mean.dtype)
+    np.subtract(mean, offset, out=threshold)
+    return image > threshold
+
+
+def threshold_adaptive(image, block_size, method='gaussian', offset=0.0,
+                       workspace=None, dtype=np.float64):
+    """Threshold an image against a local mean.
+
+    Parameters
+    ----------
+    image : array
+        The input image, of any dimension.
+    block_size : int
+        The size of the neighbourhood used to compute the local mean. It
+        must be odd for the 'mean' method.
+    method : {'gaussian', 'mean'}, optional
+        The thresholding method. See the module docstring.
+    offset : float, optional
+        Subtract this from the local mean to obtain the local threshold.
+    workspace : `Workspace`, optional
+        Buffers to use. Default: `default_workspace()`.
+    dtype : numpy float dtype, optional
+        The type of the local mean. float32 halves the memory traffic, at
+        the cost of precision near the threshold.
+
+    Returns
+    -------
+    image_t : array of bool
+        The thresholded image. This is a new array.
+    """
+    if workspace is None:
+        workspace = default_workspace()
+    mean = local_mean(image, block_size, method, workspace, dtype,
+                      out=workspace.buffer('mean', image.shape, dtype))
+    return above_local_mean(image, mean, offset, workspace)
@@ -0,0 +1,395 @@
+"""Interchangeable implementations of the core segmentation operations.
+
+Otsu thresholding, dilation, opening, small object removal and labelling
+each have several implementations: the pure numpy/scipy versions in
+`channelstats` and `morphology`, scipy and scikit-image, and mahotas,
+which is often much faster. Code in `cafe` calls the functions of this
+module, which dispatch to the chosen implementation of each operation.
+
+The choice is made once per machine by `calibrate` (``cafe calibrate`` on
+the command line), which times every implementation on representative
+images, checks that they give the same masks as the scipy or scikit-image
+implementation in `REFERENCE`, and saves the fastest one for each
+operation to a JSON file. Without calibration, the first
+registered implementation of each operation is used.
+"""
+
+import os
+import json
+import time
+import collections
+
+import numpy as np
+from scipy import ndimage as nd
+try:
+    import mahotas as mh
+except ImportError:
+    mh = None
+
+import channelstats
+import morphology
+
+
+CHOICES_FILE = os.environ.get('CAFE_BACKENDS',
+                              os.path.join(os.path.expanduser('~'), '.cafe',
+                                           'backends.json'))
+
+CALIBRATION_SHAPES = [(512, 512), (2048, 2048)]
+
+# further (shape, dtype) cases on which `calibrate` checks the outputs,
+# without timing them: a z-stack, and 8-bit and floating point images
+VALIDATION_CASES = [((16, 64, 64), np.uint16), ((256, 256), np.uint8),
+                    ((256, 256), np.float64)]
+
+# the implementations against which the others are checked
+REFERENCE = {'threshold_otsu': 'skimage', 'dilate': 'scipy',
+             'opening': 'scipy', 'remove_small_objects': 'skimage',
+             'label': 'scipy'}
+
+# the (offset, factor) pairs of `cafe.otsu` at which thresholds are compared
+# during calibration: thresholds that only agree at the default setting
+# would still give different masks once users adjust them
+CALIBRATION_THRESHOLDS = [(0.0, 1.0), (0.5, 1.0), (-10.0, 1.0), (0.0, 0.75),
+                          (2.5, 1.5)]
+
+_registry = collections.OrderedDict((op, collections.OrderedDict())
+                                    for op in ['threshold_otsu', 'dilate',
+                                               'opening',
+                                               'remove_small_objects',
+                                               'label'])
+_choices = None
+
+
+def register(operation, name):
+    """Decorator registering a function as an implementation of `operation`.
+
+    Parameters
+    ----------
+    operation : string
+        The operation, one of the functions dispatched by this module.
+    name : string
+        The name of the implementation, e.g. 'mahotas'.
+    """
+    def decorator(func):
+        _registry[operation][name] = func
+        return func
+    return decorator
+
+
+def available(operation):
+    """The names of the implementations of `operation`, default first."""
+    return list(_registry[operation])
+
+
+def load(filename=None):
+    """Read saved backend choices.
+
+    Parameters
+    ----------
+    filename : string, optional
+        The file written by `calibrate`. Default: `CHOICES_FILE`.
+
+    Returns
+    -------
+    choices : dict of string to string
+        The chosen implementation of each operation. Empty if the file
+        doesn't exist or can't be parsed, e.g. after an interrupted write.
+    """
+    try:
+        with open(filename or CHOICES_FILE) as fin:
+            return dict(json.load(fin)['choices'])
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        return {}
+
+
+def use(operation, name):
+    """Use the implementation `name` of `operation` in this process."""
+    if name not in _registry[operation]:
+        raise ValueError('unknown %s backend %r; available: %s' %
+                         (operation, name, ', '.join(available(operation))))
+    _current_choices()[operation] = name
+
+
+def _current_choices():
+    global _choices
+    if _choices is None:
+        _choices = load()
+    return _choices
+
+
+def _chosen_name(operation):
+    impls = _registry[operation]
+    name = _current_choices().get(operation)
+    if name not in impls:
+        name = next(iter(impls))
+    return name
+
+
+def get(operation):
+    """Return the chosen implementation of `operation`.
+
+    A saved choice that isn't available here, e.g. because mahotas is not
+    installed, falls back to the default.
+    """
+    return _registry[operation][_chosen_name(operation)]
+
+
+def chosen():
+    """The name of the implementation used for each operation, as a dict.
+
+    Include it in the parameters of a `manifest.Manifest` to process files
+    again when the backends change.
+    """
+    return dict((operation, _chosen_name(operation))
+                for operation in _registry)
+
+
+def threshold_otsu(image):
+    """Otsu's threshold of an image, as `channelstats.threshold_otsu`."""
+    return get('threshold_otsu')(image)
+
+
+def dilate(mask, radius):
+    """Dilate a mask by a disk or ball, as `morphology.dilate`."""
+    return get('dilate')(mask, radius)
+
+
+def opening(mask, radius, iterations=1):
+    """Open a mask with a disk or ball, as `morphology.opening`."""
+    return get('opening')(mask, radius, iterations)
+
+
+def remove_small_objects(mask, min_size):
+    """Remove connected components smaller than `min_size` pixels.
+
+    As ``skimage.morphology.remove_small_objects`` with its default face
+    connectivity.
+    """
+    return get('remove_small_objects')(mask, min_size)
+
+
+def label(mask):
+    """Label the connected components of a mask, as ``nd.label``.
+
+    Returns
+    -------
+    labels : array of int
+        The labels, in order of the first pixel of each component.
+    n : int
+        The number of components.
+    """
+    return get('label')(mask)
+
+
+def _structuring_element(radius, ndim):
+    import cafe  # cafe dispatches through this module
+    return cafe.structuring_element(radius, ndim)
+
+
+def _integer(image):
+    return image.dtype in (np.uint8, np.uint16)
+
+
+register('threshold_otsu', 'channelstats')(channelstats.threshold_otsu)
+
+
+@register('threshold_otsu', 'skimage')
+def _otsu_skimage(image):
+    try:
+        from skimage.filters import threshold_otsu
+    except ImportError:
+        from skimage.filter import threshold_otsu
+    return threshold_otsu(image)
+
+
+register('dilate', 'distance')(morphology.dilate)
+
+
+@register('dilate', 'scipy')
+def _dilate_scipy(mask, radius):
+    return nd.binary_dilation(mask, _structuring_element(radius, mask.ndim))
+
+
+register('opening', 'distance')(morphology.opening)
+
+
+@register('opening', 'scipy')
+def _opening_scipy(mask, radius, iterations=1):
+    return nd.binary_opening(mask, _structuring_element(radius, mask.ndim),
+                             iterations=iterations)
+
+
+@register('remove_small_objects', 'skimage')
+def _remove_small_objects_skimage(mask, min_size):
+    from skimage.morphology import remove_small_objects
+    return remove_small_objects(np.asarray(mask, dtype=bool), min_size)
+
+
+@register('remove_small_objects', 'bincount')
+def _remove_small_objects_bincount(mask, min_size):
+    labels = nd.label(mask)[0]
+    keep = np.bincount(labels.ravel()) >= min_size
+    keep[0] = False
+    return keep[labels]
+
+
+register('label', 'scipy')(nd.label)
+
+
+if mh is not None:
+    @register('threshold_otsu', 'mahotas')
+    def _otsu_mahotas(image):
+        # mahotas only thresholds unsigned integer images
+        if not _integer(image):
+            return channelstats.threshold_otsu(image)
+        return mh.otsu(image)
+
+    @register('dilate', 'mahotas')
+    def _dilate_mahotas(mask, radius):
+        strel = _structuring_element(radius, mask.ndim).astype(bool)
+        return mh.dilate(np.asarray(mask, dtype=bool), strel)
+
+    @register('opening', 'mahotas')
+    def _opening_mahotas(mask, radius, iterations=1):
+        strel = _structuring_element(radius, mask.ndim).astype(bool)
+        opened = np.asarray(mask, dtype=bool)
+        for i in range(iterations):
+            opened = mh.erode(opened, strel)
+        for i in range(iterations):
+            opened = mh.dilate(opened, strel)
+        return opened
+
+    @register('remove_small_objects', 'mahotas')
+    def _remove_small_objects_mahotas(mask, min_size):
+        labels = mh.label(np.asarray(mask, dtype=bool))[0]
+        keep = mh.labeled.labeled_size(labels) >= min_size
+        keep[0] = False
+        return keep[labels]
+
+    @register('label', 'mahotas')
+    def _label_mahotas(mask):
+        return mh.label(np.asarray(mask, dtype=bool))
+
+
+def calibration_images(shape, seed=0, dtype=np.uint16):
+    """Representative inputs for `calibrate`.
+
+    Parameters
+    ----------
+    shape : tuple of int
+        The image shape.
+    seed : int, optional
+        The random seed.
+    dtype : numpy dtype, optional
+        The type of the image.
+
+    Returns
+    -------
+    image : array of `dtype`
+        Smooth noise, with blobs of many sizes. Integer images span 12 bits,
+        or 8 for uint8, and floating point images span [0, 1].
+    mask : array of bool
+        The brightest 15% of `image`.
+    """
+    random = np.random.RandomState(seed)
+    noise = nd.gaussian_filter(random.standard_normal(shape), 4)
+    noise -= noise.min()
+    noise /= noise.max()
+    if np.dtype(dtype).kind == 'f':
+        image = noise.astype(dtype)
+    else:
+        image = (noise * min(4095, np.iinfo(dtype).max)).astype(dtype)
+    mask = image > np.percentile(image, 85)
+    return image, mask
+
+
+def _calls(image, mask):
+    """The arguments for each operation, with the defaults of `cafe`."""
+    return {'threshold_otsu': (image,),
+            'dilate': (mask, 10),
+            'opening': (mask, 2, 2),
+            'remove_small_objects': (mask, 36),
+            'label': (mask,)}
+
+
+def _output_mask(operation, output, args):
+    """The mask given by an operation, for comparing implementations."""
+    if operation == 'threshold_otsu':
+        return np.stack([args[0] > (output - offset) * factor
+                         for offset, factor in CALIBRATION_THRESHOLDS])
+    if operation == 'label':
+        return output[0]
+    return np.asarray(output, dtype=bool)
+
+
+def _best_time(func, args, repeat):
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def calibrate(shapes=CALIBRATION_SHAPES, repeat=3, filename=None):
+    """Time each implementation of each operation, and save the fastest.
+
+    Implementations whose masks differ from those of the `REFERENCE`
+    implementation, on any of the timed uint16 images or any of the
+    `VALIDATION_CASES`, are never chosen.
+
+    Parameters
+    ----------
+    shapes : list of tuple of int, optional
+        The shapes of the calibration images.
+    repeat : int, optional
+        Time each call this many times, and keep the fastest.
+    filename : string, optional
+        Save the results to this JSON file. Default: `CHOICES_FILE`.
+
+    Returns
+    -------
+    results : dict
+        The ``'choices'`` of implementation for each operation, the total
+        best ``'timings'`` of each implementation over all shapes, in
+        seconds, the implementations that gave ``'mismatches'``, and the
+        ``'validated'`` cases, as (shape, dtype name) pairs, on which the
+        chosen implementations gave the same masks as the reference.
+    """
+    timings = collections.OrderedDict((op, collections.OrderedDict(
+                                            (name, 0.0) for name in impls))
+                                      for op, impls in _registry.items())
+    mismatches = collections.defaultdict(list)
+    cases = ([(shape, np.uint16, True) for shape in shapes] +
+             [(shape, dtype, False) for shape, dtype in VALIDATION_CASES])
+    for shape, dtype, timed in cases:
+        calls = _calls(*calibration_images(shape, dtype=dtype))
+        for op, impls in _registry.items():
+            args = calls[op]
+            reference = _output_mask(op, impls[REFERENCE[op]](*args), args)
+            for name, func in impls.items():
+                if name in mismatches[op]:
+                    continue
+                output = _output_mask(op, func(*args), args)
+                if not np.array_equal(output, reference):
+                    mismatches[op].append(name)
+                    continue
+                if timed:
+                    timings[op][name] += _best_time(func, args, repeat)
+    choices = {}
+    for op, times in timings.items():
+        valid = [name for name in times if name not in mismatches[op]]
+        choices[op] = min(valid, key=times.get)
+    results = {'choices': choices, 'timings': timings,
+               'mismatches': dict(mismatches),
+               'shapes': [list(shape) for shape in shapes],
+               'validated': [[list(shape), np.dtype(dtype).name]
+                             for shape, dtype, _ in cases]}
+    filename = filename or CHOICES_FILE
+    directory = os.path.dirname(os.path.abspath(filename))
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(filename, 'w') as fout:
+        json.dump(results, fout, indent=1)
+    _current_choices().update(choices)
+    return results
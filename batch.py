@@ -0,0 +1,189 @@
+"""Streaming batch execution of per-image functions.
+
+Images are pushed through a pool of worker processes, with only a bounded
+number in flight at any time, and results come back in input order.
+Disk access can be overlapped with computation by reading the next inputs
+on background threads with `prefetch`, and by handing outputs to an
+`AsyncWriter`.
+"""
+
+import os
+import queue
+import threading
+import collections
+from concurrent import futures
+
+
+def n_jobs(jobs):
+    """Interpret a ``--jobs`` command line value.
+
+    Parameters
+    ----------
+    jobs : int or None
+        The requested number of worker processes. 0 or a negative number
+        means "one per CPU"; None means 1 (run serially).
+
+    Returns
+    -------
+    jobs : int
+        The number of worker processes to use, at least 1.
+    """
+    if jobs is None:
+        return 1
+    if jobs <= 0:
+        return os.cpu_count() or 1
+    return jobs
+
+
+def bounded_map(func, items, jobs=1, max_in_flight=None, executor=None):
+    """Map `func` over `items` in parallel, yielding results in order.
+
+    Unlike ``multiprocessing.Pool.imap``, `items` is consumed lazily:
+    at most `max_in_flight` items have been submitted but not yet
+    yielded, so if `items` loads images on demand, memory use depends
+    on `max_in_flight` and not on the length of `items`.
+
+    Parameters
+    ----------
+    func : callable
+        A picklable (module-level) function of one argument.
+    items : iterable
+        The inputs to `func`.
+    jobs : int, optional
+        The number of worker processes (see `n_jobs`). With one job,
+        `func` is run serially in the calling process.
+    max_in_flight : int, optional
+        The maximum number of items submitted to the pool whose
+        results have not yet been yielded. Default: ``2 * jobs``.
+    executor : object with a ``submit`` method, optional
+        Submit the items to this executor, such as a
+        ``dask.distributed.Client``, rather than to a new pool of `jobs`
+        processes. `jobs` only sets the default `max_in_flight`.
+
+    Yields
+    ------
+    result : any
+        ``func(item)`` for each item, in the order of `items`.
+    """
+    jobs = n_jobs(jobs)
+    if max_in_flight is None:
+        max_in_flight = 2 * jobs
+    if executor is not None:
+        for result in _ordered_map(executor, func, items, max_in_flight):
+            yield result
+        return
+    if jobs == 1:
+        for item in items:
+            yield func(item)
+        return
+    with futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        for result in _ordered_map(executor, func, items, max_in_flight):
+            yield result
+
+
+def _ordered_map(executor, func, items, max_in_flight):
+    """Submit `func` on `items` to `executor`, yielding results in order."""
+    max_in_flight = max(max_in_flight, 1)
+    pending = collections.deque()
+    for item in items:
+        pending.append(executor.submit(func, item))
+        if len(pending) >= max_in_flight:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def prefetch(load, items, depth=2, threads=2):
+    """Load items ahead of their use on background threads.
+
+    Parameters
+    ----------
+    load : callable
+        A function of one item, typically reading an image from disk.
+    items : iterable
+        The items to load.
+    depth : int, optional
+        The number of items loaded ahead of the one being used. Memory
+        use is bounded by ``depth + 1`` loaded items. With 0, items are
+        loaded in the calling thread when they are needed.
+    threads : int, optional
+        The number of reading threads.
+
+    Yields
+    ------
+    loaded : any
+        ``load(item)`` for each item, in order.
+    """
+    if depth <= 0:
+        for item in items:
+            yield load(item)
+        return
+    with futures.ThreadPoolExecutor(max_workers=threads) as executor:
+        for result in _ordered_map(executor, load, items, depth + 1):
+            yield result
+
+
+class AsyncWriter(object):
+    """Run output functions in order on a background thread.
+
+    `submit` returns immediately unless `max_pending` outputs are already
+    waiting to be written, in which case it blocks: this backpressure
+    bounds the memory held by pending outputs. If an output function
+    raises an exception, the following ones are skipped and the exception
+    is raised again by the next call to `submit` or `close`.
+
+    Parameters
+    ----------
+    max_pending : int, optional
+        The maximum number of outputs waiting to be written. With 0,
+        outputs are written synchronously by `submit`.
+    """
+    def __init__(self, max_pending=4):
+        self.max_pending = max_pending
+        self._failed = False
+        self._error = None
+        self._thread = None
+        if max_pending > 0:
+            self._queue = queue.Queue(max_pending)
+            self._thread = threading.Thread(target=self._run)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            task = self._queue.get()
+            if task is None:
+                return
+            func, args, kwargs = task
+            if not self._failed:
+                try:
+                    func(*args, **kwargs)
+                except Exception as e:
+                    self._failed, self._error = True, e
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def submit(self, func, *args, **kwargs):
+        """Call ``func(*args, **kwargs)`` after all previous outputs."""
+        self._raise_error()
+        if self._thread is None:
+            func(*args, **kwargs)
+        else:
+            self._queue.put((func, args, kwargs))
+
+    def close(self):
+        """Wait for all pending outputs to be written."""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        self._raise_error()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
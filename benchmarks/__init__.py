@@ -0,0 +1,7 @@
+"""Benchmarks for cafe, in the format used by airspeed velocity (asv)."""
+
+import os
+import sys
+
+# the cafe modules live at the top level of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
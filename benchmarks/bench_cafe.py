@@ -0,0 +1,155 @@
+"""Time and memory of the public cafe and trf1 functions on synthetic data.
+
+Run with asv, or directly with ``python -m benchmarks.bench_cafe`` to print
+tables of run time and peak memory by image size and spot density.
+"""
+
+import os
+import shutil
+import tempfile
+import timeit
+import tracemalloc
+
+import matplotlib
+matplotlib.use('Agg')
+
+try:
+    from skimage.external import tifffile
+except ImportError:
+    import tifffile
+
+import cafe
+import cafe_main
+import trf1
+
+from . import synthetic
+
+
+SIZES = [256, 512, 1024, 2048]
+DENSITIES = [50, 200, 800]
+DEPTHS = [4, 16, 64]
+
+FUNCTIONS = {
+    'otsu': lambda ch: cafe.otsu(ch['centromere']),
+    'encode_centro_telomeres':
+        lambda ch: cafe.encode_centro_telomeres(ch['centromere'],
+                                                ch['telomere']),
+    'get_chromatin': lambda ch: cafe.get_chromatin(ch['chromatin']),
+    'get_centromere_neighbourhood':
+        lambda ch: cafe.get_centromere_neighbourhood(ch['centromere']),
+    'rnapii_centromere_vs_chromatin':
+        lambda ch: cafe.rnapii_centromere_vs_chromatin(
+                                            synthetic.rnapii_image(ch)),
+    'trf_quantify': lambda ch: trf1.trf_quantify(synthetic.trf_image(ch)),
+}
+
+_channels = {}
+
+
+def channels(shape, density, bit_depth=12):
+    """Synthetic channels, generated once per set of parameters."""
+    key = (shape, density, bit_depth)
+    if key not in _channels:
+        _channels[key] = synthetic.synthetic_channels(shape, density,
+                                                      bit_depth)
+    return _channels[key]
+
+
+class Functions(object):
+    params = [sorted(FUNCTIONS), SIZES, DENSITIES]
+    param_names = ['function', 'size', 'density']
+    timeout = 300
+
+    def setup(self, function, size, density):
+        self.channels = channels((size, size), density)
+
+    def time_function(self, function, size, density):
+        FUNCTIONS[function](self.channels)
+
+    def peakmem_function(self, function, size, density):
+        FUNCTIONS[function](self.channels)
+
+
+class BitDepth(object):
+    params = [sorted(FUNCTIONS), [8, 16]]
+    param_names = ['function', 'bit_depth']
+
+    def setup(self, function, bit_depth):
+        self.channels = channels((1024, 1024), 200, bit_depth)
+
+    def time_function(self, function, bit_depth):
+        FUNCTIONS[function](self.channels)
+
+
+class Volume(object):
+    params = [sorted(FUNCTIONS), DEPTHS]
+    param_names = ['function', 'depth']
+    timeout = 300
+
+    def setup(self, function, depth):
+        self.channels = channels((depth, 256, 256), 200)
+
+    def time_function(self, function, depth):
+        FUNCTIONS[function](self.channels)
+
+    def peakmem_function(self, function, depth):
+        FUNCTIONS[function](self.channels)
+
+
+class RunCentro(object):
+    params = [[4, 16], [1, 4]]
+    param_names = ['n_images', 'jobs']
+    timeout = 600
+
+    def setup(self, n_images, jobs):
+        self.directory = tempfile.mkdtemp()
+        self.filenames = []
+        for i in range(n_images):
+            fn = os.path.join(self.directory, 'image%02i.tif' % i)
+            image = synthetic.rnapii_image(
+                synthetic.synthetic_channels((1024, 1024), seed=i))
+            tifffile.imsave(fn, image)
+            self.filenames.append(fn)
+        half = n_images // 2
+        self.args = cafe_main.parser.parse_args(
+            ['centro', '-t'] + self.filenames[:half] +
+            ['-c'] + self.filenames[half:] +
+            ['-o', os.path.join(self.directory, 'boxplot.pdf'),
+             '-j', str(jobs)])
+
+    def teardown(self, n_images, jobs):
+        shutil.rmtree(self.directory)
+
+    def time_run_centro(self, n_images, jobs):
+        cafe_main.run_centro(self.args)
+        matplotlib.pyplot.close('all')
+
+    def peakmem_run_centro(self, n_images, jobs):
+        cafe_main.run_centro(self.args)
+        matplotlib.pyplot.close('all')
+
+
+def measure(function, ch, repeat=3):
+    """Return the best run time and the peak traced memory of one call."""
+    t = min(timeit.repeat(lambda: function(ch), number=1, repeat=repeat))
+    tracemalloc.start()
+    function(ch)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return t, peak
+
+
+def main(repeat=3):
+    print('%-32s %6s %8s %10s %10s' % ('function', 'size', 'density',
+                                       'time (s)', 'peak (MB)'))
+    for name in sorted(FUNCTIONS):
+        for size in SIZES:
+            for density in DENSITIES:
+                t, peak = measure(FUNCTIONS[name],
+                                  channels((size, size), density), repeat)
+                print('%-32s %6i %8i %10.4f %10.1f' % (name, size, density,
+                                                       t, peak / 2**20))
+
+
+if __name__ == '__main__':
+    main()
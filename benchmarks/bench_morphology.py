@@ -0,0 +1,69 @@
+"""Compare disk-based and distance-transform-based binary morphology.
+
+Run with asv, or directly with ``python -m benchmarks.bench_morphology``
+to print a table of timings by radius.
+"""
+
+import timeit
+
+import numpy as np
+from scipy import ndimage as nd
+
+import cafe
+import morphology
+
+
+RADII = [1, 3, 10, 30, 100]
+
+
+def sparse_mask(shape=(1024, 1024), density=0.001, seed=0):
+    """A random mask with isolated foreground pixels."""
+    return np.random.RandomState(seed).rand(*shape) < density
+
+
+class Dilation(object):
+    params = [RADII]
+    param_names = ['radius']
+
+    def setup(self, radius):
+        self.mask = sparse_mask()
+        self.strel = cafe.structuring_element(radius)
+
+    def time_scipy_disk(self, radius):
+        nd.binary_dilation(self.mask, structure=self.strel)
+
+    def time_distance_transform(self, radius):
+        morphology.dilate(self.mask, radius)
+
+
+class Opening(object):
+    params = [RADII]
+    param_names = ['radius']
+
+    def setup(self, radius):
+        self.mask = morphology.dilate(sparse_mask(), 20)
+        self.strel = cafe.structuring_element(radius)
+
+    def time_scipy_disk(self, radius):
+        nd.binary_opening(self.mask, structure=self.strel)
+
+    def time_distance_transform(self, radius):
+        morphology.opening(self.mask, radius)
+
+
+def main(repeat=3):
+    print('%8s %12s %12s %8s' % ('radius', 'scipy (s)', 'edt (s)', 'speedup'))
+    for radius in RADII:
+        bench = Dilation()
+        bench.setup(radius)
+        t_scipy = min(timeit.repeat(lambda: bench.time_scipy_disk(radius),
+                                    number=1, repeat=repeat))
+        t_edt = min(timeit.repeat(
+                        lambda: bench.time_distance_transform(radius),
+                        number=1, repeat=repeat))
+        print('%8i %12.4f %12.4f %8.1f' % (radius, t_scipy, t_edt,
+                                            t_scipy / t_edt))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+"""Deterministic synthetic images for benchmarking cafe.
+
+Images contain large, dim nuclei (chromatin), and small, bright spots
+inside them for centromeres, telomeres and TRF1 (which colocalises with
+telomeres) on a noisy background. Image size, z-depth, bit depth and spot
+density are all controllable, and the same parameters and seed always give
+the same image.
+"""
+
+import numpy as np
+from scipy import ndimage as nd
+
+
+def bit_depth_dtype(bit_depth):
+    """The smallest unsigned integer type holding `bit_depth` bits."""
+    return np.uint8 if bit_depth <= 8 else np.uint16
+
+
+def place_points(mask, n, random):
+    """Choose `n` random coordinates inside a mask.
+
+    Parameters
+    ----------
+    mask : array of bool
+        The allowed locations.
+    n : int
+        The number of points.
+    random : np.random.RandomState
+        The random number generator.
+
+    Returns
+    -------
+    coords : tuple of array of int
+        The coordinates of the points, one array per axis.
+    """
+    allowed = np.flatnonzero(mask)
+    if len(allowed) == 0:
+        allowed = np.arange(mask.size)
+    return np.unravel_index(random.choice(allowed, n), mask.shape)
+
+
+def blobs(shape, coords, sigma, amplitude=None):
+    """Render Gaussian blobs centred at the given coordinates.
+
+    Parameters
+    ----------
+    shape : tuple of int
+        The output shape.
+    coords : tuple of array of int
+        The blob centres.
+    sigma : float
+        The blob width, in pixels.
+    amplitude : array of float, optional
+        The peak intensity of each blob. Defaults to 1.
+
+    Returns
+    -------
+    image : array of float
+        The rendered blobs.
+    """
+    image = np.zeros(shape)
+    weights = np.ones(len(coords[0])) if amplitude is None else amplitude
+    np.add.at(image, coords, weights)
+    image = nd.gaussian_filter(image, sigma)
+    # scale so that an isolated blob of amplitude 1 peaks at 1
+    return image * ((2 * np.pi) ** 0.5 * sigma) ** len(shape)
+
+
+def to_dtype(image, bit_depth, random, noise=0.02):
+    """Add noise to a float image in [0, 1] and quantise it."""
+    top = 2 ** bit_depth - 1
+    image = image + noise * random.standard_normal(image.shape) + noise
+    image = np.clip(image, 0, 1) * top
+    return image.astype(bit_depth_dtype(bit_depth))
+
+
+def synthetic_channels(shape=(1024, 1024), density=200, bit_depth=12,
+                       nucleus_radius=40, seed=0):
+    """Generate the channels of a synthetic cafe image.
+
+    Parameters
+    ----------
+    shape : tuple of int, optional
+        The image shape. Use 3 dimensions, (P, M, N), for z-stacks.
+    density : float, optional
+        The number of centromeres, and of telomeres, per million pixels.
+    bit_depth : int, optional
+        The intensity bit depth: 8 gives uint8 images, up to 16 uint16.
+    nucleus_radius : float, optional
+        The approximate nucleus radius, in pixels. Nuclei cover about a
+        third of the image.
+    seed : int, optional
+        The random seed.
+
+    Returns
+    -------
+    channels : dict of string to array
+        The 'chromatin', 'centromere', 'telomere', 'trf1' and 'rnapii'
+        channels.
+    """
+    random = np.random.RandomState(seed)
+    size = np.prod(shape)
+    sigma = nucleus_radius / 2.
+    nucleus_volume = (2 * np.pi) ** (len(shape) / 2.) * sigma ** len(shape)
+    n_nuclei = max(1, int(size / 3 / nucleus_volume))
+    n_spots = max(1, int(density * size / 1e6))
+    nuclei = blobs(shape, place_points(np.ones(shape, bool), n_nuclei,
+                                       random), sigma)
+    nuclei = np.clip(0.5 * nuclei, 0, 0.6)
+    inside = nuclei > 0.25
+    centro_coords = place_points(inside, n_spots, random)
+    telo_coords = place_points(inside, n_spots, random)
+    brightness = lambda: random.uniform(0.4, 0.9, n_spots)
+    centromeres = blobs(shape, centro_coords, 1.5, brightness())
+    telomeres = blobs(shape, telo_coords, 1.0, brightness())
+    trf1 = blobs(shape, telo_coords, 1.2, brightness())
+    rnapii = 0.3 * nuclei + blobs(shape, centro_coords, 2.0, brightness())
+    channels = {'chromatin': nuclei + 0.2 * centromeres,
+                'centromere': 0.1 * nuclei + centromeres,
+                'telomere': 0.1 * nuclei + telomeres,
+                'trf1': 0.2 * nuclei + trf1,
+                'rnapii': rnapii}
+    return {name: to_dtype(image, bit_depth, random)
+            for name, image in sorted(channels.items())}
+
+
+def rnapii_image(channels):
+    """Stack channels as expected by `cafe.rnapii_centromere_vs_chromatin`."""
+    return np.stack([channels['rnapii'], channels['centromere'],
+                     channels['chromatin']], axis=-1)
+
+
+def trf_image(channels):
+    """Stack channels as expected by `trf1.trf_quantify`."""
+    return np.stack([channels['trf1'], channels['telomere'],
+                     channels['chromatin']], axis=-1)
@@ -5,13 +5,16 @@ another channel.
 """
 
 import numpy as np
-from scipy import ndimage as nd
 #from skimage import io
-from skimage import filter as imfilter
-from skimage.morphology import selem, remove_small_objects
+from skimage.morphology import selem
 
+import adaptive
+import backends
+import runlength
+import profiling
 
-def otsu(image, offset=0.0, factor=1.0):
+
+def otsu(image, offset=0.0, factor=1.0, threshold=None):
     """Threshold an image using Otsu's method with an optional offset.
 
     Parameters
@@ -23,19 +26,96 @@ def otsu(image, offset=0.0, factor=1.0):
     factor : float, optional
         Change the computed threshold by multiplying by a constant
         factor.
+    threshold : float, optional
+        Use this precomputed Otsu threshold instead of computing it
+        from `image`. `offset` and `factor` are still applied.
 
     Returns
     -------
     image_t : array of bool
         The thresholded image.
     """
-    t = imfilter.threshold_otsu(image)
+    if threshold is None:
+        threshold = backends.threshold_otsu(image)
+    t = threshold
     t -= offset
     t *= factor
     image_t = image > t
     return image_t
 
 
+def structuring_element(radius, ndim=2):
+    """Return a disk (2D) or ball (3D) structuring element.
+
+    Parameters
+    ----------
+    radius : int
+        The radius of the structuring element.
+    ndim : int, optional
+        The number of dimensions of the image it will be applied to.
+
+    Returns
+    -------
+    strel : array of uint8
+        The structuring element.
+    """
+    if ndim == 2:
+        return selem.disk(radius)
+    elif ndim == 3:
+        return selem.ball(radius)
+    else:
+        raise ValueError('Only 2D and 3D images are supported, got %i '
+                         'dimensions.' % ndim)
+
+
+def adaptive_background(image, block_size, method='gaussian'):
+    """Compute the local mean used by `threshold_adaptive`.
+
+    Parameters
+    ----------
+    image : array
+        The input image, 2D or 3D.
+    block_size : int
+        The size of the neighbourhood used to compute the local mean. It
+        must be odd for the 'mean' method.
+    method : {'gaussian', 'mean'}, optional
+        Use a Gaussian-weighted or an unweighted (box) mean.
+
+    Returns
+    -------
+    background : array of float
+        The local mean at each pixel.
+    """
+    return adaptive.local_mean(image, block_size, method)
+
+
+def threshold_adaptive(image, block_size, offset=0.0, method='gaussian'):
+    """Threshold an image against its local mean.
+
+    This is equivalent to ``skimage.filter.threshold_adaptive`` with the
+    Gaussian or mean methods, but works on images of any dimension and
+    reuses its work buffers between calls. See the `adaptive` module.
+
+    Parameters
+    ----------
+    image : array
+        The input image, 2D or 3D.
+    block_size : int
+        The size of the neighbourhood used to compute the local mean. It
+        must be odd for the 'mean' method.
+    offset : float, optional
+        Subtract this from the local mean to obtain the local threshold.
+    method : {'gaussian', 'mean'}, optional
+        Use a Gaussian-weighted or an unweighted (box) mean.
+
+    Returns
+    -------
+    image_t : array of bool
+        The thresholded image.
+    """
+    return adaptive.threshold_adaptive(image, block_size, method, offset)
+
+
 def encode_centro_telomeres_multichannel(img, *args, **kwargs):
     """Like ``encode_centro_telomeres``, but input images are in channels.
 
@@ -69,14 +149,15 @@ def encode_centro_telomeres(image_centro, image_telo,
                             centro_offset=0.0, centro_factor=1.0,
                             centro_min_size=36, centro_radius=10,
                             telo_offset=0.0, telo_adapt_radius=49,
-                            telo_open_radius=4):
+                            telo_open_radius=4, telo_adapt_method='gaussian'):
     """Find centromeres, telomeres, and their overlap.
 
     Parameters
     ----------
-    image_centro : array, shape (M, N)
-        The grayscale channel for centromeres.
-    image_telo : array, shape (M, N)
+    image_centro : array, shape (M, N[, P])
+        The grayscale channel for centromeres. 3D images are segmented
+        with ball-shaped structuring elements.
+    image_telo : array, shape (M, N[, P])
         The grayscale channel for telomeres.
     centro_offset : float, optional
         Offset Otsu's threshold by this amount (i.e. be less stringent
@@ -95,68 +176,100 @@ def encode_centro_telomeres(image_centro, image_telo,
     telo_open_radius : int, optional
         Use this radius for a binary opening of thresholded telomeres
         (removes noise).
+    telo_adapt_method : {'gaussian', 'mean'}, optional
+        The local mean used to threshold the telomere image. 'mean' is
+        faster for large `telo_adapt_radius`.
 
     Returns
     -------
-    encoded_regions : array of int, shape (M, N)
+    encoded_regions : array of int, shape (M, N[, P])
         A uint8 image with the following values:
          - 0: background
          - 1: telomeres
          - 2: centromeres
          - 3: centromere/telomere overlap
     """
-    centros = otsu(image_centro, centro_offset, centro_factor)
-    centros = remove_small_objects(centros, centro_min_size)
-    centro_strel = selem.disk(centro_radius)
-    centros = nd.binary_dilation(centros, structure=centro_strel)
-    telos = imfilter.threshold_adaptive(image_telo, telo_adapt_radius,
-                                        offset=telo_offset)
-    telo_strel = selem.disk(telo_open_radius)
-    telos = nd.binary_opening(telos, structure=telo_strel)
+    with profiling.stage('otsu'):
+        centros = otsu(image_centro, centro_offset, centro_factor)
+    with profiling.stage('remove_small_objects'):
+        centros = backends.remove_small_objects(centros, centro_min_size)
+    with profiling.stage('dilate'):
+        centros = backends.dilate(centros, centro_radius)
+    telos = telomere_mask(image_telo, telo_offset, telo_adapt_radius,
+                          telo_open_radius, telo_adapt_method)
     encoded_regions = 2 * centros.astype(np.uint8) + telos
     return encoded_regions
 
 
+def telomere_mask(image_telo, telo_offset=0.0, telo_adapt_radius=49,
+                  telo_open_radius=4, telo_adapt_method='gaussian'):
+    """Find telomeres by adaptive thresholding followed by an opening.
+
+    Parameters
+    ----------
+    image_telo : array, shape (M, N)
+        The grayscale channel for telomeres.
+    telo_offset, telo_adapt_radius, telo_open_radius : optional
+    telo_adapt_method : optional
+        See `encode_centro_telomeres`.
+
+    Returns
+    -------
+    telos : array of bool, shape (M, N)
+        The telomere mask.
+    """
+    with profiling.stage('threshold_adaptive'):
+        telos = threshold_adaptive(image_telo, telo_adapt_radius,
+                                   offset=telo_offset,
+                                   method=telo_adapt_method)
+    with profiling.stage('opening'):
+        telos = backends.opening(telos, telo_open_radius)
+    return telos
+
+
 def get_centromere_neighbourhood(im, dilation_size=3, threshold=None,
-                                 threshold_function=imfilter.threshold_otsu):
+                                 threshold_function=
+                                        backends.threshold_otsu):
     """Obtain the locations near centromeres in an image.
 
     Parameters
     ----------
-    im : np.ndarray, shape (M, N)
+    im : np.ndarray, shape (M, N[, P])
         The input image, containing fluorescently-labelled centromeres.
     dilation_size : int (optional, default 3)
         Size in pixels of neighbourhood around actual centromere locations.
     threshold : float (optional, default None)
         Use this threshold instead of one computed by `threshold_function`.
     threshold_function : function, im -> int or im -> im
-                         (optional, default `skimage.filter.threshold_otsu`)
+                         (optional, default `backends.threshold_otsu`)
         Use this function to find a suitable threshold for the input image.
 
     Returns
     -------
-    centro : np.ndarray of bool, shape (M, N)
+    centro : np.ndarray of bool, shape (M, N[, P])
         The locations around centromeres marked as `True`.
     """
-    if threshold is None:
-        threshold = threshold_function(im)
-    centro = im > threshold
-    strel = selem.disk(dilation_size)
-    centro = nd.binary_dilation(centro, structure=strel)
+    with profiling.stage('otsu'):
+        if threshold is None:
+            threshold = threshold_function(im)
+        centro = im > threshold
+    with profiling.stage('dilate'):
+        centro = backends.dilate(centro, dilation_size)
     return centro
 
 
 def get_chromatin(im, background_diameter=51, opening_size=2, opening_iter=2,
-                  size_filter=256):
+                  size_filter=256, background_method='gaussian',
+                  channel_axis='auto'):
     """Find the chromatin in an unevenly illuminated image.
 
     Parameters
     ----------
-    im : np.ndarray, shape (M, N)
+    im : np.ndarray, shape (M, N[, P])
         The chromatin grayscale image.
     background_diameter : int, optional
         The diameter of the block size in which to find the background. (This
-        is used by the scikit-image function `threshold_adaptive`.)
+        is used by `threshold_adaptive`.)
         (default: 51)
     opening_size : int, optional
         Perform a binary opening with a disk of this radius. (default: 2)
@@ -165,23 +278,124 @@ def get_chromatin(im, background_diameter=51, opening_size=2, opening_iter=2,
     size_filter : int, optional
         After the morphological opening, filter out segments smaller than this
         size. (default: 256)
+    background_method : {'gaussian', 'mean'}, optional
+        The local mean used to find the background. (default: 'gaussian')
+    channel_axis : int, 'auto' or None, optional
+        If `im` is a colour image, the axis of its channels, e.g. -1 for
+        an RGB image. The chromatin is taken from the first channel. With
+        'auto', an image of shape (M, N, 3) is taken to be RGB. Pass None
+        for grayscale images, including 3D stacks of 3 planes.
+        (default: 'auto')
 
     Returns
     -------
     chrs : np.ndarray, shape (M, N)
         A thresholded image of the chromatin regions.
     """
-    if im.ndim == 3 and im.shape[2] == 3:
-        im = im[..., 0]
-    fg = imfilter.threshold_adaptive(im, background_diameter)
+    im = chromatin_channel(im, channel_axis)
+    fg_open = chromatin_foreground(im, background_diameter, opening_size,
+                                   opening_iter, background_method)
+    with profiling.stage('remove_small_objects'):
+        chrs = backends.remove_small_objects(fg_open, size_filter)
+    return chrs
+
+
+def chromatin_channel(im, channel_axis='auto'):
+    """Return the grayscale chromatin channel of `im`.
+
+    Parameters
+    ----------
+    im : array-like
+        The chromatin image, possibly a colour image.
+    channel_axis : int, 'auto' or None, optional
+        See `get_chromatin`.
+
+    Returns
+    -------
+    chrom : array-like
+        The first channel of `im` along `channel_axis`, or `im` itself.
+    """
+    if channel_axis == 'auto':
+        channel_axis = -1 if im.ndim == 3 and im.shape[2] == 3 else None
+    if channel_axis is None:
+        return im
+    index = [slice(None)] * im.ndim
+    index[channel_axis] = 0
+    return im[tuple(index)]
+
+
+def chromatin_foreground(im, background_diameter=51, opening_size=2,
+                         opening_iter=2, background_method='gaussian'):
+    """Threshold chromatin adaptively and clean it up with an opening.
+
+    This is `get_chromatin` without the final size filtering, which is the
+    only step that depends on whole objects rather than on a bounded
+    neighbourhood of each pixel.
+
+    Parameters
+    ----------
+    im : np.ndarray, shape (M, N)
+        The chromatin grayscale image.
+    background_diameter, opening_size, opening_iter : int, optional
+    background_method : string, optional
+        See `get_chromatin`.
+
+    Returns
+    -------
+    fg_open : np.ndarray of bool, shape (M, N)
+        The opened foreground mask.
+    """
+    with profiling.stage('threshold_adaptive'):
+        fg = threshold_adaptive(im, background_diameter,
+                                method=background_method)
     # on an unevenly lit image, `fg` will have all sorts of muck lying around,
     # in addition to the chromatin. Thankfully, the muck is noisy and full of
     # holes, whereas the chromatin is solid. An opening followed by a size
     # filtering removes it quite effectively.
-    strel = selem.disk(opening_size)
-    fg_open = nd.binary_opening(fg, strel, iterations=opening_iter)
-    chrs = remove_small_objects(fg_open, size_filter)
-    return chrs
+    with profiling.stage('opening'):
+        fg_open = backends.opening(fg, opening_size,
+                                   iterations=opening_iter)
+    return fg_open
+
+
+def centromere_chromatin_masks(centromeres, chromatin,
+                               centromere_dilation_size=3,
+                               centromere_threshold=None,
+                               centromere_threshold_function=
+                                            backends.threshold_otsu,
+                               chromatin_background_diameter=51,
+                               chromatin_opening_size=2,
+                               chromatin_opening_iter=2,
+                               chromatin_size_filter=256,
+                               chromatin_background_method='gaussian'):
+    """Segment the centromere neighbourhoods and the chromatin of an image.
+
+    Parameters
+    ----------
+    centromeres : np.ndarray, shape (M, N)
+        The centromere channel.
+    chromatin : np.ndarray, shape (M, N)
+        The chromatin channel.
+    centromere_* : various types, optional
+        Parameters passed through to `get_centromere_neighbourhood`.
+    chromatin_* : various types, optional
+        Parameters passed through to `get_chromatin`.
+
+    Returns
+    -------
+    centromeric_regions, chromatin_regions : np.ndarray of bool, shape (M, N)
+        The outputs of `get_centromere_neighbourhood` and `get_chromatin`.
+        The chromatin regions include those near centromeres.
+    """
+    centromeric_regions = get_centromere_neighbourhood(centromeres,
+                                centromere_dilation_size, centromere_threshold,
+                                centromere_threshold_function)
+    chromatin_regions = get_chromatin(chromatin, chromatin_background_diameter,
+                                      chromatin_opening_size,
+                                      chromatin_opening_iter,
+                                      chromatin_size_filter,
+                                      chromatin_background_method)
+    return centromeric_regions, chromatin_regions
 
 
 def rnapii_centromere_vs_chromatin(rgb_im, channels=(0, 1, 2),
@@ -189,11 +403,13 @@ def rnapii_centromere_vs_chromatin(rgb_im, channels=(0, 1, 2),
                                    centromere_dilation_size=3,
                                    centromere_threshold=None,
                                    centromere_threshold_function=
-                                                    imfilter.threshold_otsu,
+                                            backends.threshold_otsu,
                                    chromatin_background_diameter=51,
                                    chromatin_opening_size=2,
                                    chromatin_opening_iter=2,
-                                   chromatin_size_filter=256):
+                                   chromatin_size_filter=256,
+                                   chromatin_background_method='gaussian',
+                                   masks=None):
     """Find intensity differences in the RNA-Pol-II channel.
 
     Parameters
@@ -210,6 +426,10 @@ def rnapii_centromere_vs_chromatin(rgb_im, channels=(0, 1, 2),
         Parameters passed through to `get_centromere_neighbourhood`.
     chromatin_* : various types, optional
         Parameters passed through to `get_chromatin`.
+    masks : tuple of np.ndarray of bool or `runlength.RunLengthMask`
+        Precomputed output of `centromere_chromatin_masks` for this image,
+        possibly run-length encoded. If given, the `centromere_*` and
+        `chromatin_*` parameters are ignored. The masks are not modified.
 
     Returns
     -------
@@ -218,17 +438,24 @@ def rnapii_centromere_vs_chromatin(rgb_im, channels=(0, 1, 2),
         in other chromatin regions.
     """
     rnapii, centromeres, chromatin = [rgb_im[..., i] for i in channels]
-    centromeric_regions = get_centromere_neighbourhood(centromeres,
-                                centromere_dilation_size, centromere_threshold,
-                                centromere_threshold_function)
-    chromatin_regions = get_chromatin(chromatin, chromatin_background_diameter,
-                                      chromatin_opening_size,
-                                      chromatin_opening_iter,
-                                      chromatin_size_filter)
-    chromatin_regions *= True - centromeric_regions
-    if normalise_to_1:
-        rnapii = rnapii.astype(float) / rnapii.max()
-    rnapii_centro = rnapii[centromeric_regions]
-    rnapii_chrom = rnapii[chromatin_regions]
+    if masks is None:
+        masks = centromere_chromatin_masks(centromeres, chromatin,
+                                           centromere_dilation_size,
+                                           centromere_threshold,
+                                           centromere_threshold_function,
+                                           chromatin_background_diameter,
+                                           chromatin_opening_size,
+                                           chromatin_opening_iter,
+                                           chromatin_size_filter,
+                                           chromatin_background_method)
+    with profiling.stage('extract_values'):
+        centromeric_regions, chromatin_regions = masks
+        chromatin_regions = chromatin_regions & ~centromeric_regions
+        rnapii_centro = runlength.extract(rnapii, centromeric_regions)
+        rnapii_chrom = runlength.extract(rnapii, chromatin_regions)
+        if normalise_to_1:
+            # normalise only the extracted values, not a copy of the image
+            rnapii_max = float(rnapii.max())
+            rnapii_centro = rnapii_centro / rnapii_max
+            rnapii_chrom = rnapii_chrom / rnapii_max
     return rnapii_centro, rnapii_chrom
-
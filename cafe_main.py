@@ -4,17 +4,83 @@
 import os
 import sys
 import argparse
+import ast
+import functools
+import glob
+import hashlib
+import importlib.util
+import tempfile
 import itertools as it
+import collections
+
+# local imports needing only the standard library
+import batch
+import daemon
+import manifest
+import profiling
+
+
+def lazy_import(name):
+    """Import a module when one of its attributes is first used.
+
+    Importing numpy, pandas, scikit-image and the Qt-based viewer takes
+    seconds, so the command line interface imports them lazily: each
+    subcommand only pays for the modules it uses.
+
+    Parameters
+    ----------
+    name : string
+        The name of a top-level module.
+
+    Returns
+    -------
+    module : module
+        The module, imported or not yet loaded.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ImportError('No module named %r' % name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
 
 # dependency library imports
-import numpy as np
-import mahotas as mh
-from mahotas import io
-from matplotlib import pyplot as plt
+np = lazy_import('numpy')
+
+# local imports with heavy dependencies
+cafe = lazy_import('cafe')
+backends = lazy_import('backends')
+cluster = lazy_import('cluster')
+imsource = lazy_import('imsource')
+maskcache = lazy_import('maskcache')
+runlength = lazy_import('runlength')
+significance = lazy_import('significance')
+sketch = lazy_import('sketch')
+sweep = lazy_import('sweep')
+trf1 = lazy_import('trf1')
+interactive = lazy_import('interactive')
 
-# local imports
-import cafe
-import interactive
+# lazily imported modules used by the background threads of
+# `batch.prefetch` and `batch.AsyncWriter`
+THREAD_MODULES = [np, imsource, runlength, sketch]
+
+
+def load_modules(modules=THREAD_MODULES):
+    """Finish importing lazily imported modules, in the calling thread.
+
+    ``importlib.util.LazyLoader`` is not thread-safe before Python 3.12:
+    when two threads first use a module at the same time, one of them can
+    find it half-initialised. Call this before starting threads that use
+    `modules`.
+    """
+    for module in modules:
+        getattr(module, '__name__')  # any attribute access loads it
 
 
 def strip_extension(fn):
@@ -34,6 +100,44 @@ def strip_extension(fn):
     return fn_strip
 
 
+def parse_param(text):
+    """Parse a ``NAME=VALUE[,VALUE...]`` command line parameter range.
+
+    Parameters
+    ----------
+    text : string
+        The parameter name and its comma-separated values. Values that
+        are not Python literals, such as ``gaussian``, are kept as strings.
+
+    Returns
+    -------
+    name : string
+        The parameter name, one of `sweep.PARAMETERS`.
+    values : list
+        The parameter values.
+    """
+    name, sep, values = text.partition('=')
+    if not sep or name not in sweep.PARAMETERS:
+        raise argparse.ArgumentTypeError(
+            'expected NAME=VALUE[,VALUE...], with NAME one of %s' %
+            ', '.join(sweep.PARAMETERS))
+    parsed = []
+    for value in values.split(','):
+        try:
+            parsed.append(ast.literal_eval(value))
+        except (ValueError, SyntaxError):
+            parsed.append(value)
+    return name, parsed
+
+
+def parse_shape(text):
+    """Parse an image shape given as ``MxN[xP]`` on the command line."""
+    try:
+        return tuple(int(n) for n in text.lower().split('x'))
+    except ValueError:
+        raise argparse.ArgumentTypeError('expected a shape such as 512x512')
+
+
 parser = argparse.ArgumentParser(description=
                                  "Chromatin-associated fluorescence estimator")
 subpar = parser.add_subparsers()
@@ -48,8 +152,58 @@ centro.add_argument('-H', '--save-chromatin', action='store_true',
                     default=False, help='Store segmented chromatin regions.')
 centro.add_argument('-C', '--save-centromeres', action='store_true',
                     default=False, help='Store segmented centromere regions.')
+centro.add_argument('--mask-format', choices=['tiff', 'rle'], default='tiff',
+                    help='The format of saved regions: 8-bit TIFF images, '
+                    'or compact run-length encoded .npz files, which can be '
+                    'read with runlength.load. (default: tiff)')
 centro.add_argument('-o', '--output-file', default='boxplot.pdf',
                     help='The name of the output file.')
+centro.add_argument('-j', '--jobs', type=int, default=1,
+                    help='Number of worker processes (0: one per CPU).')
+centro.add_argument('--max-in-flight', type=int, default=None,
+                    help='Maximum number of images being processed at once '
+                    '(default: twice the number of jobs).')
+centro.add_argument('--scheduler', metavar='ADDRESS', default=None,
+                    help='Process images on the dask scheduler at this '
+                    'address, or on a local dask cluster of --jobs '
+                    'workers with "local". Requires dask.')
+centro.add_argument('--cache-dir', default=None,
+                    help='Cache segmentation masks in this directory, so '
+                    'that reruns on the same images skip segmentation.')
+centro.add_argument('--cache-size', type=float, default=1024,
+                    help='Maximum size of the mask cache, in MB. '
+                    '(default: 1024)')
+centro.add_argument('-s', '--streaming', action='store_true', default=False,
+                    help='Summarise the pixel values of each image with a '
+                    'fixed-size histogram instead of keeping them all in '
+                    'memory. Box statistics are then approximate and '
+                    'outliers are not drawn.')
+centro.add_argument('--bins', type=int, default=4096,
+                    help='Number of histogram bins with --streaming. '
+                    '(default: 4096)')
+centro.add_argument('--state-dir', default=None,
+                    help='Keep a manifest and the per-image results in this '
+                    'directory, so that reruns only process new or changed '
+                    'images, and interrupted runs resume.')
+centro.add_argument('--prefetch', type=int, default=2,
+                    help='Number of images to read ahead, and of outputs to '
+                    'queue for writing, on background threads. Images are '
+                    'only read ahead with a single job. (0: no background '
+                    'I/O, default: 2)')
+centro.add_argument('--profile', metavar='REPORT', default=None,
+                    help='Record the time and memory used by each processing '
+                    'stage of each image, write them to this .json or .csv '
+                    'file, and print a summary.')
+centro.add_argument('--stats', metavar='TABLE', default=None,
+                    help='Compare the centromeric enrichment of RNA Pol II '
+                    'in test and control images, and write the effect sizes, '
+                    'bootstrap confidence intervals and permutation p-value '
+                    'to this .csv file. Images are the unit of resampling.')
+centro.add_argument('--resamples', type=int, default=10000,
+                    help='Number of permutations and bootstrap resamples '
+                    'with --stats. (default: 10000)')
+centro.add_argument('--seed', type=int, default=0,
+                    help='Random seed for --stats. (default: 0)')
 
 
 telo = subpar.add_parser('interactive', help="Quantify fluorescence on "
@@ -57,6 +211,149 @@ telo = subpar.add_parser('interactive', help="Quantify fluorescence on "
 telo.add_argument('directories', nargs='+', metavar='DIR', help=
                   "Input directories, containing four .tif files each: "
                   "target (AuKB), telomere, centromere, and DAPI.")
+telo.add_argument('-f', '--force', action='store_true', default=False,
+                  help='Process all directories, even those whose images '
+                  'have already been measured.')
+telo.add_argument('-p', '--preset', default=None,
+                  help='A file of segmentation parameters. The viewer\'s '
+                  'sliders start from them, and its "Save preset" button '
+                  'saves to this file.')
+telo.add_argument('--preview-factor', type=int, default=None,
+                  metavar='FACTOR',
+                  help='While a slider is dragged, preview the segmentation '
+                  'of the image downsampled by this factor, for a more '
+                  'responsive viewer on large images. The full resolution '
+                  'segmentation is shown when the slider is released.')
+telo.add_argument('--headless', action='store_true', default=False,
+                  help='Measure the directories with the parameters in the '
+                  '--preset file, in parallel, without opening the viewer.')
+telo.add_argument('--review', nargs='+', metavar='DIR', default=[],
+                  help='With --headless, open the viewer for these '
+                  'directories anyway, even if they were already measured.')
+telo.add_argument('-j', '--jobs', type=int, default=1,
+                  help='Number of worker processes with --headless '
+                  '(0: one per CPU).')
+telo.add_argument('--max-in-flight', type=int, default=None,
+                  help='Maximum number of directories being processed at '
+                  'once (default: twice the number of jobs).')
+telo.add_argument('--scheduler', metavar='ADDRESS', default=None,
+                  help='Process directories on the dask scheduler at this '
+                  'address, or on a local dask cluster of --jobs '
+                  'workers with "local". Requires dask.')
+telo.add_argument('--prefetch', type=int, default=2,
+                  help='Number of images to read ahead, and of outputs to '
+                  'queue for writing, on background threads. Images are only '
+                  'read ahead with a single job. (0: no background I/O, '
+                  'default: 2)')
+telo.add_argument('--profile', metavar='REPORT', default=None,
+                  help='Record the time and memory used by each processing '
+                  'stage of each image, write them to this .json or .csv '
+                  'file, and print a summary.')
+
+
+trf = subpar.add_parser('trf', help="Quantify TRF1 blobs in images from "
+                        "several conditions.")
+trf.add_argument('-g', '--group', nargs=2, action='append', required=True,
+                 metavar=('CONDITION', 'GLOB'),
+                 help='A condition name and a glob pattern matching its '
+                 'images. Can be given several times.')
+trf.add_argument('-o', '--output', default='trf.parquet',
+                 help='The output directory, a Parquet dataset with one '
+                 'file per image and condition. Images already in the '
+                 'dataset are only processed again if they have changed, '
+                 'and the results of images no longer matched by any group '
+                 'are removed. (default: trf.parquet)')
+trf.add_argument('-f', '--force', action='store_true', default=False,
+                 help='Process all images, even those already in the output.')
+trf.add_argument('--prefetch', type=int, default=2,
+                 help='Number of images to read ahead, and of outputs to '
+                 'queue for writing, on background threads. Images are only '
+                 'read ahead with a single job. (0: no background I/O, '
+                 'default: 2)')
+trf.add_argument('--profile', metavar='REPORT', default=None,
+                 help='Record the time and memory used by each processing '
+                 'stage of each image, write them to this .json or .csv '
+                 'file, and print a summary.')
+trf.add_argument('-j', '--jobs', type=int, default=1,
+                 help='Number of worker processes (0: one per CPU).')
+trf.add_argument('--max-in-flight', type=int, default=None,
+                 help='Maximum number of images being processed at once '
+                 '(default: twice the number of jobs).')
+trf.add_argument('--scheduler', metavar='ADDRESS', default=None,
+                 help='Process images on the dask scheduler at this '
+                 'address, or on a local dask cluster of --jobs '
+                 'workers with "local". Requires dask.')
+
+
+sweeper = subpar.add_parser('sweep', help="Measure the centromere/telomere "
+                            "segmentation over a grid of parameters.")
+sweeper.add_argument('images', nargs='+', metavar='IMAGE',
+                     help='Multichannel input images.')
+sweeper.add_argument('-p', '--param', type=parse_param, action='append',
+                     required=True, metavar='NAME=VALUE[,VALUE...]',
+                     help='The values to try for a parameter of '
+                     'cafe.encode_centro_telomeres, e.g. centro_radius=5,10. '
+                     'Can be given several times; every combination is '
+                     'tried.')
+sweeper.add_argument('-C', '--centro-channel', type=int, default=0,
+                     help='The centromere channel. (default: 0)')
+sweeper.add_argument('-T', '--telo-channel', type=int, default=1,
+                     help='The telomere channel. (default: 1)')
+sweeper.add_argument('-o', '--output', default='sweep.csv',
+                     help='The output table, with one row per image and '
+                     'parameter setting. (default: sweep.csv)')
+sweeper.add_argument('-j', '--jobs', type=int, default=1,
+                     help='Number of worker processes (0: one per CPU).')
+sweeper.add_argument('--max-in-flight', type=int, default=None,
+                     help='Maximum number of images being processed at once '
+                     '(default: twice the number of jobs).')
+sweeper.add_argument('--scheduler', metavar='ADDRESS', default=None,
+                     help='Process images on the dask scheduler at this '
+                     'address, or on a local dask cluster of --jobs '
+                     'workers with "local". Requires dask.')
+sweeper.add_argument('--prefetch', type=int, default=2,
+                     help='Number of images to read ahead, and of outputs to '
+                     'queue for writing, on background threads. Images are '
+                     'only read ahead with a single job. (0: no background '
+                     'I/O, default: 2)')
+sweeper.add_argument('--profile', metavar='REPORT', default=None,
+                     help='Record the time and memory used by each '
+                     'processing stage of each image, write them to this '
+                     '.json or .csv file, and print a summary.')
+
+
+calibrator = subpar.add_parser('calibrate', help="Time the implementations "
+                               "of thresholding, morphology and labelling, "
+                               "and save the fastest for later runs.")
+calibrator.add_argument('-s', '--shape', type=parse_shape, action='append',
+                        metavar='MxN[xP]',
+                        help='The shape of a calibration image. Can be given '
+                        'several times. (default: 512x512 and 2048x2048)')
+calibrator.add_argument('-r', '--repeat', type=int, default=3,
+                        help='Time each call this many times and keep the '
+                        'fastest. (default: 3)')
+calibrator.add_argument('-o', '--output', default=None,
+                        help='The file in which to save the choices. '
+                        '(default: the CAFE_BACKENDS environment variable, '
+                        'or ~/.cafe/backends.json)')
+
+
+server = subpar.add_parser('serve', help="Keep the imports warm in a server "
+                           "process, and run the commands sent to it with "
+                           "`cafe submit`.")
+server.add_argument('--socket', default=daemon.SOCKET,
+                    help='The Unix socket to listen on. (default: the '
+                    'CAFE_SOCKET environment variable, or cafe-UID.sock in '
+                    'the temporary directory)')
+
+
+submitter = subpar.add_parser('submit', help="Run a command on a server "
+                              "started with `cafe serve`, e.g. "
+                              "`cafe submit trf -g kd 'kd/*.tif'`.")
+submitter.add_argument('--socket', default=daemon.SOCKET,
+                       help='The Unix socket of the server.')
+submitter.add_argument('command', nargs=argparse.REMAINDER,
+                       help='The cafe command and its arguments.')
 
 
 def get_command(argv):
@@ -75,59 +372,712 @@ def get_command(argv):
     return argv[1]
 
 
-def main():
-    """Run the command-line interface."""
-    args = parser.parse_args()
-    cmd = get_command(sys.argv)
+def main(argv=None):
+    """Run the command-line interface.
+
+    Parameters
+    ----------
+    argv : list of string, optional
+        The argument vector, including the program name. Default:
+        ``sys.argv``.
+    """
+    if argv is None:
+        argv = sys.argv
+    args = parser.parse_args(argv[1:])
+    cmd = get_command(argv)
     if cmd == 'centro':
         run_centro(args)
     elif cmd == 'interactive':
         run_interactive(args)
+    elif cmd == 'trf':
+        run_trf(args)
+    elif cmd == 'sweep':
+        run_sweep(args)
+    elif cmd == 'calibrate':
+        run_calibrate(args)
+    elif cmd == 'serve':
+        daemon.serve(args.socket)
+    elif cmd == 'submit':
+        run_submit(args)
+
+
+def load_image(fn, channels=None):
+    """Open image `fn` and read `channels` into memory, e.g. to prefetch it.
+
+    The time spent is recorded as the 'read' stage of the image, unless
+    it is loaded on a background thread, where reading overlaps with
+    processing.
+
+    Returns
+    -------
+    image : `imsource.ImageSource`
+        The preloaded image.
+    """
+    with profiling.stage('read'):
+        return imsource.ImageSource(fn).preload(channels)
+
+
+def save_mask(fn, mask, mask_format='tiff'):
+    """Save a mask as an 8-bit TIFF image or a run-length encoded file.
+
+    Parameters
+    ----------
+    fn : string
+        The output filename, without extension.
+    mask : array of bool or `runlength.RunLengthMask`
+        The mask.
+    mask_format : {'tiff', 'rle'}, optional
+        The output format.
+    """
+    if mask_format == 'rle':
+        runlength.save(fn + '.rle.npz', mask)
+    else:
+        from mahotas import io
+        io.imsave(fn + '.tif', 255 * np.asarray(mask).astype(np.uint8))
+
+
+def centro_image(fn, save_chromatin=False, save_centromeres=False,
+                 cache=None, bins=None, writer=None, image=None,
+                 mask_format='tiff'):
+    """Process a single image for the ``centro`` subcommand.
+
+    Parameters
+    ----------
+    fn : string
+        The filename of a 3-channel image.
+    save_chromatin, save_centromeres : bool, optional
+        Save the segmented chromatin and centromere regions next to the
+        input image.
+    cache : `maskcache.MaskCache`, optional
+        Look up the segmentation of the image in this cache, and store it
+        there if it is not yet present.
+    bins : int, optional
+        If given, summarise the output values in `sketch.Histogram`
+        objects with this many bins, rather than returning them all.
+    writer : `batch.AsyncWriter`, optional
+        Save the regions with this writer, rather than synchronously.
+    image : `imsource.ImageSource`, optional
+        The image in `fn`, if it has already been opened.
+    mask_format : {'tiff', 'rle'}, optional
+        The format of the saved regions. See `save_mask`.
+
+    Returns
+    -------
+    rnapii_centro, rnapii_chrom : 1D np.ndarray or `sketch.Histogram`
+        The output of `cafe.rnapii_centromere_vs_chromatin` on the image.
+    """
+    if image is None:
+        image = load_image(fn, (0, 1, 2))
+    with image as im:
+        if cache is None:
+            masks = cafe.centromere_chromatin_masks(im[..., 1], im[..., 2])
+        else:
+            masks = cache.get_or_compute(cafe.centromere_chromatin_masks,
+                                         im[..., 1], im[..., 2])
+        result = cafe.rnapii_centromere_vs_chromatin(im, masks=masks)
+    if bins is not None:
+        result = tuple(sketch.Histogram.of(values, nbins=bins)
+                       for values in result)
+    centromeres, chromatin = masks
+    save = save_mask if writer is None else functools.partial(writer.submit,
+                                                              save_mask)
+    with profiling.stage('write'):
+        if save_chromatin:
+            save(strip_extension(fn) + '_chromatin', chromatin, mask_format)
+        if save_centromeres:
+            save(strip_extension(fn) + '_centromere', centromeres,
+                 mask_format)
+    return result
+
+
+def map_images(func, filenames, args, session, load=None):
+    """Map `func` over images with `batch.bounded_map`, profiling each one.
+
+    Parameters
+    ----------
+    func : callable
+        A picklable function of one filename.
+    filenames : list of string
+        The input images.
+    args : argparse.Namespace
+        The parsed command line, with `jobs`, `max_in_flight`, `scheduler`
+        and `prefetch` options.
+    session : `profiling.Session`
+        The profiling session of the run, possibly inactive.
+    load : callable, optional
+        A function reading what `func` needs from a filename. When running
+        in a single process with `args.prefetch`, the next images are
+        loaded on background threads while the current one is processed,
+        and `func` is called as ``func(fn, image=load(fn))``. Otherwise
+        `func` reads its image itself.
+
+    Returns
+    -------
+    results : iterator
+        The result of `func` on each file, in order.
+    """
+    load_modules()  # before the reading and writing threads use them
+    if args.scheduler is not None:
+        scheduler = None if args.scheduler == 'local' else args.scheduler
+        results = cluster.map_images(session.wrap(func), filenames, scheduler,
+                                     batch.n_jobs(args.jobs),
+                                     args.max_in_flight)
+        return session.unwrap(results)
+    if load is None or batch.n_jobs(args.jobs) > 1 or args.prefetch <= 0:
+        results = batch.bounded_map(session.wrap(func), filenames, args.jobs,
+                                    args.max_in_flight)
+        return session.unwrap(results)
+    images = batch.prefetch(load, filenames, args.prefetch)
+    return session.unwrap(
+                session.wrap(functools.partial(func, image=image))(fn)
+                for fn, image in zip(filenames, images))
+
+
+def local_writer(args, writer):
+    """The writer for per-image functions: `writer`, in a single process.
+
+    Worker processes can't share the writer of the main process, so they
+    write their outputs synchronously, concurrently with each other.
+    """
+    if args.scheduler is not None or batch.n_jobs(args.jobs) > 1:
+        return None
+    return writer
+
+
+def result_name(fn):
+    """A name for the output of input file `fn`, stable across runs."""
+    return hashlib.sha1(os.path.abspath(fn).encode()).hexdigest()[:16]
+
+
+def save_centro_result(fn, result):
+    """Save the output of `centro_image` to the ``.npz`` file `fn`."""
+    arrays = {}
+    for i, values in enumerate(result):
+        if isinstance(values, sketch.Histogram):
+            for name, array in values.state().items():
+                arrays['%i_%s' % (i, name)] = array
+        else:
+            arrays['%i' % i] = values
+    directory = os.path.dirname(os.path.abspath(fn))
+    fd, tmp = tempfile.mkstemp(suffix='.npz', prefix='.', dir=directory)
+    with os.fdopen(fd, 'wb') as fout:
+        np.savez(fout, **arrays)
+    os.replace(tmp, fn)
+
+
+def store_centro_result(record, fn, results_dir, result):
+    """Save the `result` of image `fn` and record it in the manifest."""
+    name = result_name(fn) + '.npz'
+    save_centro_result(os.path.join(results_dir, name), result)
+    record.record(fn, result=name)
+
+
+def load_centro_result(fn):
+    """Load an output of `centro_image` saved by `save_centro_result`."""
+    result = []
+    with np.load(fn) as data:
+        n = len(set(name.split('_')[0] for name in data.files))
+        for i in range(n):
+            if str(i) in data.files:
+                result.append(data[str(i)])
+            else:
+                prefix = '%i_' % i
+                state = {name[len(prefix):]: data[name]
+                         for name in data.files if name.startswith(prefix)}
+                result.append(sketch.Histogram.from_state(state))
+    return tuple(result)
+
+
+CENTRO_MODULES = ['cafe', 'adaptive', 'backends', 'channelstats',
+                  'morphology', 'runlength', 'sketch']
+
+
+def centro_results(process, filenames, args, session, writer):
+    """Compute `process` on each file, reusing results from `args.state_dir`.
+
+    Parameters
+    ----------
+    process : callable
+        The per-image function, returning the same as `centro_image`.
+    filenames : list of string
+        The input images.
+    args : argparse.Namespace
+        The parsed ``centro`` command line.
+    session : `profiling.Session`
+        The profiling session of the run.
+    writer : `batch.AsyncWriter`
+        The writer for the results saved in `args.state_dir`.
+
+    Returns
+    -------
+    results : iterable
+        The result of `process` on each file, in order.
+    """
+    load = functools.partial(load_image, channels=(0, 1, 2))
+    if args.state_dir is None:
+        return map_images(process, filenames, args, session, load)
+    results_dir = os.path.join(args.state_dir, 'results')
+    if not os.path.isdir(results_dir):
+        os.makedirs(results_dir)
+    # the options that change the results or the files written next to
+    # the inputs, so that changing them processes the images again
+    params = {'bins': args.bins if args.streaming else None,
+              'save_chromatin': args.save_chromatin,
+              'save_centromeres': args.save_centromeres,
+              'mask_format': args.mask_format,
+              'backends': backends.chosen()}
+    record = manifest.Manifest(os.path.join(args.state_dir, 'manifest.json'),
+                               params=params, modules=CENTRO_MODULES)
+    pending = record.pending(filenames)
+    computed = {}
+    for fn, result in zip(pending, map_images(process, pending, args,
+                                              session, load)):
+        computed[fn] = result
+        writer.submit(store_centro_result, record, fn, results_dir, result)
+    return [computed[fn] if fn in computed else
+            load_centro_result(os.path.join(results_dir,
+                                            record.get(fn)['result']))
+            for fn in filenames]
 
 
 def run_centro(args):
     """Run the program on some input images and produce statistics and plots.
 
+    Images are read and processed one at a time by `args.jobs` worker
+    processes, so memory use does not grow with the number of images.
+    With `args.state_dir`, only images that are new or have changed since
+    the last run are processed.
+
     Use `cafe -h` or `cafe --help` for options.
     """
-    test_images = [io.imread(fn) for fn in args.test_cases]
-    test_rnapii = it.chain(*[cafe.rnapii_centromere_vs_chromatin(im)
-                             for im in test_images])
-    control_images = [io.imread(fn) for fn in args.controls]
-    control_rnapii = it.chain(*[cafe.rnapii_centromere_vs_chromatin(im)
-                                for im in control_images])
-    if args.save_chromatin:
-        chromatin_image_fns = map(strip_extension,
-                                  args.test_cases + args.controls)
-        chromatin_images = [cafe.get_chromatin(im[..., 2]) for
-                            im in test_images + control_images]
-        for fn, im in zip(chromatin_image_fns, chromatin_images):
-            io.imsave(fn + '_chromatin.tif', 255 * im.astype(np.uint8))
-    if args.save_centromeres:
-        centromere_image_fns = map(strip_extension,
-                                   args.test_cases + args.controls)
-        centromere_images = [cafe.get_centromere_neighbourhood(im[..., 1]) for
-                             im in test_images + control_images]
-        for fn, im in zip(centromere_image_fns, centromere_images):
-            io.imsave(fn + '_centromere.tif', 255 * im.astype(np.uint8))
-
-    plt.boxplot(list(test_rnapii) + list(control_rnapii))
-    plt.savefig(args.output_file, bbox_inches='tight')
+    cache = None
+    if args.cache_dir is not None:
+        cache = maskcache.MaskCache(args.cache_dir,
+                                    int(args.cache_size * 2**20))
+    session = profiling.Session(args.profile is not None)
+    with session, batch.AsyncWriter(args.prefetch) as writer:
+        process = functools.partial(centro_image,
+                                    save_chromatin=args.save_chromatin,
+                                    save_centromeres=args.save_centromeres,
+                                    cache=cache,
+                                    bins=args.bins if args.streaming else None,
+                                    mask_format=args.mask_format,
+                                    writer=local_writer(args, writer))
+        results = list(centro_results(process,
+                                      args.test_cases + args.controls, args,
+                                      session, writer))
+        rnapii = list(it.chain(*results))
+
+        if args.stats is not None:
+            with profiling.stage('stats'):
+                writer.submit(centro_stats(results, args).to_csv,
+                              args.stats, index=False)
+
+        with profiling.stage('plot'):
+            from matplotlib import pyplot as plt
+            if args.streaming:
+                plt.gca().bxp([h.box_stats() for h in rnapii],
+                              showfliers=False)
+            else:
+                plt.boxplot(rnapii)
+            plt.savefig(args.output_file, bbox_inches='tight')
+    session.report(args.profile)
+
+
+def centro_stats(results, args):
+    """Compare test and control images for ``centro --stats``.
+
+    Parameters
+    ----------
+    results : list of tuple
+        The output of `centro_image` for the test images, then the
+        controls.
+    args : argparse.Namespace
+        The parsed ``centro`` command line.
+
+    Returns
+    -------
+    table : pandas DataFrame
+        One row, with the output of `significance.compare` on the
+        `significance.enrichment` of each image.
+    """
+    import pandas as pd
+    values = significance.enrichment(significance.image_summaries(results))
+    n_test = len(args.test_cases)
+    comparison = significance.compare(values[:n_test], values[n_test:],
+                                      args.resamples, seed=args.seed,
+                                      jobs=args.jobs)
+    return pd.DataFrame([comparison])
+
+
+INTERACTIVE_MODULES = ['interactive', 'stages', 'cafe', 'adaptive',
+                       'backends', 'channelstats', 'labelstats', 'morphology',
+                       'runlength']
 
 
 def run_interactive(args):
-    image_files_list = [sorted(filter(lambda x: x.lower().endswith('.tif'),
-                               os.listdir(d))) for d in args.directories]
-    images = [[mh.imread(os.path.join(d, im)) for im in image_files]
-              for image_files in image_files_list]
-    targets = [im[0] for im in images]
-    rgbs = [np.dstack([ims[2], ims[1], ims[3]]) for ims in images]
-    for s, target, rgb in zip(args.directories, targets, rgbs):
-        if rgb.shape[-1] == 9:
-            # some single channel images are written out as RGB...
-            rgb = rgb[:, :, ::3]
-            target = target[..., 0]
-        interactive.compute_spot_stats(rgb, target, s)
+    """Measure spots in each directory, skipping those already measured.
+
+    With `args.headless`, directories are segmented with the preset
+    parameters by `args.jobs` worker processes, and the viewer only opens
+    for the directories in `args.review`.
+    """
+    if args.headless and args.preset is None:
+        parser.error('--headless requires a --preset file')
+    params = interactive.load_preset(args.preset) if args.headless else None
+    review = set(os.path.abspath(d) for d in args.review)
+    pending = [d for d in args.directories if args.force or
+               os.path.abspath(d) in review or not directory_done(d, params)]
+    headless = [d for d in pending if params is not None and
+                os.path.abspath(d) not in review]
+    manual = [d for d in pending if d not in headless]
+    records = dict((d, snapshot_directory(d)) for d in pending)
+    session = profiling.Session(args.profile is not None)
+    with session, batch.AsyncWriter(args.prefetch) as writer:
+        process = functools.partial(measure_directory, params=params,
+                                    writer=local_writer(args, writer))
+        for d in map_images(process, headless, args, session,
+                            load_directory):
+            writer.submit(record_directory, records[d], d, params)
+        # read the next directory while the user works on the current one
+        load_modules()
+        loaded = batch.prefetch(load_directory, manual, args.prefetch)
+        for d, images in zip(manual, loaded):
+            with profiling.image(d):
+                measure_directory(d, preset_file=args.preset, writer=writer,
+                                  image=images,
+                                  preview_factor=args.preview_factor)
+            writer.submit(record_directory, records[d], d)
+    session.report(args.profile)
+
+
+def directory_images(d):
+    """The input images in directory `d`, in order."""
+    return [os.path.join(d, fn) for fn in sorted(os.listdir(d))
+            if fn.lower().endswith('.tif')]
+
+
+def directory_manifest(d):
+    """The manifest of the images measured in directory `d`."""
+    return manifest.Manifest(os.path.join(d, 'manifest.json'),
+                             modules=INTERACTIVE_MODULES)
+
+
+def directory_done(d, params=None):
+    """Whether directory `d` was measured and its images are unchanged.
+
+    If `params` is given, directories measured without the viewer, using
+    other parameters, are not done. Directories measured with the viewer
+    are never redone because of the parameters.
+    """
+    image_files = directory_images(d)
+    record = directory_manifest(d)
+    if (not os.path.exists(os.path.join(d, 'measure.txt')) or
+            record.pending(image_files)):
+        return False
+    return params is None or all(record.get(fn).get('preset') in
+                                 (None, params) for fn in image_files)
+
+
+def snapshot_directory(d):
+    """Open the manifest of directory `d`, and snapshot its images.
+
+    Call this before measuring `d`, and `record_directory` after.
+    """
+    record = directory_manifest(d)
+    for fn in directory_images(d):
+        record.snapshot(fn)
+    return record
+
+
+def record_directory(record, d, params=None):
+    """Record the images of `d` as measured, with `params` if headless.
+
+    Parameters
+    ----------
+    record : `manifest.Manifest`
+        The manifest of `d`, from `snapshot_directory`.
+    d : string
+        The measured directory.
+    params : dict, optional
+        The preset parameters of a headless measurement.
+    """
+    for fn in directory_images(d):
+        record.record(fn, preset=params)
+
+
+def grayscale(fn):
+    """Read a grayscale image, decoding only the first channel of RGB files.
+
+    Some single channel images are written out as RGB, with the same
+    values in each channel.
+    """
+    with imsource.ImageSource(fn) as source:
+        return np.array(source[..., 0] if source.ndim == 3 else source)
+
+
+def load_directory(d):
+    """Read the images of directory `d` for `interactive.compute_spot_stats`.
+
+    Parameters
+    ----------
+    d : string
+        A directory containing four .tif files: target, telomere,
+        centromere, and DAPI.
+
+    Returns
+    -------
+    rgb : array, shape (M, N, 3)
+        The centromere, telomere and DAPI channels.
+    target : array, shape (M, N)
+        The target channel.
+    """
+    images = [grayscale(fn) for fn in directory_images(d)]
+    return np.dstack([images[2], images[1], images[3]]), images[0]
+
+
+def measure_directory(d, params=None, preset_file=None, writer=None,
+                      image=None, preview_factor=None):
+    """Measure the spots in directory `d`.
+
+    Parameters
+    ----------
+    d : string
+        The input directory. See `load_directory`.
+    params, preset_file, writer, preview_factor : optional
+        See `interactive.compute_spot_stats`.
+    image : tuple of array, optional
+        The output of `load_directory`, if already read.
+
+    Returns
+    -------
+    d : string
+        The input directory.
+    """
+    if image is None:
+        with profiling.stage('read'):
+            image = load_directory(d)
+    rgb, target = image
+    interactive.compute_spot_stats(rgb, target, d, params, preset_file,
+                                   writer, preview_factor)
+    return d
+
+
+def trf_image(fn, image=None):
+    """Quantify the TRF1 blobs in a single image with `trf1.trf_quantify`."""
+    if image is None:
+        image = load_image(fn, (0, 2))
+    with image as im:
+        return trf1.trf_quantify(im)
+
+
+def write_trf_table(directory, name, table):
+    """Write a `trf_table` to a Parquet dataset directory atomically."""
+    tmp = os.path.join(directory, '.' + name)
+    table.to_parquet(tmp, index=False)
+    os.replace(tmp, os.path.join(directory, name))
+
+
+def trf_table(props, filename, condition, filenames, conditions):
+    """Build the output table of `run_trf` for one image.
+
+    Parameters
+    ----------
+    props : structured array
+        The output of `trf1.trf_quantify` on the image.
+    filename, condition : string
+        The filename and condition of the image.
+    filenames, conditions : list of string
+        All filenames and conditions of the run, used as categories of the
+        corresponding columns. They may contain duplicates.
+
+    Returns
+    -------
+    table : pandas DataFrame
+        One row per blob, with the filename, condition, and the columns of
+        `trf1.TRF_FIELDS`.
+    """
+    import pandas as pd
+    n = len(props)
+    table = pd.DataFrame({
+        'filename': pd.Categorical([filename] * n,
+                                   categories=unique(filenames)),
+        'condition': pd.Categorical([condition] * n,
+                                    categories=sorted(set(conditions)))})
+    for name, _ in trf1.TRF_FIELDS:
+        table[name] = props[name]
+    return table
+
+
+TRF_MODULES = ['trf1', 'backends', 'channelstats', 'labelstats',
+               'morphology']
+
+
+def unique(values):
+    """The distinct elements of `values`, in order of first occurrence."""
+    return list(collections.OrderedDict.fromkeys(values))
+
+
+def trf_part_name(fn, condition):
+    """The name of the `run_trf` output of image `fn` in `condition`."""
+    return 'part-%s.parquet' % result_name(fn + '\0' + condition)
+
+
+def remove_stale_parts(directory, names):
+    """Remove the Parquet parts in `directory` that aren't in `names`.
+
+    This includes the temporary files of writes that were interrupted.
+    """
+    for fn in os.listdir(directory):
+        if ((fn.startswith('part-') or fn.startswith('.part-')) and
+                fn not in names):
+            os.remove(os.path.join(directory, fn))
+
+
+def trf_pending(record, names, directory):
+    """The images whose `run_trf` output is missing or out of date.
+
+    Parameters
+    ----------
+    record : `manifest.Manifest`
+        The manifest of the output dataset.
+    names : dict of string to list of string
+        The part names of each image, from `trf_part_name`.
+    directory : string
+        The output dataset.
+
+    Returns
+    -------
+    pending : list of string
+        The images that changed, or whose parts were written for other
+        conditions or are missing.
+    """
+    return [fn for fn, fn_names in names.items()
+            if not record.is_current(fn) or
+            record.get(fn).get('results') != fn_names or
+            not all(os.path.exists(os.path.join(directory, name))
+                    for name in fn_names)]
+
+
+def run_trf(args):
+    """Quantify TRF1 blobs in condition-labelled images.
+
+    Each image's blob table is written to the output Parquet dataset as
+    soon as it is computed, and recorded in the dataset's manifest. Images
+    already in the dataset are skipped unless they have changed, so a rerun
+    adds new images to the dataset and an interrupted run resumes. Results
+    of images that no group matches any more are removed, so the dataset
+    always holds exactly the current images. An image matched by several
+    groups is quantified once, and written once for each condition. Load
+    the results with ``pd.read_parquet(args.output)``.
+    """
+    filenames, conditions = [], []
+    for condition, pattern in args.group:
+        fns = sorted(glob.glob(pattern))
+        filenames.extend(fns)
+        conditions.extend([condition] * len(fns))
+    parts = collections.OrderedDict()
+    for fn, condition in unique(zip(filenames, conditions)):
+        parts.setdefault(fn, []).append(condition)
+    names = collections.OrderedDict(
+                (fn, [trf_part_name(fn, c) for c in cs])
+                for fn, cs in parts.items())
+    if not os.path.isdir(args.output):
+        os.makedirs(args.output)
+    # files starting with '_' or '.' are ignored when reading the dataset
+    record = manifest.Manifest(os.path.join(args.output, '_manifest.json'),
+                               params={'backends': backends.chosen()},
+                               modules=TRF_MODULES)
+    record.retain(parts)
+    remove_stale_parts(args.output, set(it.chain(*names.values())))
+    pending = (list(parts) if args.force else
+               trf_pending(record, names, args.output))
+    for fn in pending:
+        record.snapshot(fn)
+    load = functools.partial(load_image, channels=(0, 2))
+    session = profiling.Session(args.profile is not None)
+    with session, batch.AsyncWriter(args.prefetch) as writer:
+        results = map_images(trf_image, pending, args, session, load)
+        for fn, props in zip(pending, results):
+            with profiling.image(fn), profiling.stage('write'):
+                for condition, name in zip(parts[fn], names[fn]):
+                    table = trf_table(props, fn, condition, filenames,
+                                      conditions)
+                    writer.submit(write_trf_table, args.output, name, table)
+                writer.submit(record.record, fn, results=names[fn])
+    session.report(args.profile)
+
+
+def sweep_image(fn, settings, centro_channel=0, telo_channel=1, image=None):
+    """Measure the segmentation of one image with `sweep.sweep_encode`."""
+    if image is None:
+        image = load_image(fn, (centro_channel, telo_channel))
+    with image as im, profiling.stage('sweep'):
+        rows = sweep.sweep_encode(im[..., centro_channel],
+                                  im[..., telo_channel], settings)
+    for row in rows:
+        row['filename'] = fn
+    return rows
+
+
+def run_sweep(args):
+    """Measure the segmentation of images over a grid of parameters.
+
+    The rows of each image are appended to the output table as soon as
+    the image is done.
+    """
+    import pandas as pd
+    params = dict(args.param)
+    settings = sweep.parameter_grid(params)
+    process = functools.partial(sweep_image, settings=settings,
+                                centro_channel=args.centro_channel,
+                                telo_channel=args.telo_channel)
+    load = functools.partial(load_image, channels=(args.centro_channel,
+                                                   args.telo_channel))
+    session = profiling.Session(args.profile is not None)
+    with session, batch.AsyncWriter(args.prefetch) as writer:
+        results = map_images(process, args.images, args, session, load)
+        for i, rows in enumerate(results):
+            table = pd.DataFrame(rows)
+            columns = ['filename'] + sorted(params)
+            table = table[columns + [c for c in table.columns
+                                     if c not in columns]]
+            writer.submit(table.to_csv, args.output,
+                          mode='w' if i == 0 else 'a', header=(i == 0),
+                          index=False)
+    session.report(args.profile)
+
+
+def run_calibrate(args):
+    """Choose the fastest backend for each operation, and report timings."""
+    shapes = args.shape or backends.CALIBRATION_SHAPES
+    output = args.output or backends.CHOICES_FILE
+    results = backends.calibrate(shapes, args.repeat, output)
+    for op, timings in results['timings'].items():
+        for name, seconds in timings.items():
+            if name in results['mismatches'].get(op, []):
+                note = 'different output, excluded'
+            else:
+                note = '%.4f s' % seconds
+            marker = '*' if results['choices'][op] == name else ' '
+            print('%-22s %s %-14s %s' % (op, marker, name, note))
+    print('Outputs checked against %s on: %s' %
+          (', '.join(sorted(set(backends.REFERENCE.values()))),
+           ', '.join('%s %s' % ('x'.join(map(str, shape)), dtype)
+                     for shape, dtype in results['validated'])))
+    print('Choices saved to %s' % output)
+
+
+def run_submit(args):
+    """Run a command on a `cafe serve` server, and exit with its status."""
+    if not args.command:
+        submitter.error('no command given')
+    try:
+        status = daemon.submit(args.command, args.socket)
+    except (IOError, OSError) as e:
+        sys.exit('cafe: cannot reach a server on %s (%s); start one with '
+                 '`cafe serve`' % (args.socket, e))
+    sys.exit(status)
 
 
 if __name__ == '__main__':
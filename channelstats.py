@@ -0,0 +1,227 @@
+"""Single-pass global statistics of image channels.
+
+For integer images, one ``np.bincount`` over a channel gives its histogram,
+from which the minimum, maximum, Otsu threshold, and intensity rescaling
+lookup tables all follow without any further pass over the pixels or any
+floating point copy of the image.
+"""
+
+import numpy as np
+
+
+class ChannelStats(object):
+    """The minimum, maximum, and histogram of one image channel.
+
+    The histogram follows the conventions of ``skimage.exposure.histogram``:
+    integer images have one bin per value from `min` to `max`, while
+    floating point images have `nbins` bins spanning that range.
+
+    Attributes
+    ----------
+    min, max : scalar
+        The smallest and largest values in the channel.
+    hist : array of int
+        The histogram counts.
+    bin_centers : array
+        The value at the center of each bin.
+    """
+    def __init__(self, min, max, hist, bin_centers):
+        self.min = min
+        self.max = max
+        self.hist = hist
+        self.bin_centers = bin_centers
+
+    @property
+    def is_integer(self):
+        return np.issubdtype(self.bin_centers.dtype, np.integer)
+
+    def merge(self, other):
+        """Combine the statistics of two parts of an integer image.
+
+        Parameters
+        ----------
+        other : `ChannelStats`
+            The statistics of another part of the same image.
+
+        Returns
+        -------
+        merged : `ChannelStats`
+            The statistics of both parts together.
+        """
+        if not (self.is_integer and other.is_integer):
+            raise ValueError('Only histograms of integer images have fixed '
+                             'bins and can be merged.')
+        lo, hi = min(self.min, other.min), max(self.max, other.max)
+        hist = np.zeros(int(hi) - int(lo) + 1, dtype=np.int64)
+        for s in (self, other):
+            start = int(s.min) - int(lo)
+            hist[start:start + len(s.hist)] += s.hist
+        return ChannelStats(lo, hi, hist,
+                            np.arange(int(lo), int(hi) + 1))
+
+
+def _unsigned_view(image):
+    """View a signed integer image as unsigned, preserving the order.
+
+    Returns the view and the value subtracted from the image.
+    """
+    if image.dtype.kind == 'u' or image.dtype == bool:
+        return image, 0
+    bits = 8 * image.dtype.itemsize
+    unsigned = image.view('u%i' % image.dtype.itemsize)
+    return unsigned ^ np.array(1 << (bits - 1), unsigned.dtype), \
+        -(1 << (bits - 1))
+
+
+def channel_stats(image, nbins=256):
+    """Compute the minimum, maximum, and histogram of a channel.
+
+    8- and 16-bit integer images need a single pass over the pixels.
+
+    Parameters
+    ----------
+    image : array
+        A single image channel.
+    nbins : int, optional
+        The number of bins for floating point images.
+
+    Returns
+    -------
+    stats : `ChannelStats`
+        The channel statistics.
+    """
+    image = np.asarray(image)
+    if image.dtype == bool or (image.dtype.kind in 'iu' and
+                               image.dtype.itemsize <= 2):
+        values, offset = _unsigned_view(image)
+        counts = np.bincount(values.ravel())
+        nonzero = np.flatnonzero(counts)
+        lo, hi = nonzero[0], nonzero[-1]
+        hist = counts[lo:hi + 1]
+        lo, hi = int(lo) + offset, int(hi) + offset
+        return ChannelStats(lo, hi, hist, np.arange(lo, hi + 1))
+    lo, hi = image.min(), image.max()
+    if image.dtype.kind in 'iu':
+        hist = np.bincount((image.ravel() - lo).astype(np.intp))
+        return ChannelStats(lo, hi, hist,
+                            np.arange(int(lo), int(hi) + 1))
+    hist, bin_edges = np.histogram(image, bins=nbins, range=(lo, hi))
+    bin_centers = (bin_edges[:-1] + bin_edges[1:]) / 2.
+    return ChannelStats(lo, hi, hist, bin_centers)
+
+
+def image_stats(image, nbins=256):
+    """Compute `channel_stats` for each channel of a multichannel image.
+
+    Parameters
+    ----------
+    image : array, shape (..., C)
+        The input image, with channels along the last axis.
+    nbins : int, optional
+        The number of bins for floating point images.
+
+    Returns
+    -------
+    stats : list of `ChannelStats`
+        The statistics of each channel.
+    """
+    return [channel_stats(image[..., c], nbins)
+            for c in range(image.shape[-1])]
+
+
+def threshold_otsu_histogram(hist, bin_centers):
+    """Compute Otsu's threshold from a precomputed image histogram.
+
+    This gives the same result as ``threshold_otsu`` on the image, when
+    `hist` and `bin_centers` are the output of
+    ``skimage.exposure.histogram`` on that image.
+
+    Parameters
+    ----------
+    hist : array of int
+        The histogram counts.
+    bin_centers : array of float
+        The center value of each histogram bin.
+
+    Returns
+    -------
+    threshold : float
+        Pixels with values above this threshold are foreground.
+
+    Raises
+    ------
+    ValueError
+        If the image has a single value, so no threshold separates it.
+    """
+    if np.count_nonzero(hist) < 2:
+        raise ValueError("Otsu's threshold is undefined for an image with "
+                         "a single value.")
+    hist = hist.astype(float)
+    # class probabilities for all possible thresholds
+    weight1 = np.cumsum(hist)
+    weight2 = np.cumsum(hist[::-1])[::-1]
+    # class means for all possible thresholds
+    mean1 = np.cumsum(hist * bin_centers) / weight1
+    mean2 = (np.cumsum((hist * bin_centers)[::-1]) / weight2[::-1])[::-1]
+    # between-class variance for each threshold
+    variance12 = weight1[:-1] * weight2[1:] * (mean1[:-1] - mean2[1:]) ** 2
+    idx = np.argmax(variance12)
+    threshold = bin_centers[:-1][idx]
+    return threshold
+
+
+def threshold_otsu(image, nbins=256):
+    """Compute Otsu's threshold with a single pass over an integer image.
+
+    A drop-in replacement for ``skimage.filter.threshold_otsu``.
+
+    Parameters
+    ----------
+    image : array or `ChannelStats`
+        The input image, or its precomputed statistics.
+    nbins : int, optional
+        The number of bins for floating point images.
+
+    Returns
+    -------
+    threshold : float
+        Pixels with values above this threshold are foreground.
+    """
+    stats = image
+    if not isinstance(stats, ChannelStats):
+        stats = channel_stats(image, nbins)
+    return threshold_otsu_histogram(stats.hist, stats.bin_centers)
+
+
+def rescale_to_uint8(image, stats=None):
+    """Stretch each channel of an image to the full uint8 range.
+
+    Integer channels are converted with a lookup table built from the
+    channel range, rather than through a floating point copy.
+
+    Parameters
+    ----------
+    image : array, shape (..., C)
+        The input image.
+    stats : list of `ChannelStats`, optional
+        Precomputed statistics of each channel.
+
+    Returns
+    -------
+    image8 : array of uint8, shape (..., C)
+        The rescaled image, with each channel's minimum at 0 and maximum at
+        255.
+    """
+    if stats is None:
+        stats = image_stats(image)
+    image8 = np.empty(image.shape, np.uint8)
+    for c, s in enumerate(stats):
+        channel = image[..., c]
+        if s.is_integer and s.min >= 0:
+            values = np.arange(int(s.max) + 1, dtype=float)
+            lut = ((values - s.min) * 255 / (s.max - s.min)).astype(np.uint8)
+            image8[..., c] = lut[channel]
+        else:
+            image8[..., c] = ((channel.astype(float) - s.min) * 255 /
+                              (s.max - s.min)).astype(np.uint8)
+    return image8
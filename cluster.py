@@ -0,0 +1,250 @@
+"""Process collections of images on a dask cluster.
+
+Each image is one task. Workers are sent filenames, not pixels: they open
+their images with `imsource.ImageSource`, read only the channels that are
+used, and send back results or small tables. As tasks are independent and
+only results cross the network, throughput grows with the number of
+workers, until the file system saturates.
+
+dask is an optional dependency, only needed by this module::
+
+    client = cluster.connect(n_workers=4)  # or connect('tcp://host:8786')
+    table = cluster.trf_dataframe(client, [('kd', kd_files),
+                                           ('con', control_files)])
+"""
+
+import numpy as np
+import pandas as pd
+try:
+    from dask.distributed import Client
+except ImportError:
+    Client = None
+
+import batch
+import cafe
+import imsource
+import sweep
+import trf1
+
+
+def connect(scheduler=None, n_workers=None):
+    """Connect to a dask scheduler, or start a local cluster.
+
+    Parameters
+    ----------
+    scheduler : string, optional
+        The address of a running scheduler, e.g. 'tcp://10.0.0.1:8786'.
+        Default: start a local cluster, which is closed with the client.
+    n_workers : int, optional
+        The number of worker processes of a local cluster, each running
+        one task at a time. Default: one per CPU.
+
+    Returns
+    -------
+    client : dask.distributed.Client
+        The client, which can be used as a context manager.
+    """
+    if Client is None:
+        raise ImportError('Distributed execution requires dask: '
+                          'pip install "dask[distributed]"')
+    if scheduler is not None:
+        return Client(scheduler)
+    return Client(n_workers=n_workers, threads_per_worker=1)
+
+
+def _apply(func, filename, preload, kwargs):
+    """Run ``func(image, **kwargs)`` on the image in `filename`."""
+    with imsource.ImageSource(filename) as image:
+        if preload is not None:
+            image.preload(preload)
+        return func(image, **kwargs)
+
+
+def submit_images(client, func, filenames, preload=None, **kwargs):
+    """Submit one task per image to the cluster.
+
+    Parameters
+    ----------
+    client : dask.distributed.Client
+        The cluster client.
+    func : callable
+        A picklable function of a multichannel image, such as
+        `trf1.trf_quantify`, called as ``func(image, **kwargs)``. The
+        image is an `imsource.ImageSource`, opened on the worker.
+    filenames : list of string
+        The images.
+    preload : list of int, optional
+        Read these channels into memory before calling `func`. Default:
+        read what `func` uses, when it uses it.
+    **kwargs : keyword arguments
+        Passed to `func`.
+
+    Returns
+    -------
+    futures : list of dask.distributed.Future
+        The result of each task, in the order of `filenames`.
+    """
+    return [client.submit(_apply, func, fn, preload, kwargs)
+            for fn in filenames]
+
+
+def map_images(func, filenames, scheduler=None, n_workers=None,
+               max_in_flight=None):
+    """Map a function of a filename over images on a cluster.
+
+    This is `batch.bounded_map` on a dask cluster: at most
+    `max_in_flight` images are submitted but not yet yielded.
+
+    Parameters
+    ----------
+    func : callable
+        A picklable function of one filename.
+    filenames : list of string
+        The images.
+    scheduler, n_workers : optional
+        See `connect`.
+    max_in_flight : int, optional
+        Default: twice the number of worker threads.
+
+    Yields
+    ------
+    result : any
+        ``func(fn)`` for each filename, in order.
+    """
+    with connect(scheduler, n_workers) as client:
+        if max_in_flight is None:
+            max_in_flight = 2 * sum(client.nthreads().values())
+        for result in batch.bounded_map(func, filenames,
+                                        max_in_flight=max_in_flight,
+                                        executor=client):
+            yield result
+
+
+def gather_table(client, futures, filenames, conditions=None):
+    """Gather per-image results into a single table.
+
+    Parameters
+    ----------
+    client : dask.distributed.Client
+        The cluster client.
+    futures : list of dask.distributed.Future
+        Tasks returning a structured array, list of dicts, or anything
+        else accepted by ``pd.DataFrame``, one row per measurement.
+    filenames : list of string
+        The image of each task. An image may appear several times.
+    conditions : list of string, optional
+        The condition of each task.
+
+    Returns
+    -------
+    table : pandas DataFrame
+        The rows of all images, with a categorical 'filename' column
+        first, followed by a categorical 'condition' column if
+        `conditions` is given.
+    """
+    tables = []
+    for i, (fn, result) in enumerate(zip(filenames,
+                                         client.gather(futures))):
+        table = pd.DataFrame(result)
+        table.insert(0, 'filename', fn)
+        if conditions is not None:
+            table.insert(1, 'condition', conditions[i])
+        tables.append(table)
+    table = pd.concat(tables, ignore_index=True)
+    table['filename'] = pd.Categorical(table['filename'],
+                                       categories=pd.unique(
+                                           pd.Series(filenames)))
+    if conditions is not None:
+        table['condition'] = pd.Categorical(table['condition'],
+                                            categories=sorted(
+                                                set(conditions)))
+    return table
+
+
+def trf_dataframe(client, groups):
+    """Quantify the TRF1 blobs in groups of images.
+
+    Parameters
+    ----------
+    client : dask.distributed.Client
+        The cluster client.
+    groups : list of (string, list of string)
+        The condition and filenames of each group of images.
+
+    Returns
+    -------
+    table : pandas DataFrame
+        One row per blob, with the filename, condition, and the columns
+        of `trf1.TRF_FIELDS`, as written by ``cafe trf``.
+    """
+    filenames, conditions = [], []
+    for condition, fns in groups:
+        filenames.extend(fns)
+        conditions.extend([condition] * len(fns))
+    futures = submit_images(client, trf1.trf_quantify, filenames,
+                            preload=[0, 2])
+    return gather_table(client, futures, filenames, conditions)
+
+
+def _rnapii_summary(image, **params):
+    values = cafe.rnapii_centromere_vs_chromatin(image, **params)
+    return [{'region': region, 'n': len(v), 'mean': np.mean(v),
+             'std': np.std(v), 'median': np.median(v)}
+            for region, v in zip(['centromere', 'chromatin'], values)]
+
+
+def rnapii_dataframe(client, filenames, **params):
+    """Summarise `cafe.rnapii_centromere_vs_chromatin` over images.
+
+    Parameters
+    ----------
+    client : dask.distributed.Client
+        The cluster client.
+    filenames : list of string
+        The 3-channel images.
+    **params : keyword arguments
+        Passed to `cafe.rnapii_centromere_vs_chromatin`.
+
+    Returns
+    -------
+    table : pandas DataFrame
+        For each image and region ('centromere' or 'chromatin'), the
+        number of pixels and the mean, standard deviation and median of
+        the RNA Pol II channel.
+    """
+    futures = submit_images(client, _rnapii_summary, filenames, **params)
+    return gather_table(client, futures, filenames)
+
+
+def _encode_summary(image, centro_channel, telo_channel, **params):
+    encoded = cafe.encode_centro_telomeres(image[..., centro_channel],
+                                           image[..., telo_channel], **params)
+    return [sweep.encode_measures(encoded)]
+
+
+def encode_dataframe(client, filenames, centro_channel=0, telo_channel=1,
+                     **params):
+    """Summarise `cafe.encode_centro_telomeres` over images.
+
+    Parameters
+    ----------
+    client : dask.distributed.Client
+        The cluster client.
+    filenames : list of string
+        The multichannel images.
+    centro_channel, telo_channel : int, optional
+        The centromere and telomere channels.
+    **params : keyword arguments
+        Passed to `cafe.encode_centro_telomeres`.
+
+    Returns
+    -------
+    table : pandas DataFrame
+        One row per image, with the measurements of
+        `sweep.encode_measures`.
+    """
+    futures = submit_images(client, _encode_summary, filenames,
+                            [centro_channel, telo_channel],
+                            centro_channel=centro_channel,
+                            telo_channel=telo_channel, **params)
+    return gather_table(client, futures, filenames)
@@ -0,0 +1,175 @@
+"""Run cafe commands in a warm server process, over a local Unix socket.
+
+Starting Python and importing numpy, scikit-image, mahotas and matplotlib
+takes seconds, more than processing a single image. ``cafe serve`` imports
+them once and waits for commands; ``cafe submit centro ...`` sends a
+command line to it. The server runs each command in a child forked from
+itself, with the imports already done, in the working directory of the
+submitting process. The child's standard output and error are streamed
+back, followed by its exit status. Worker processes started by the
+command (``-j``) are forked from the warm child in turn.
+
+The protocol is one JSON line from the client, ``{"argv": [...], "cwd":
+"..."}``, answered by the output of the command, a NUL byte, and the exit
+status in decimal.
+
+This module only uses the standard library, so that submitting is fast.
+"""
+
+import os
+import sys
+import json
+import socket
+import tempfile
+import traceback
+import socketserver
+
+
+SOCKET = os.environ.get('CAFE_SOCKET',
+                        os.path.join(tempfile.gettempdir(),
+                                     'cafe-%i.sock' % os.getuid()))
+
+# modules imported by the server before accepting commands. The viewer
+# used by ``cafe interactive`` without ``--headless`` is not preloaded.
+WARM_MODULES = ['numpy', 'scipy.ndimage', 'pandas', 'matplotlib.pyplot',
+                'skimage.morphology', 'mahotas.io', 'cafe', 'backends',
+                'imsource', 'maskcache', 'runlength', 'sketch', 'stages',
+                'sweep', 'trf1', 'labelstats', 'channelstats']
+
+_END = b'\0'
+
+
+def warm_up(modules=WARM_MODULES):
+    """Import `modules` in this process."""
+    import importlib
+    import matplotlib
+    matplotlib.use('Agg')  # the server has no display
+    for name in modules:
+        importlib.import_module(name)
+
+
+def run(argv, cwd):
+    """Run a cafe command line in `cwd`, returning its exit status."""
+    import cafe_main
+    try:
+        os.chdir(cwd)
+        cafe_main.main(['cafe'] + list(argv))
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            return e.code or 0
+        sys.stderr.write('%s\n' % e.code)
+        return 1
+    except Exception:
+        traceback.print_exc()
+        return 1
+    return 0
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        # this runs in a child process forked for the request
+        request = json.loads(self.rfile.readline().decode())
+        sys.stdout.flush()
+        sys.stderr.flush()
+        fd = self.connection.fileno()
+        os.dup2(fd, 1)
+        os.dup2(fd, 2)
+        status = run(request['argv'], request['cwd'])
+        sys.stdout.flush()
+        sys.stderr.flush()
+        self.wfile.write(_END + str(status).encode())
+
+
+class _Server(socketserver.ForkingMixIn, socketserver.UnixStreamServer):
+    pass
+
+
+def serve(path=SOCKET, modules=WARM_MODULES):
+    """Accept cafe commands on a Unix socket until interrupted.
+
+    Parameters
+    ----------
+    path : string, optional
+        The socket file. It is only accessible by the current user.
+    modules : list of string, optional
+        The modules to import before accepting commands.
+    """
+    if os.path.exists(path):
+        try:
+            connect(path).close()
+        except (IOError, OSError):
+            os.remove(path)  # left over by a server that was killed
+        else:
+            raise RuntimeError('A cafe server is already running on %s'
+                               % path)
+    warm_up(modules)
+    umask = os.umask(0o177)
+    try:
+        server = _Server(path, _Handler)
+    finally:
+        os.umask(umask)
+    sys.stderr.write('cafe server ready on %s\n' % path)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(path)
+
+
+def connect(path=SOCKET):
+    """Connect to the server listening on `path`."""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except (IOError, OSError):
+        sock.close()
+        raise
+    return sock
+
+
+def submit(argv, path=SOCKET, stream=None):
+    """Run a cafe command line on the server, streaming its output.
+
+    Parameters
+    ----------
+    argv : list of string
+        The command line, without the program name, e.g.
+        ``['centro', '-t', 'kd.tif', '-c', 'con.tif']``.
+    path : string, optional
+        The server socket.
+    stream : binary file, optional
+        Where to write the output of the command. Default: standard
+        output.
+
+    Returns
+    -------
+    status : int
+        The exit status of the command.
+    """
+    if stream is None:
+        stream = getattr(sys.stdout, 'buffer', sys.stdout)
+    sock = connect(path)
+    with sock:
+        request = {'argv': list(argv), 'cwd': os.getcwd()}
+        sock.sendall(json.dumps(request).encode() + b'\n')
+        tail = b''
+        while True:
+            data = sock.recv(65536)
+            if not data:
+                break
+            data = tail + data
+            # hold back a possible status until the connection closes
+            end = data.rfind(_END)
+            if end < 0:
+                stream.write(data)
+                tail = b''
+            else:
+                stream.write(data[:end])
+                tail = data[end:]
+            stream.flush()
+    if not tail:
+        raise IOError('The cafe server closed the connection without '
+                      'reporting a status.')
+    return int(tail[1:])
@@ -0,0 +1,166 @@
+"""Lazy, channel-selective access to multichannel image files.
+
+An `ImageSource` opens a file without reading its pixels. Indexing it with
+``source[..., c]``, as the functions in `cafe` and `trf1` do, reads only
+channel ``c``:
+
+- uncompressed TIFF files are memory-mapped, so a channel is a view of the
+  file, and the operating system reads only the pages that are used;
+- TIFF files with one channel per page decode only that page;
+- other files are decoded in full, once, on first access.
+
+Closing the source (or leaving its ``with`` block) releases the file and
+all decoded data. `ImageSource.preload` reads the channels a computation
+will need into memory ahead of time, e.g. on a prefetching thread.
+"""
+
+import os
+
+import numpy as np
+
+try:
+    from skimage.external import tifffile
+except ImportError:
+    import tifffile
+from mahotas import io
+
+
+def _is_tiff(filename):
+    return os.path.splitext(filename)[1].lower() in ('.tif', '.tiff')
+
+
+class ImageSource(object):
+    """A multichannel image file, read on demand.
+
+    The image is presented with channels along the last axis, shape
+    (M, N[, P], C), whatever its layout in the file. A TIFF file of 2D
+    pages is read as one channel per page; use `volume.TiffStack` for
+    z-stacks.
+
+    Parameters
+    ----------
+    filename : string
+        The image file.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self._tif = None
+        self._data = None  # a memory map or decoded array, if any
+        self._channels = {}
+        self._channel_axis = -1
+        if _is_tiff(filename):
+            self._tif = tifffile.TiffFile(filename)
+            series = self._tif.series[0]
+            shape, self.dtype = tuple(series.shape), np.dtype(series.dtype)
+            pages = len(self._tif.pages)
+            if pages > 1 and pages == shape[0] and len(shape) == 3:
+                # one channel per page
+                self._channel_axis = 0
+                shape = shape[1:] + shape[:1]
+            self.shape = shape
+            try:
+                self._data = tifffile.memmap(filename, mode='r')
+            except (AttributeError, ValueError):
+                pass  # compressed or fragmented: decode on demand
+        else:
+            self._data = io.imread(filename)
+            self.shape, self.dtype = self._data.shape, self._data.dtype
+        self.ndim = len(self.shape)
+
+    @property
+    def memory_mapped(self):
+        return isinstance(self._data, np.memmap)
+
+    def channel(self, c):
+        """Return channel `c` of the image, reading as little as possible.
+
+        Parameters
+        ----------
+        c : int
+            The channel index.
+
+        Returns
+        -------
+        image : array
+            The channel. For memory-mapped files, it is a read-only view
+            of the file.
+        """
+        if self.ndim == 2:
+            if c not in (0, -1):
+                raise IndexError('single channel image has no channel %i' % c)
+            c = 0
+        else:
+            c = range(self.shape[-1])[c]
+        if c in self._channels:
+            return self._channels[c]
+        if self.ndim == 2:
+            return self._full()
+        if self._data is None and self._channel_axis == 0:
+            self._check_open()
+            self._channels[c] = self._tif.pages[c].asarray()
+            return self._channels[c]
+        data = self._full() if self._data is None else self._data
+        return data[c] if self._channel_axis == 0 else data[..., c]
+
+    def preload(self, channels=None):
+        """Read some channels into memory, and release the file.
+
+        Parameters
+        ----------
+        channels : list of int, optional
+            The channels to read. Default: all of them. Only these
+            channels can be accessed afterwards.
+
+        Returns
+        -------
+        self : `ImageSource`
+            The source itself, for use as ``ImageSource(fn).preload()``.
+        """
+        if channels is None:
+            channels = range(self.shape[-1]) if self.ndim > 2 else [0]
+        for c in channels:
+            self._channels[c] = np.array(self.channel(c))
+        self._data = None
+        if self._tif is not None:
+            self._tif.close()
+            self._tif = None
+        return self
+
+    def _check_open(self):
+        if self._tif is None:
+            raise ValueError('%s is closed, or only some of its channels '
+                             'were preloaded' % self.filename)
+
+    def _full(self):
+        """The whole image, decoding it if necessary."""
+        if self._data is None:
+            self._check_open()
+            self._data = self._tif.asarray()
+        if self._channel_axis == 0 and self.ndim > 2:
+            return np.moveaxis(self._data, 0, -1)
+        return self._data
+
+    def __getitem__(self, key):
+        if (isinstance(key, tuple) and len(key) == 2 and
+                key[0] is Ellipsis and isinstance(key[1], (int, np.integer))):
+            return self.channel(key[1])
+        return self._full()[key]
+
+    def __array__(self, dtype=None):
+        if self.ndim == 2:
+            return np.asarray(self.channel(0), dtype=dtype)
+        return np.asarray(self._full(), dtype=dtype)
+
+    def close(self):
+        """Release the file and all decoded data."""
+        self._channels.clear()
+        self._data = None
+        if self._tif is not None:
+            self._tif.close()
+            self._tif = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -1,63 +1,236 @@
 import os
+import json
 import numpy as np
-from scipy import ndimage as nd
 import mahotas as mh
 from skimage.viewer.plugins.overlayplugin import OverlayPlugin
-from skimage.viewer.widgets import Slider
+from skimage.viewer.widgets import Slider, Button
 from skimage import viewer
 from skimage import segmentation as seg
-from skimage import measure
+import backends
 import cafe
+import channelstats
+import labelstats
+import profiling
+import stages
 
 
-def encode(im, **kwargs):
-    if kwargs.has_key('alpha'):
-        a = kwargs['alpha']
-        del kwargs['alpha']
-    else:
-        a = 100
-    ov = cafe.encode_centro_telomeres_multichannel(im, **kwargs)
+# the starting values of the CentroPlugin sliders
+DEFAULT_PRESET = {'centro_min_size': 10, 'centro_radius': 10,
+                  'telo_offset': 0.0, 'telo_adapt_radius': 49,
+                  'telo_open_radius': 4}
+
+
+def load_preset(filename=None):
+    """Load segmentation parameters saved by `save_preset`.
+
+    Parameters
+    ----------
+    filename : string, optional
+        The preset file. If None, or if it doesn't exist, the default
+        slider values of `CentroPlugin` are returned.
+
+    Returns
+    -------
+    params : dict
+        Keyword arguments to `cafe.encode_centro_telomeres`.
+    """
+    params = dict(DEFAULT_PRESET)
+    if filename is not None and os.path.exists(filename):
+        with open(filename) as fin:
+            params.update(json.load(fin))
+    return params
+
+
+def save_preset(filename, params):
+    """Save segmentation parameters to a JSON preset file."""
+    with open(filename, 'w') as fout:
+        json.dump(params, fout, indent=1, sort_keys=True)
+
+
+def display_overlay(ov, alpha=100):
+    """Convert `cafe.encode_centro_telomeres` output to an overlay image."""
+    a = alpha
     return (a * (ov > 0) + int(a * 0.42) * ov).astype(np.uint8)
 
 
+def downsample_params(params, factor):
+    """Scale segmentation parameters for an image downsampled by `factor`.
+
+    Parameters
+    ----------
+    params : dict
+        Keyword arguments to `cafe.encode_centro_telomeres`.
+    factor : int
+        The downsampling factor along each axis.
+
+    Returns
+    -------
+    scaled : dict
+        The parameters with sizes and radii scaled to the smaller image.
+    """
+    scaled = dict(params)
+    for name in ['centro_radius', 'telo_open_radius']:
+        if name in scaled:
+            scaled[name] = int(round(scaled[name] / float(factor)))
+    if 'centro_min_size' in scaled:
+        scaled['centro_min_size'] = int(round(scaled['centro_min_size'] /
+                                              float(factor ** 2)))
+    if 'telo_adapt_radius' in scaled:
+        # keep the block size odd, as for the full size image
+        scaled['telo_adapt_radius'] = max(
+            int(round(scaled['telo_adapt_radius'] / float(factor))) | 1, 3)
+    return scaled
+
+
 class CentroPlugin(OverlayPlugin):
+    """Interactively segment centromeres and telomeres.
+
+    Intermediate results of the segmentation are cached, so that moving
+    a slider only recomputes the stages that depend on it.
+
+    Parameters
+    ----------
+    preview_factor : int, optional
+        If given, while a slider is being dragged, show the segmentation
+        of the image downsampled by this factor, and compute the full
+        resolution segmentation when the slider is released.
+    preset_file : string, optional
+        The sliders start from the parameters in this file, if it exists,
+        and a "Save preset" button writes the current parameters to it,
+        for use with `compute_spot_stats` without the GUI.
+    """
     def __init__(self, *args, **kwargs):
-        super(CentroPlugin, self).__init__(image_filter=encode, **kwargs)
+        self.preview_factor = kwargs.pop('preview_factor', None)
+        self.preset_file = kwargs.pop('preset_file', None)
+        self._image = None
+        self._stages = self._preview_stages = None
+        super(CentroPlugin, self).__init__(image_filter=self.encode, **kwargs)
+
+    def _sliders(self):
+        return [w for w in self.keyword_arguments.values()
+                if isinstance(w, Slider)]
+
+    def _dragging(self):
+        return any(w.slider.isSliderDown() for w in self._sliders())
+
+    def params(self):
+        """The segmentation parameters currently set by the sliders."""
+        return {name: w.val for name, w in self.keyword_arguments.items()
+                if name in DEFAULT_PRESET}
+
+    def save_preset(self):
+        save_preset(self.preset_file, self.params())
+
+    def encode(self, im, **kwargs):
+        a = kwargs.pop('alpha', 100)
+        if im is not self._image:
+            self._image = im
+            self._stages = stages.EncodeStages(im[..., 0], im[..., 1])
+            self._preview_stages = None
+        if self.preview_factor is not None and self._dragging():
+            f = self.preview_factor
+            if self._preview_stages is None:
+                small = im[::f, ::f]
+                self._preview_stages = stages.EncodeStages(small[..., 0],
+                                                           small[..., 1])
+            ov = self._preview_stages.encode(**downsample_params(kwargs, f))
+            ov = np.repeat(np.repeat(ov, f, axis=0), f, axis=1)
+            ov = ov[:im.shape[0], :im.shape[1]]
+        else:
+            ov = self._stages.encode(**kwargs)
+        return display_overlay(ov, a)
 
     def attach(self, image_viewer):
-        self.add_widget(Slider('alpha', 0, 100, value=100, value_type='int'))
+        update_on = 'release' if self.preview_factor is None else 'move'
+        preset = load_preset(self.preset_file)
+        self.add_widget(Slider('alpha', 0, 100, value=100, value_type='int',
+                               update_on=update_on))
         self.add_widget(Slider('centro_min_size', 0, 100,
-                                value=10, value_type='int'))
+                                value=preset['centro_min_size'],
+                                value_type='int', update_on=update_on))
         self.add_widget(Slider('centro_radius', 0, 100,
-                                value=10, value_type='int'))
-        self.add_widget(Slider('telo_offset', -10, 10, value=0))
+                                value=preset['centro_radius'],
+                                value_type='int', update_on=update_on))
+        self.add_widget(Slider('telo_offset', -10, 10,
+                               value=preset['telo_offset'],
+                               update_on=update_on))
         self.add_widget(Slider('telo_adapt_radius', 0, 101,
-                                value=49, value_type='int'))
+                                value=preset['telo_adapt_radius'],
+                                value_type='int', update_on=update_on))
         self.add_widget(Slider('telo_open_radius', 0, 20,
-                                value=4, value_type='int'))
+                                value=preset['telo_open_radius'],
+                                value_type='int', update_on=update_on))
+        if self.preset_file is not None:
+            self.add_widget(Button('Save preset', self.save_preset))
+        if self.preview_factor is not None:
+            # the last move event is computed at preview resolution
+            for w in self._sliders():
+                w.slider.sliderReleased.connect(self.filter_image)
         super(CentroPlugin, self).attach(image_viewer)
 
 
-def compute_spot_stats(image, target, directory):
-    if image.dtype != np.uint8:
-        channel_mins = image.min(axis=0).min(axis=0)[np.newaxis, np.newaxis, :]
-        channel_maxs = image.max(axis=0).max(axis=0)[np.newaxis, np.newaxis, :]
-        image = ((image.astype(float) - channel_mins) * 255 /
-                 (channel_maxs - channel_mins)).astype(np.uint8)
-    v = viewer.ImageViewer(image)
-    v += CentroPlugin()
-    overlay = v.show()[0][0]
-    overlay = seg.relabel_sequential(overlay)[0]
-    mask = (overlay == 1)
-    objects = nd.label(mask)[0]
-    property_names = (['size', 'mean'] +
-                      ['quantile-%i' % i for i in [5, 25, 50, 75, 95]])
-    props = [np.concatenate(([prop.area, prop.mean_intensity], prop.quantiles))
-             for prop in measure.regionprops(objects, intensity_image=target)]
-    props = np.array(props)
+def write_spot_stats(directory, props, property_names, overlay):
+    """Write the output files of `compute_spot_stats`."""
     fout_txt = os.path.join(directory, 'measure.txt')
     np.savetxt(fout_txt, props, fmt='%.2f', delimiter='\t',
                header='\t'.join(property_names))
     fout_im = os.path.join(directory, 'mask.png')
     mh.imsave(fout_im, 64 * overlay.astype(np.uint8))
 
+
+def compute_spot_stats(image, target, directory, params=None,
+                       preset_file=None, writer=None, preview_factor=None):
+    """Segment spots and measure the target channel in them.
+
+    Writes the measurements to ``measure.txt``, and the segmentation to
+    ``mask.png``, in `directory`.
+
+    Parameters
+    ----------
+    image : array, shape (M, N, 3)
+        The image to segment, with centromeres in channel 0 and telomeres
+        in channel 1.
+    target : array, shape (M, N)
+        The channel to measure.
+    directory : string
+        The output directory.
+    params : dict, optional
+        Segmentation parameters, e.g. from `load_preset`. If given, the
+        image is segmented with them directly; otherwise, a viewer is
+        opened to choose them interactively.
+    preset_file : string, optional
+        The preset file for the viewer's `CentroPlugin`.
+    writer : `batch.AsyncWriter`, optional
+        Write the output files with this writer, rather than
+        synchronously.
+    preview_factor : int, optional
+        The viewer's `CentroPlugin` preview factor.
+    """
+    if image.dtype != np.uint8:
+        image = channelstats.rescale_to_uint8(image)
+    if params is None:
+        v = viewer.ImageViewer(image)
+        v += CentroPlugin(preset_file=preset_file,
+                          preview_factor=preview_factor)
+        overlay = v.show()[0][0]
+    else:
+        with profiling.stage('segment'):
+            overlay = cafe.encode_centro_telomeres_multichannel(image,
+                                                                **params)
+    # the viewer overlay has the same levels as the encoded regions
+    overlay = seg.relabel_sequential(overlay)[0]
+    mask = (overlay == 1)
+    percents = [5, 25, 50, 75, 95]
+    property_names = ['size', 'mean'] + ['quantile-%i' % i for i in percents]
+    with profiling.stage('regionprops'):
+        objects = backends.label(mask)[0]
+        stats = labelstats.quantile_stats(objects, target,
+                                          [p / 100 for p in percents])
+        props = np.column_stack((stats['area'], stats['mean'],
+                                 stats['quantiles']))
+    if writer is None:
+        write_spot_stats(directory, props, property_names, overlay)
+    else:
+        writer.submit(write_spot_stats, directory, props, property_names,
+                      overlay)
+
@@ -0,0 +1,297 @@
+"""Vectorised statistics of labelled objects.
+
+Rather than iterating over ``skimage.measure.regionprops`` objects, the
+foreground pixels are sorted by label once, after which each statistic of
+every object is a single ``ufunc.reduceat`` call over the sorted pixels.
+"""
+
+import numpy as np
+
+
+def sort_labels(labels):
+    """Group the foreground pixels of a label image by label.
+
+    Parameters
+    ----------
+    labels : array of int
+        A label image. 0 is background.
+
+    Returns
+    -------
+    index : array of int
+        The flat (raveled) indices of the foreground pixels, sorted by
+        label. Within a label, pixels are in raster order.
+    starts : array of int
+        The position in `index` of the first pixel of each label.
+    label_ids : array of int
+        The label present at each position of `starts`, in increasing
+        order.
+    """
+    flat = labels.ravel()
+    index = np.flatnonzero(flat)
+    order = np.argsort(flat[index], kind='mergesort')
+    return _grouped(flat, index[order])
+
+
+def sort_labels_by_value(labels, image):
+    """Group the foreground pixels of a label image by label and value.
+
+    This is `sort_labels`, except that within a label, pixels are sorted
+    by their value in `image`, so that order statistics such as
+    `quantiles` can be read off directly.
+
+    Parameters
+    ----------
+    labels : array of int
+        A label image. 0 is background.
+    image : array
+        An intensity image with the same shape as `labels`.
+
+    Returns
+    -------
+    index, starts, label_ids : array of int
+        As in `sort_labels`.
+    """
+    flat = labels.ravel()
+    index = np.flatnonzero(flat)
+    order = np.lexsort((image.ravel()[index], flat[index]))
+    return _grouped(flat, index[order])
+
+
+def _grouped(flat, index):
+    """The starts and labels of the runs of equal labels in `index`."""
+    sorted_labels = flat[index]
+    if len(index) == 0:
+        starts = np.zeros(0, dtype=np.intp)
+    else:
+        starts = np.flatnonzero(np.concatenate(([True], sorted_labels[1:] !=
+                                                        sorted_labels[:-1])))
+    return index, starts, sorted_labels[starts]
+
+
+def object_sizes(starts, n_pixels):
+    """The number of pixels of each object.
+
+    Parameters
+    ----------
+    starts : array of int
+        The ``starts`` output of `sort_labels`.
+    n_pixels : int
+        The number of sorted foreground pixels, ``len(index)``.
+
+    Returns
+    -------
+    sizes : array of int
+        The size of each object.
+    """
+    return np.diff(np.append(starts, n_pixels))
+
+
+def _eigvals_2d(a, b, c):
+    """Eigenvalues of the 2x2 symmetric matrices [[a, b], [b, c]]."""
+    root = np.sqrt(4 * b ** 2 + (a - c) ** 2) / 2
+    return (a + c) / 2 + root, (a + c) / 2 - root
+
+
+def eccentricity(shape, index, starts):
+    """Compute the eccentricity of every labelled object.
+
+    For 2D images this matches ``regionprops(...).eccentricity``. In
+    higher dimensions, the largest and smallest eigenvalues of the
+    inertia tensor are used in the same formula.
+
+    Parameters
+    ----------
+    shape : tuple of int
+        The shape of the label image.
+    index, starts : array of int
+        The output of `sort_labels`.
+
+    Returns
+    -------
+    ecc : array of float
+        The eccentricity of each object.
+    """
+    n = len(starts)
+    if n == 0:
+        return np.zeros(0)
+    sizes = object_sizes(starts, len(index))
+    counts = sizes.astype(float)
+    coords = np.unravel_index(index, shape)
+    # use the first pixel of each object as origin, to avoid cancellation
+    # when computing central moments at large coordinates
+    centred = [(c - np.repeat(c[starts], sizes)).astype(float)
+               for c in coords]
+    means = [np.add.reduceat(c, starts) / counts for c in centred]
+    ndim = len(shape)
+    cov = np.empty((n, ndim, ndim))
+    for i in range(ndim):
+        for j in range(i, ndim):
+            m = (np.add.reduceat(centred[i] * centred[j], starts) / counts -
+                 means[i] * means[j])
+            cov[:, i, j] = cov[:, j, i] = m
+    return _eccentricity_from_covariance(cov)
+
+
+def _eccentricity_from_covariance(cov):
+    n, ndim = cov.shape[:2]
+    if ndim == 2:
+        l1, l2 = _eigvals_2d(cov[:, 1, 1], cov[:, 0, 1], cov[:, 0, 0])
+    else:
+        eigvals = np.linalg.eigvalsh(cov)
+        l1, l2 = eigvals[:, -1], eigvals[:, 0]
+    ecc = np.zeros(n)
+    nonzero = l1 != 0
+    ecc[nonzero] = np.sqrt(1 - l2[nonzero] / l1[nonzero])
+    return ecc
+
+
+def coordinate_moments(shape, index, starts, offset=None):
+    """Compute the raw first and second coordinate moments of each object.
+
+    Unlike the central moments, raw moments of different parts of an
+    object can simply be added together, so objects spanning several
+    chunks of an image can be measured one chunk at a time.
+
+    Parameters
+    ----------
+    shape : tuple of int
+        The shape of the label image (or chunk).
+    index, starts : array of int
+        The output of `sort_labels`.
+    offset : tuple of int, optional
+        The position of the chunk in the full image.
+
+    Returns
+    -------
+    sums : array of float, shape (n_objects, ndim)
+        The sum of each coordinate over each object.
+    products : array of float, shape (n_objects, ndim, ndim)
+        The sum of the products of each pair of coordinates.
+    """
+    ndim = len(shape)
+    n = len(starts)
+    if offset is None:
+        offset = (0,) * ndim
+    coords = [(c + o).astype(float)
+              for c, o in zip(np.unravel_index(index, shape), offset)]
+    sums = np.zeros((n, ndim))
+    products = np.zeros((n, ndim, ndim))
+    if n == 0:
+        return sums, products
+    for i in range(ndim):
+        sums[:, i] = np.add.reduceat(coords[i], starts)
+        for j in range(i, ndim):
+            products[:, i, j] = products[:, j, i] = \
+                np.add.reduceat(coords[i] * coords[j], starts)
+    return sums, products
+
+
+def eccentricity_from_moments(counts, sums, products):
+    """Compute eccentricities from accumulated `coordinate_moments`.
+
+    Parameters
+    ----------
+    counts : array of int, shape (n_objects,)
+        The number of pixels in each object.
+    sums, products : array of float
+        The (summed) output of `coordinate_moments`.
+
+    Returns
+    -------
+    ecc : array of float
+        The eccentricity of each object.
+    """
+    counts = np.asarray(counts, dtype=float)
+    means = sums / counts[:, np.newaxis]
+    cov = (products / counts[:, np.newaxis, np.newaxis] -
+           means[:, :, np.newaxis] * means[:, np.newaxis, :])
+    return _eccentricity_from_covariance(cov)
+
+
+def pixel_stats(values, starts):
+    """Compute the total and maximum of pre-sorted pixel values per object.
+
+    Parameters
+    ----------
+    values : 1D array
+        Pixel values in the order given by the ``index`` output of
+        `sort_labels`, e.g. ``image.ravel()[index]``.
+    starts : array of int
+        The ``starts`` output of `sort_labels`.
+
+    Returns
+    -------
+    totals : array of float
+        The sum of the values in each object.
+    maxima : array
+        The maximum value in each object, in the type of `values`.
+    """
+    if len(starts) == 0:
+        return np.zeros(0), np.zeros(0, dtype=values.dtype)
+    totals = np.add.reduceat(values.astype(float), starts)
+    maxima = np.maximum.reduceat(values, starts)
+    return totals, maxima
+
+
+def quantiles(values, starts, q):
+    """Compute quantiles of pre-sorted pixel values per object.
+
+    Quantiles are interpolated linearly between pixel values, as with
+    ``np.percentile``.
+
+    Parameters
+    ----------
+    values : 1D array
+        Pixel values grouped by object and sorted within each object,
+        e.g. ``image.ravel()[index]`` with the ``index`` output of
+        `sort_labels_by_value`.
+    starts : array of int
+        The position in `values` of the first pixel of each object.
+    q : list of float
+        The quantiles to compute, in [0, 1].
+
+    Returns
+    -------
+    quantiles : array of float, shape (n_objects, len(q))
+        The quantiles of each object.
+    """
+    starts = np.asarray(starts)[:, np.newaxis]
+    counts = object_sizes(starts[:, 0], len(values))[:, np.newaxis]
+    values = np.asarray(values, dtype=float)
+    position = starts + np.asarray(q, dtype=float) * (counts - 1)
+    lo = np.floor(position).astype(np.intp)
+    hi = np.minimum(lo + 1, starts + counts - 1)
+    return values[lo] + (position - lo) * (values[hi] - values[lo])
+
+
+def quantile_stats(labels, image, q):
+    """Compute the area, mean, and quantiles of an image in labelled objects.
+
+    A single sort of the foreground pixels by label and value gives all
+    statistics of all objects.
+
+    Parameters
+    ----------
+    labels : array of int
+        A label image. 0 is background.
+    image : array
+        An intensity image with the same shape as `labels`.
+    q : list of float
+        The quantiles to compute, in [0, 1].
+
+    Returns
+    -------
+    stats : dict of arrays
+        ``'label'``: the label IDs present in `labels`, in increasing order;
+        ``'area'``: the number of pixels in each object;
+        ``'mean'``: the mean of `image` in each object;
+        ``'quantiles'``: the quantiles of `image` in each object, of shape
+        (n_objects, len(q)).
+    """
+    index, starts, label_ids = sort_labels_by_value(labels, image)
+    values = image.ravel()[index]
+    area = object_sizes(starts, len(index))
+    totals = pixel_stats(values, starts)[0]
+    return {'label': label_ids, 'area': area, 'mean': totals / area,
+            'quantiles': quantiles(values, starts, q)}
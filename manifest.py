@@ -0,0 +1,211 @@
+"""Track the input files processed by a run, so that reruns can skip them.
+
+A `Manifest` is a JSON file recording the size, modification time and
+content hash of every processed input file, together with a version key
+derived from the run parameters and the source code of the modules that
+produced the output. A file needs processing if it is new, if its contents
+have changed, or if it was processed with other parameters or code.
+
+Entries are appended to a journal as soon as each file is done, so an
+interrupted run resumes where it stopped, and recording a file doesn't
+rewrite the whole manifest. The journal is merged into the JSON file the
+next time the manifest is opened.
+"""
+
+import os
+import json
+import hashlib
+import inspect
+import importlib
+import tempfile
+
+
+def file_hash(fn, blocksize=2**20):
+    """Compute the SHA-1 hash of the contents of a file.
+
+    Parameters
+    ----------
+    fn : string
+        The input filename.
+    blocksize : int, optional
+        The number of bytes to read at a time.
+
+    Returns
+    -------
+    digest : string
+        The hexadecimal digest.
+    """
+    h = hashlib.sha1()
+    with open(fn, 'rb') as fin:
+        for block in iter(lambda: fin.read(blocksize), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def code_version(modules):
+    """Hash the source code of some modules.
+
+    Parameters
+    ----------
+    modules : list of module or string
+        The modules, or their names, in the order they should be hashed.
+
+    Returns
+    -------
+    digest : string
+        The hexadecimal digest.
+    """
+    h = hashlib.sha1()
+    for module in modules:
+        if isinstance(module, str):
+            module = importlib.import_module(module)
+        h.update(module.__name__.encode())
+        with open(inspect.getsourcefile(module), 'rb') as fin:
+            h.update(fin.read())
+    return h.hexdigest()
+
+
+def version_key(params=None, modules=()):
+    """Hash run parameters and the source code of `modules` together.
+
+    Parameters
+    ----------
+    params : dict, optional
+        The parameters of the run that affect its output. Values must be
+        representable in JSON, or have a stable ``repr``.
+    modules : list of module or string, optional
+        The modules whose code produces the output.
+
+    Returns
+    -------
+    digest : string
+        The hexadecimal digest.
+    """
+    h = hashlib.sha1()
+    h.update(json.dumps(params or {}, sort_keys=True, default=repr).encode())
+    h.update(code_version(modules).encode())
+    return h.hexdigest()
+
+
+def file_snapshot(fn):
+    """The size, modification time and hash of file `fn`, as a dict."""
+    st = os.stat(fn)
+    return {'size': st.st_size, 'mtime': st.st_mtime, 'sha1': file_hash(fn)}
+
+
+class Manifest(object):
+    """A record of processed files, stored in a JSON file.
+
+    Parameters
+    ----------
+    filename : string
+        The manifest file. It is read if it exists, together with the
+        journal of entries recorded since it was last written, in
+        ``filename + '.journal'``.
+    params : dict, optional
+        The parameters of the current run. See `version_key`.
+    modules : list of module or string, optional
+        The modules whose code produces the output of the run.
+    """
+    def __init__(self, filename, params=None, modules=()):
+        self.filename = filename
+        self.journal = filename + '.journal'
+        self.version = version_key(params, modules)
+        self.entries = {}
+        self._snapshots = {}
+        if os.path.exists(filename):
+            with open(filename) as fin:
+                self.entries = json.load(fin)['files']
+        if os.path.exists(self.journal):
+            with open(self.journal) as fin:
+                for line in fin:
+                    try:
+                        key, entry = json.loads(line)
+                    except ValueError:  # interrupted while writing the line
+                        break
+                    self.entries[key] = entry
+            self.save()
+
+    @staticmethod
+    def _key(fn):
+        return os.path.abspath(fn)
+
+    def get(self, fn):
+        """Return the entry recorded for file `fn`, or None."""
+        return self.entries.get(self._key(fn))
+
+    def is_current(self, fn):
+        """Whether file `fn` was processed, unchanged, by the current version.
+
+        Files whose modification time changed but whose size did not are
+        hashed, so that copying or touching a file does not cause it to be
+        processed again.
+        """
+        entry = self.get(fn)
+        if entry is None or entry['version'] != self.version:
+            return False
+        st = os.stat(fn)
+        if st.st_size != entry['size']:
+            return False
+        if st.st_mtime == entry['mtime']:
+            return True
+        if file_hash(fn) != entry['sha1']:
+            return False
+        entry['mtime'] = st.st_mtime
+        return True
+
+    def snapshot(self, fn):
+        """Take the size, modification time and hash of file `fn` now.
+
+        Call this before processing a file: `record` then records the
+        snapshot, so a file that changes while it is processed is processed
+        again by the next run.
+        """
+        self._snapshots[self._key(fn)] = file_snapshot(fn)
+
+    def pending(self, filenames):
+        """Return the files in `filenames` that need to be processed.
+
+        Each of them is snapshotted, see `snapshot`.
+        """
+        pending = [fn for fn in filenames if not self.is_current(fn)]
+        for fn in pending:
+            self.snapshot(fn)
+        return pending
+
+    def record(self, fn, **info):
+        """Record that file `fn` has been processed, and save the entry.
+
+        Parameters
+        ----------
+        fn : string
+            The processed file. Its `snapshot` is recorded if one was
+            taken, and otherwise the file is examined now.
+        **info : keyword arguments
+            Additional JSON-serialisable information to store in the entry,
+            such as the name of the corresponding output file.
+        """
+        key = self._key(fn)
+        entry = self._snapshots.pop(key, None) or file_snapshot(fn)
+        entry['version'] = self.version
+        entry.update(info)
+        self.entries[key] = entry
+        with open(self.journal, 'a') as fout:
+            fout.write(json.dumps([key, entry], sort_keys=True) + '\n')
+
+    def retain(self, filenames):
+        """Forget all files but `filenames`, and save the manifest."""
+        keep = set(self._key(fn) for fn in filenames)
+        self.entries = dict((key, entry) for key, entry in self.entries.items()
+                            if key in keep)
+        self.save()
+
+    def save(self):
+        """Write the manifest to disk atomically, and clear the journal."""
+        directory = os.path.dirname(os.path.abspath(self.filename))
+        fd, tmp = tempfile.mkstemp(suffix='.json', prefix='.', dir=directory)
+        with os.fdopen(fd, 'w') as fout:
+            json.dump({'files': self.entries}, fout, indent=1, sort_keys=True)
+        os.replace(tmp, self.filename)
+        if os.path.exists(self.journal):
+            os.remove(self.journal)
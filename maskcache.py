@@ -0,0 +1,202 @@
+"""A persistent, content-addressed on-disk cache of segmentation masks.
+
+Masks are stored in compressed ``.npz`` files named by a hash of the input
+images, the segmentation function, and all of its parameters, so changing
+any of these results in a cache miss rather than a stale result. Boolean
+masks are stored, and returned, run-length encoded (see `runlength`).
+"""
+
+import os
+import hashlib
+import inspect
+import tempfile
+
+import numpy as np
+
+import runlength
+
+
+def hash_array(image, h=None):
+    """Hash the shape, type, and contents of an array.
+
+    Parameters
+    ----------
+    image : np.ndarray
+        The input array.
+    h : hashlib hash object, optional
+        Update this hash instead of creating a new one.
+
+    Returns
+    -------
+    h : hashlib hash object
+        The updated hash.
+    """
+    if h is None:
+        h = hashlib.sha1()
+    image = np.ascontiguousarray(image)
+    h.update(repr((image.shape, image.dtype.str)).encode())
+    h.update(image.data)
+    return h
+
+
+def _param_repr(value):
+    """Return a representation of `value` that is stable across runs."""
+    if callable(value):
+        return '%s.%s' % (getattr(value, '__module__', ''),
+                          getattr(value, '__name__', repr(value)))
+    return repr(value)
+
+
+def _is_mask(array):
+    return (isinstance(array, runlength.RunLengthMask) or
+            np.asarray(array).dtype == bool)
+
+
+def _compact(masks):
+    """Run-length encode the boolean masks in a sequence of arrays."""
+    return tuple(runlength.encode(m) if _is_mask(m) else m for m in masks)
+
+
+def _pack(masks):
+    """The ``.npz`` arrays storing a sequence of masks."""
+    arrays = {}
+    for i, m in enumerate(masks):
+        if _is_mask(m):
+            for name, array in runlength.encode(m).state().items():
+                arrays['rle%i_%s' % (i, name)] = array
+        else:
+            arrays['mask%i' % i] = m
+    return arrays
+
+
+def _unpack(data):
+    """The masks stored in an ``.npz`` file by `_pack`."""
+    masks = {}
+    for name in data.files:
+        kind, _, field = name.partition('_')
+        if kind.startswith('mask'):
+            masks[int(kind[4:])] = data[name]
+        else:
+            masks.setdefault(int(kind[3:]), {})[field] = data[name]
+    return tuple(runlength.RunLengthMask.from_state(m)
+                 if isinstance(m, dict) else m
+                 for i, m in sorted(masks.items()))
+
+
+class MaskCache(object):
+    """Cache the output of a segmentation function on disk.
+
+    Parameters
+    ----------
+    directory : string
+        The cache directory. It is created if it doesn't exist.
+    max_bytes : int, optional
+        When the cache grows beyond this size, the least recently used
+        entries are deleted. None means no limit.
+    """
+    def __init__(self, directory, max_bytes=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def key(self, func, images, params):
+        """Compute the cache key for ``func(*images, **params)``.
+
+        Default parameter values are included in the key, so that
+        explicitly passing a default value gives the same key as
+        omitting it.
+        """
+        bound = inspect.signature(func).bind_partial(**params)
+        bound.apply_defaults()
+        h = hashlib.sha1()
+        h.update(_param_repr(func).encode())
+        for image in images:
+            hash_array(image, h)
+        for name in sorted(bound.arguments):
+            h.update(('%s=%s;' % (name, _param_repr(bound.arguments[name]))
+                      ).encode())
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.npz')
+
+    def get(self, key):
+        """Return the masks stored under `key`, or None if not present."""
+        path = self._path(key)
+        try:
+            with np.load(path) as data:
+                masks = _unpack(data)
+        except (IOError, OSError, KeyError, ValueError):
+            return None
+        try:
+            os.utime(path, None)  # mark as recently used
+        except OSError:
+            pass
+        return masks
+
+    def put(self, key, masks):
+        """Store the sequence of arrays `masks` under `key`."""
+        arrays = _pack(masks)
+        # temporary files have their own suffix, so that `evict` never
+        # deletes a file that another worker is still writing
+        fd, tmp = tempfile.mkstemp(suffix='.npz.tmp', dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as fout:
+                np.savez_compressed(fout, **arrays)
+            # the rename is atomic, so concurrent workers never see partial
+            # files
+            os.replace(tmp, self._path(key))
+        except BaseException:
+            os.remove(tmp)
+            raise
+        self.evict()
+
+    def get_or_compute(self, func, *images, **params):
+        """Return ``func(*images, **params)``, from the cache if possible.
+
+        Parameters
+        ----------
+        func : callable
+            A segmentation function returning a tuple of arrays.
+        *images : np.ndarray
+            The input images to `func`. Their contents form part of the
+            cache key.
+        **params : keyword arguments
+            Additional parameters to `func`.
+
+        Returns
+        -------
+        masks : tuple of np.ndarray or `runlength.RunLengthMask`
+            The output of `func`, with boolean masks run-length encoded.
+        """
+        key = self.key(func, images, params)
+        masks = self.get(key)
+        if masks is None:
+            masks = _compact(func(*images, **params))
+            self.put(key, masks)
+        return masks
+
+    def evict(self):
+        """Delete least recently used entries until under `max_bytes`."""
+        if self.max_bytes is None:
+            return
+        entries = []
+        for fn in os.listdir(self.directory):
+            if not fn.endswith('.npz'):  # including files being written
+                continue
+            path = os.path.join(self.directory, fn)
+            try:
+                st = os.stat(path)
+            except OSError:  # removed by another process
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        total = sum(e[1] for e in entries)
+        for mtime, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
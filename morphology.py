@@ -0,0 +1,126 @@
+"""Binary morphology with disks and balls in time independent of the radius.
+
+A pixel is in the dilation of a mask by a disk of radius ``r`` exactly when
+its Euclidean distance to the nearest mask pixel is at most ``r``, and in
+the erosion exactly when its distance to the nearest non-mask pixel
+(counting pixels outside the image) is greater than ``r``. Using an exact
+Euclidean distance transform, these give the same masks as
+``nd.binary_dilation`` and ``nd.binary_erosion`` with
+``cafe.structuring_element(r)``, but the cost doesn't grow with the area of
+the structuring element. The distance maps themselves answer every
+radius at once, which `stages` uses when sweeping radii.
+"""
+
+import numpy as np
+from scipy import ndimage as nd
+
+
+def distance_to(mask):
+    """The Euclidean distance from each pixel to the nearest mask pixel.
+
+    Parameters
+    ----------
+    mask : array of bool
+        The input mask.
+
+    Returns
+    -------
+    distance : array of float
+        The distance map, 0 on the mask. If the mask is empty, it is
+        infinite everywhere.
+    """
+    mask = np.asarray(mask, dtype=bool)
+    if not mask.any():
+        return np.full(mask.shape, np.inf)
+    return nd.distance_transform_edt(~mask)
+
+
+def depth(mask):
+    """The Euclidean distance from each pixel to the nearest background pixel.
+
+    Pixels outside the image count as background.
+
+    Parameters
+    ----------
+    mask : array of bool
+        The input mask.
+
+    Returns
+    -------
+    distance : array of float
+        The distance map, 0 outside the mask.
+    """
+    mask = np.asarray(mask, dtype=bool)
+    # the nearest pixel outside the image is always in the first layer
+    padded = np.pad(mask, 1, mode='constant', constant_values=False)
+    distance = nd.distance_transform_edt(padded)
+    inner = (slice(1, -1),) * mask.ndim
+    return distance[inner]
+
+
+def dilate(mask, radius):
+    """Dilate a mask by a disk (2D) or ball (3D) of the given radius.
+
+    Parameters
+    ----------
+    mask : array of bool
+        The input mask.
+    radius : int
+        The radius of the structuring element.
+
+    Returns
+    -------
+    dilated : array of bool
+        The same as ``nd.binary_dilation(mask, cafe.structuring_element(
+        radius, mask.ndim))``.
+    """
+    return distance_to(mask) <= radius
+
+
+def erode(mask, radius):
+    """Erode a mask by a disk (2D) or ball (3D) of the given radius.
+
+    Pixels outside the image are considered to be background, as with
+    the default ``border_value=0`` of ``nd.binary_erosion``.
+
+    Parameters
+    ----------
+    mask : array of bool
+        The input mask.
+    radius : int
+        The radius of the structuring element.
+
+    Returns
+    -------
+    eroded : array of bool
+        The same as ``nd.binary_erosion(mask, cafe.structuring_element(
+        radius, mask.ndim))``.
+    """
+    return depth(mask) > radius
+
+
+def opening(mask, radius, iterations=1):
+    """Open a mask with a disk (2D) or ball (3D) of the given radius.
+
+    Parameters
+    ----------
+    mask : array of bool
+        The input mask.
+    radius : int
+        The radius of the structuring element.
+    iterations : int, optional
+        As in ``nd.binary_opening``: erode this many times, then dilate
+        this many times.
+
+    Returns
+    -------
+    opened : array of bool
+        The same as ``nd.binary_opening(mask, cafe.structuring_element(
+        radius, mask.ndim), iterations=iterations)``.
+    """
+    opened = np.asarray(mask, dtype=bool)
+    for i in range(iterations):
+        opened = erode(opened, radius)
+    for i in range(iterations):
+        opened = dilate(opened, radius)
+    return opened
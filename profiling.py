@@ -0,0 +1,269 @@
+"""Lightweight per-stage timing and memory instrumentation.
+
+Processing functions mark their stages with::
+
+    with profiling.stage('otsu'):
+        ...
+
+When profiling is disabled (the default), `stage` returns a shared no-op
+context manager, so instrumented code runs at full speed. When enabled,
+each stage records its wall time, CPU time, and peak memory allocated
+above the level at its start (traced with `tracemalloc`), together with
+the image being processed.
+
+Profiling is enabled per thread, and stages are only recorded on threads
+that enabled it. Work done on other threads, such as reading images ahead,
+overlaps with the recorded stages rather than adding to them. Several
+threads can profile at once, e.g. the workers of a threaded dask
+scheduler, each with its own records. Memory is traced for the whole
+process, though, so the peak of a stage then includes the allocations of
+concurrent stages on other threads.
+"""
+
+import sys
+import csv
+import json
+import time
+import threading
+import tracemalloc
+import collections
+
+
+FIELDS = ['image', 'stage', 'wall', 'cpu', 'peak']
+
+# the records, open stages and current image of each profiling thread
+_local = threading.local()
+# the open stages of all threads, and the number of threads profiling
+_lock = threading.Lock()
+_open_stages = []
+_n_profiling = 0
+
+
+class _NullStage(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+def _fold_peak():
+    """Fold the traced peak into all open stages, then reset it."""
+    with _lock:
+        peak = tracemalloc.get_traced_memory()[1]
+        for s in _open_stages:
+            s.peak = max(s.peak, peak)
+        tracemalloc.reset_peak()
+
+
+class _Stage(object):
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        _fold_peak()
+        self.start_memory = tracemalloc.get_traced_memory()[0]
+        self.peak = self.start_memory
+        with _lock:
+            _open_stages.append(self)
+        _local.stages.append(self)
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        return self
+
+    def __exit__(self, *exc):
+        wall = time.perf_counter() - self.wall
+        cpu = time.process_time() - self.cpu
+        _fold_peak()
+        with _lock:
+            _open_stages.remove(self)
+        _local.stages.pop()
+        _local.records.append({'image': getattr(_local, 'image', None),
+                               'stage': self.name, 'wall': wall, 'cpu': cpu,
+                               'peak': self.peak - self.start_memory})
+        return False
+
+
+def stage(name):
+    """Return a context manager recording the stage `name`, if enabled."""
+    if getattr(_local, 'records', None) is None:
+        return _NULL_STAGE
+    return _Stage(name)
+
+
+def enabled():
+    """Whether stages are being recorded on the current thread."""
+    return getattr(_local, 'records', None) is not None
+
+
+def enable():
+    """Start recording stages on the current thread."""
+    global _n_profiling
+    if enabled():
+        disable()
+    _local.records = []
+    _local.stages = []
+    with _lock:
+        if _n_profiling == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        _n_profiling += 1
+
+
+def disable():
+    """Stop recording stages on the current thread and return the records.
+
+    Memory tracing stops when no thread is profiling any more.
+
+    Returns
+    -------
+    records : list of dict
+        One record per stage, with the keys in `FIELDS`.
+    """
+    global _n_profiling
+    records = getattr(_local, 'records', None)
+    if records is None:
+        return []
+    with _lock:
+        for s in _local.stages:
+            _open_stages.remove(s)
+        _n_profiling -= 1
+        if _n_profiling == 0 and tracemalloc.is_tracing():
+            tracemalloc.stop()
+    _local.records = _local.stages = None
+    return records
+
+
+class image(object):
+    """Context manager tagging the stages recorded within it with `name`.
+
+    The tag applies to the stages of the current thread.
+    """
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.previous = getattr(_local, 'image', None)
+        _local.image = self.name
+        return self
+
+    def __exit__(self, *exc):
+        _local.image = self.previous
+        return False
+
+
+class Profiled(object):
+    """Wrap a per-image function to profile it, e.g. in a worker process.
+
+    Calling the wrapper returns the result of the function and the stage
+    records of the call. If profiling is already enabled on the calling
+    thread, the stages are recorded there instead, and no records are
+    returned. Concurrent calls on several threads, e.g. on the workers of
+    a threaded dask scheduler, each return their own records.
+
+    Parameters
+    ----------
+    func : callable
+        A picklable function of one argument, the image.
+    """
+    def __init__(self, func):
+        self.func = func
+
+    def __call__(self, item):
+        if enabled():
+            with image(str(item)):
+                return self.func(item), []
+        enable()
+        try:
+            with image(str(item)):
+                result = self.func(item)
+        finally:
+            records = disable()
+        return result, records
+
+
+class Session(object):
+    """Collect the stage records of a run, from all processes.
+
+    Use it as a context manager around the run, and wrap per-image
+    functions sent to worker processes with `Session.wrap`.
+
+    Parameters
+    ----------
+    active : bool, optional
+        If False, the session does nothing, so that callers don't need to
+        check whether profiling was requested.
+    """
+    def __init__(self, active=True):
+        self.active = active
+        self.records = []
+
+    def __enter__(self):
+        if self.active:
+            enable()
+        return self
+
+    def __exit__(self, *exc):
+        if self.active:
+            self.records.extend(disable())
+        return False
+
+    def wrap(self, func):
+        """Wrap `func` with `Profiled`."""
+        return Profiled(func) if self.active else func
+
+    def unwrap(self, results):
+        """Return the results of a wrapped function, keeping its records."""
+        if not self.active:
+            return results
+        return self._unwrap(results)
+
+    def _unwrap(self, results):
+        for result, records in results:
+            self.records.extend(records)
+            yield result
+
+    def write(self, filename):
+        """Write all records to a ``.json`` or ``.csv`` file."""
+        with open(filename, 'w') as fout:
+            if filename.lower().endswith('.json'):
+                json.dump(self.records, fout, indent=1)
+            else:
+                writer = csv.DictWriter(fout, FIELDS)
+                writer.writeheader()
+                writer.writerows(self.records)
+
+    def summary(self):
+        """Aggregate the records by stage.
+
+        Returns
+        -------
+        table : string
+            For each stage, the number of calls, the total and mean wall
+            time, the total CPU time, and the largest peak memory, in
+            order of total wall time.
+        """
+        totals = collections.OrderedDict()
+        for r in self.records:
+            t = totals.setdefault(r['stage'], [0, 0.0, 0.0, 0])
+            t[0] += 1
+            t[1] += r['wall']
+            t[2] += r['cpu']
+            t[3] = max(t[3], r['peak'])
+        lines = ['%-28s %6s %10s %10s %10s %10s' %
+                 ('stage', 'calls', 'wall (s)', 'mean (s)', 'cpu (s)',
+                  'peak (MB)')]
+        for name, (n, wall, cpu, peak) in sorted(totals.items(),
+                                                 key=lambda t: -t[1][1]):
+            lines.append('%-28s %6i %10.3f %10.4f %10.3f %10.1f' %
+                         (name, n, wall, wall / n, cpu, peak / 2**20))
+        return '\n'.join(lines)
+
+    def report(self, filename, stream=sys.stderr):
+        """Write the records to `filename` and the summary to `stream`."""
+        if not self.active:
+            return
+        self.write(filename)
+        stream.write(self.summary() + '\n')
@@ -0,0 +1,175 @@
+"""Run-length encoded binary masks.
+
+A `RunLengthMask` stores a mask as the start and end of each run of
+foreground pixels in C order. Sparse masks, such as centromere
+neighbourhoods, take a few bytes per run instead of a byte per pixel, and
+the values of an image within a mask are gathered from the runs without
+scanning a full-size boolean array. The masks support the ``&``, ``|``
+and ``~`` operators, and are saved in compressed ``.npz`` files.
+"""
+
+import numpy as np
+
+
+class RunLengthMask(object):
+    """A binary mask stored as runs of foreground pixels.
+
+    Parameters
+    ----------
+    shape : tuple of int
+        The shape of the mask.
+    starts, ends : array of int
+        The flat (C order) index of the first pixel of each run, and of
+        the pixel after its last one. Runs are sorted and don't touch.
+    """
+    def __init__(self, shape, starts, ends):
+        self.shape = tuple(shape)
+        self.ndim = len(self.shape)
+        self.size = int(np.prod(self.shape))
+        self.dtype = np.dtype(bool)
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.ends = np.asarray(ends, dtype=np.int64)
+
+    @classmethod
+    def from_array(cls, mask):
+        """Encode a boolean array."""
+        mask = np.asarray(mask, dtype=bool)
+        edges = np.diff(mask.reshape(-1).view(np.int8), prepend=0, append=0)
+        return cls(mask.shape, np.flatnonzero(edges == 1),
+                   np.flatnonzero(edges == -1))
+
+    @property
+    def lengths(self):
+        return self.ends - self.starts
+
+    def count(self):
+        """The number of foreground pixels."""
+        return int(self.lengths.sum())
+
+    def any(self):
+        return len(self.starts) > 0
+
+    def __array__(self, dtype=None):
+        edges = np.zeros(self.size + 1, dtype=np.int8)
+        edges[self.starts] += 1
+        edges[self.ends] -= 1
+        mask = np.cumsum(edges[:-1], dtype=np.int8).astype(bool)
+        return np.asarray(mask.reshape(self.shape), dtype=dtype)
+
+    def index(self):
+        """The flat index of every foreground pixel, in C order."""
+        lengths = self.lengths
+        run_offsets = np.cumsum(lengths) - lengths
+        return (np.repeat(self.starts - run_offsets, lengths) +
+                np.arange(lengths.sum(), dtype=np.int64))
+
+    def extract(self, image):
+        """Return the values of `image` in the mask.
+
+        Parameters
+        ----------
+        image : array
+            An array of the same shape as the mask.
+
+        Returns
+        -------
+        values : 1D array
+            The same as ``image[np.asarray(mask)]``.
+        """
+        if image.shape != self.shape:
+            raise ValueError('image shape %s does not match mask shape %s'
+                             % (image.shape, self.shape))
+        index = self.index()
+        if isinstance(image, np.ndarray) and image.flags.c_contiguous:
+            return image.reshape(-1)[index]
+        # e.g. a channel view of an interleaved image: don't copy it all
+        return image[np.unravel_index(index, self.shape)]
+
+    def _covers(self, positions):
+        """Whether each flat position is in the mask."""
+        i = np.searchsorted(self.starts, positions, side='right') - 1
+        inside = i >= 0
+        inside[inside] = positions[inside] < self.ends[i[inside]]
+        return inside
+
+    def _combine(self, other, op):
+        other = encode(other)
+        if other.shape != self.shape:
+            raise ValueError('mask shapes %s and %s do not match'
+                             % (self.shape, other.shape))
+        points = np.unique(np.concatenate([[0, self.size], self.starts,
+                                           self.ends, other.starts,
+                                           other.ends]))
+        keep = op(self._covers(points[:-1]), other._covers(points[:-1]))
+        edges = np.diff(keep.view(np.int8), prepend=0, append=0)
+        return RunLengthMask(self.shape, points[np.flatnonzero(edges == 1)],
+                             points[np.flatnonzero(edges == -1)])
+
+    def __and__(self, other):
+        return self._combine(other, np.logical_and)
+
+    def __or__(self, other):
+        return self._combine(other, np.logical_or)
+
+    __rand__ = __and__
+    __ror__ = __or__
+
+    def __invert__(self):
+        gap_starts = np.concatenate([[0], self.ends])
+        gap_ends = np.concatenate([self.starts, [self.size]])
+        keep = gap_ends > gap_starts
+        return RunLengthMask(self.shape, gap_starts[keep], gap_ends[keep])
+
+    def state(self):
+        """Return the mask as a dict of compact arrays, e.g. for ``np.savez``.
+
+        Runs are stored as the gap before each run and the run length,
+        in the smallest unsigned type that holds them.
+        """
+        gaps = np.diff(self.starts, prepend=0)
+        gaps[1:] -= self.lengths[:-1]
+        return {'shape': np.array(self.shape, dtype=np.int64),
+                'gaps': _compact(gaps), 'lengths': _compact(self.lengths)}
+
+    @classmethod
+    def from_state(cls, state):
+        """Rebuild a mask from the output of `RunLengthMask.state`."""
+        gaps = state['gaps'].astype(np.int64)
+        lengths = state['lengths'].astype(np.int64)
+        ends = np.cumsum(gaps + lengths)
+        shape = tuple(int(n) for n in state['shape'])
+        return cls(shape, ends - lengths, ends)
+
+
+def _compact(values):
+    """Cast non-negative integers to the smallest unsigned type."""
+    top = values.max() if len(values) else 0
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if top <= np.iinfo(dtype).max:
+            return values.astype(dtype)
+    return values.astype(np.uint64)
+
+
+def encode(mask):
+    """Return `mask` as a `RunLengthMask`, encoding it if necessary."""
+    if isinstance(mask, RunLengthMask):
+        return mask
+    return RunLengthMask.from_array(mask)
+
+
+def extract(image, mask):
+    """Return the values of `image` in `mask`, a boolean array or RLE mask."""
+    if isinstance(mask, RunLengthMask):
+        return mask.extract(image)
+    return image[mask]
+
+
+def save(fn, mask):
+    """Save a mask to a compressed ``.npz`` file."""
+    np.savez_compressed(fn, **encode(mask).state())
+
+
+def load(fn):
+    """Load a `RunLengthMask` saved with `save`."""
+    with np.load(fn) as data:
+        return RunLengthMask.from_state(data)
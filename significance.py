@@ -0,0 +1,268 @@
+"""Effect sizes and resampling statistics for test vs control images.
+
+The unit of replication is the image: each image is reduced to a few sums
+over its pixels (see `image_summaries`), and the test and control groups
+are compared through one value per image, by default the enrichment of
+the RNA Pol II signal near centromeres relative to the rest of the
+chromatin. Permutations and bootstrap resamples of the images are then
+drawn in batches, as matrices of group memberships or resampling counts,
+so that each batch is a single matrix product over the per-image values.
+
+Batches are drawn from independent random streams spawned from one seed,
+and have a fixed size, so the results depend only on the seed, not on the
+number of processes computing them.
+"""
+
+import numpy as np
+
+import batch
+import sketch
+
+
+def region_summary(values):
+    """Summarise the values of an image region.
+
+    Parameters
+    ----------
+    values : 1D array or `sketch.Histogram`
+        The pixel values, or their histogram.
+
+    Returns
+    -------
+    summary : array of float, shape (3,)
+        The number of values, their sum, and the sum of their squares.
+    """
+    if isinstance(values, sketch.Histogram):
+        return np.array([values.n, values.total, values.total_sq],
+                        dtype=float)
+    values = np.asarray(values, dtype=float)
+    return np.array([len(values), values.sum(), np.dot(values, values)])
+
+
+def image_summaries(results):
+    """Summarise the regions of each image.
+
+    Parameters
+    ----------
+    results : iterable of tuple
+        For each image, the values (or `sketch.Histogram`) of each region,
+        e.g. the output of `cafe.rnapii_centromere_vs_chromatin`.
+
+    Returns
+    -------
+    summaries : array of float, shape (n_images, n_regions, 3)
+        The `region_summary` of each region of each image.
+    """
+    return np.array([[region_summary(v) for v in regions]
+                     for regions in results])
+
+
+def enrichment(summaries):
+    """The ratio of the mean of the first region to that of the second.
+
+    Parameters
+    ----------
+    summaries : array of float, shape (n_images, 2, 3)
+        The output of `image_summaries`, e.g. for centromeric and
+        chromatin regions.
+
+    Returns
+    -------
+    ratios : array of float, shape (n_images,)
+        The enrichment of each image. NaN for images with an empty
+        region.
+    """
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = summaries[:, :, 1] / summaries[:, :, 0]
+        return means[:, 0] / means[:, 1]
+
+
+def effect_sizes(test, control):
+    """Compare the per-image values of two groups.
+
+    Parameters
+    ----------
+    test, control : array of float
+        One value per image.
+
+    Returns
+    -------
+    effects : dict
+        The group sizes and means, their ``'difference'`` and
+        ``'ratio'``, and Cohen's d: the difference divided by the pooled
+        standard deviation.
+    """
+    n_test, n_control = len(test), len(control)
+    mean_test, mean_control = np.mean(test), np.mean(control)
+    pooled = np.sqrt(((n_test - 1) * np.var(test, ddof=1) +
+                      (n_control - 1) * np.var(control, ddof=1)) /
+                     (n_test + n_control - 2))
+    return {'n_test': n_test, 'n_control': n_control,
+            'test_mean': mean_test, 'control_mean': mean_control,
+            'difference': mean_test - mean_control,
+            'ratio': mean_test / mean_control,
+            'cohens_d': (mean_test - mean_control) / pooled}
+
+
+def _check_groups(test, control):
+    """Raise a ValueError if either group has no images."""
+    for name, values in [('test', test), ('control', control)]:
+        if len(values) == 0:
+            raise ValueError('The %s group has no images with a value; '
+                             'at least one is needed in each group.' % name)
+
+
+def _seed_sequence(seed):
+    if isinstance(seed, np.random.SeedSequence):
+        return seed
+    return np.random.SeedSequence(seed)
+
+
+def _chunks(n_resamples, chunk_size, seed):
+    """Split resamples into fixed-size chunks with independent seeds."""
+    sizes = [chunk_size] * (n_resamples // chunk_size)
+    if n_resamples % chunk_size:
+        sizes.append(n_resamples % chunk_size)
+    seeds = _seed_sequence(seed).spawn(len(sizes))
+    return list(zip(sizes, seeds))
+
+
+class _Permutations(object):
+    """Differences of group means under random relabellings of images."""
+    def __init__(self, values, n_test):
+        self.values = values
+        self.n_test = n_test
+
+    def __call__(self, chunk):
+        size, seed = chunk
+        rng = np.random.default_rng(seed)
+        n = len(self.values)
+        members = np.argsort(rng.random((size, n)), axis=1)[:, :self.n_test]
+        selected = np.zeros((size, n))
+        np.put_along_axis(selected, members, 1, axis=1)
+        total_test = selected.dot(self.values)
+        return (total_test / self.n_test -
+                (self.values.sum() - total_test) / (n - self.n_test))
+
+
+class _Bootstrap(object):
+    """Group means of images resampled with replacement within groups."""
+    def __init__(self, test, control):
+        self.test = test
+        self.control = control
+
+    def __call__(self, chunk):
+        size, seed = chunk
+        rng = np.random.default_rng(seed)
+        means = []
+        for values in (self.test, self.control):
+            n = len(values)
+            counts = rng.multinomial(n, np.full(n, 1 / n), size=size)
+            means.append(counts.dot(values) / n)
+        return np.stack(means, axis=1)
+
+
+def permutation_test(test, control, n_resamples=10000, seed=0, jobs=1,
+                     chunk_size=1000):
+    """Test whether the group means differ by permuting image labels.
+
+    Parameters
+    ----------
+    test, control : array of float
+        One value per image.
+    n_resamples : int, optional
+        The number of permutations.
+    seed : int or `numpy.random.SeedSequence`, optional
+        The random seed.
+    jobs : int, optional
+        The number of processes computing chunks of permutations.
+    chunk_size : int, optional
+        The number of permutations computed at once.
+
+    Returns
+    -------
+    p_value : float
+        The two-sided p-value of the difference of means, counting the
+        observed labelling as one of the permutations.
+    """
+    _check_groups(test, control)
+    values = np.concatenate([test, control]).astype(float)
+    observed = abs(np.mean(test) - np.mean(control))
+    null = np.concatenate(list(batch.bounded_map(
+                _Permutations(values, len(test)),
+                _chunks(n_resamples, chunk_size, seed), jobs)))
+    # allow for rounding errors in the permuted means
+    extreme = np.sum(np.abs(null) >= observed * (1 - 1e-12))
+    return (extreme + 1) / (n_resamples + 1)
+
+
+def bootstrap(test, control, n_resamples=10000, seed=0, jobs=1,
+              chunk_size=1000):
+    """Resample the images of each group with replacement.
+
+    Parameters
+    ----------
+    test, control : array of float
+        One value per image.
+    n_resamples, seed, jobs, chunk_size : optional
+        See `permutation_test`.
+
+    Returns
+    -------
+    means : array of float, shape (n_resamples, 2)
+        The mean of the test and control groups in each resample.
+    """
+    test = np.asarray(test, dtype=float)
+    control = np.asarray(control, dtype=float)
+    _check_groups(test, control)
+    return np.concatenate(list(batch.bounded_map(
+                _Bootstrap(test, control),
+                _chunks(n_resamples, chunk_size, seed), jobs)))
+
+
+def compare(test, control, n_resamples=10000, confidence=0.95, seed=0,
+            jobs=1, chunk_size=1000):
+    """Effect sizes, confidence intervals and p-value of a comparison.
+
+    Parameters
+    ----------
+    test, control : array of float
+        One value per image, e.g. the `enrichment` of each image. NaN
+        values are ignored.
+    n_resamples : int, optional
+        The number of permutations, and of bootstrap resamples.
+    confidence : float, optional
+        The coverage of the bootstrap percentile intervals.
+    seed, jobs, chunk_size : optional
+        See `permutation_test`. The permutations and the bootstrap
+        resamples are drawn from independent streams spawned from `seed`.
+
+    Returns
+    -------
+    result : dict
+        The `effect_sizes`, the bounds of the confidence intervals of the
+        difference and ratio of means (``'difference_low'``, etc.), and
+        the permutation ``'p_value'``.
+
+    Raises
+    ------
+    ValueError
+        If a group has no values, once NaN values are removed.
+    """
+    test = np.asarray(test, dtype=float)
+    control = np.asarray(control, dtype=float)
+    test, control = test[~np.isnan(test)], control[~np.isnan(control)]
+    _check_groups(test, control)
+    permutation_seed, bootstrap_seed = _seed_sequence(seed).spawn(2)
+    result = effect_sizes(test, control)
+    means = bootstrap(test, control, n_resamples, bootstrap_seed, jobs,
+                      chunk_size)
+    tails = [50 * (1 - confidence), 50 * (1 + confidence)]
+    for name, resampled in [('difference', means[:, 0] - means[:, 1]),
+                            ('ratio', means[:, 0] / means[:, 1])]:
+        low, high = np.percentile(resampled, tails)
+        result[name + '_low'], result[name + '_high'] = low, high
+    result['p_value'] = permutation_test(test, control, n_resamples,
+                                         permutation_seed, jobs, chunk_size)
+    result.update(resamples=n_resamples, confidence=confidence, seed=seed)
+    return result
@@ -0,0 +1,179 @@
+"""Constant-memory, mergeable summaries of large sets of pixel values.
+
+A `Histogram` has fixed bins, so it uses the same memory whether it
+summarises a hundred values or a billion, and two histograms (for example,
+from different images or worker processes) merge by adding their counts.
+Quantiles, and hence the box statistics drawn by ``plt.bxp``, are
+interpolated within bins; the mean, minimum and maximum are exact.
+"""
+
+import functools
+
+import numpy as np
+
+
+class Histogram(object):
+    """A fixed-bin histogram of values, with exact moments and extremes.
+
+    Parameters
+    ----------
+    lo, hi : float, optional
+        The range covered by the bins. Values outside of it are counted in
+        the first or last bin. The default suits values normalised to 1.
+    nbins : int, optional
+        The number of bins.
+    """
+    def __init__(self, lo=0.0, hi=1.0, nbins=4096):
+        self.lo = float(lo)
+        self.hi = float(hi)
+        self.nbins = nbins
+        self.counts = np.zeros(nbins, dtype=np.int64)
+        self.n = 0
+        self.total = 0.0
+        self.total_sq = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+    @classmethod
+    def of(cls, values, *args, **kwargs):
+        """Create a histogram of `values`. See `Histogram` for arguments."""
+        h = cls(*args, **kwargs)
+        h.add(values)
+        return h
+
+    def state(self):
+        """Return the histogram as a dict of arrays, e.g. for ``np.savez``."""
+        return {'range': np.array([self.lo, self.hi]),
+                'counts': self.counts,
+                'n': np.array(self.n, dtype=np.int64),
+                'totals': np.array([self.total, self.total_sq]),
+                'extremes': np.array([self.min, self.max])}
+
+    @classmethod
+    def from_state(cls, state):
+        """Rebuild a histogram from the output of `Histogram.state`."""
+        lo, hi = state['range']
+        h = cls(lo, hi, len(state['counts']))
+        h.counts[:] = state['counts']
+        h.n = int(state['n'])
+        h.total, h.total_sq = (float(t) for t in state['totals'])
+        h.min, h.max = (float(e) for e in state['extremes'])
+        return h
+
+    @property
+    def edges(self):
+        return np.linspace(self.lo, self.hi, self.nbins + 1)
+
+    @property
+    def mean(self):
+        return self.total / self.n if self.n else np.nan
+
+    @property
+    def var(self):
+        """The (population) variance of the values."""
+        if not self.n:
+            return np.nan
+        return max(self.total_sq / self.n - self.mean ** 2, 0.0)
+
+    def add(self, values):
+        """Add an array of values to the histogram."""
+        values = np.ravel(values)
+        if values.size == 0:
+            return self
+        scale = self.nbins / (self.hi - self.lo)
+        index = ((values - self.lo) * scale).astype(np.intp)
+        np.clip(index, 0, self.nbins - 1, out=index)
+        self.counts += np.bincount(index, minlength=self.nbins)
+        self.n += values.size
+        as_float = values.astype(float)
+        self.total += float(as_float.sum())
+        self.total_sq += float(np.dot(as_float, as_float))
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        return self
+
+    def _check_compatible(self, other):
+        if (self.lo, self.hi, self.nbins) != (other.lo, other.hi, other.nbins):
+            raise ValueError('Cannot merge histograms with different bins.')
+
+    def __iadd__(self, other):
+        self._check_compatible(other)
+        self.counts += other.counts
+        self.n += other.n
+        self.total += other.total
+        self.total_sq += other.total_sq
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def __add__(self, other):
+        merged = Histogram(self.lo, self.hi, self.nbins)
+        merged += self
+        merged += other
+        return merged
+
+    def quantile(self, q):
+        """Estimate quantiles by linear interpolation within bins.
+
+        Parameters
+        ----------
+        q : float or array of float
+            The quantiles to compute, in [0, 1].
+
+        Returns
+        -------
+        values : float or array of float
+            The estimated quantiles, clipped to the exact data range.
+        """
+        if not self.n:
+            return np.full(np.shape(q), np.nan) if np.ndim(q) else np.nan
+        cumulative = np.concatenate(([0], np.cumsum(self.counts)))
+        edges = self.edges
+        values = np.interp(np.asarray(q, dtype=float) * self.n,
+                           cumulative, edges)
+        return np.clip(values, self.min, self.max)
+
+    def box_stats(self, label=None, whis=1.5):
+        """Compute the statistics drawn by a box plot.
+
+        Parameters
+        ----------
+        label : string, optional
+            The label of the box.
+        whis : float, optional
+            As in ``plt.boxplot``: whiskers extend to the most extreme
+            value within `whis` times the interquartile range of the box.
+
+        Returns
+        -------
+        stats : dict
+            Box statistics in the format expected by ``plt.bxp``. Outliers
+            are not included.
+        """
+        q1, med, q3 = self.quantile([0.25, 0.5, 0.75])
+        iqr = q3 - q1
+        lo_limit, hi_limit = q1 - whis * iqr, q3 + whis * iqr
+        edges = self.edges
+        nonempty = np.flatnonzero(self.counts)
+        if lo_limit <= self.min:
+            whislo = self.min
+        else:
+            # lowest occupied bin reaching above the limit
+            above = nonempty[edges[nonempty + 1] >= lo_limit]
+            whislo = max(edges[above[0]], lo_limit) if len(above) else q1
+        if hi_limit >= self.max:
+            whishi = self.max
+        else:
+            below = nonempty[edges[nonempty] <= hi_limit]
+            whishi = min(edges[below[-1] + 1], hi_limit) if len(below) else q3
+        stats = {'med': med, 'q1': q1, 'q3': q3, 'mean': self.mean,
+                 'whislo': min(whislo, q1), 'whishi': max(whishi, q3),
+                 'fliers': np.zeros(0)}
+        if label is not None:
+            stats['label'] = label
+        return stats
+
+
+def merge(histograms):
+    """Merge a sequence of compatible histograms into a new one."""
+    return functools.reduce(lambda a, b: a + b, histograms)
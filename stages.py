@@ -0,0 +1,161 @@
+"""Stage-by-stage evaluation of `cafe.encode_centro_telomeres` with caching.
+
+`encode_centro_telomeres` is a chain of stages, each depending on only some
+of the parameters. `EncodeStages` keeps the result of each stage, keyed by
+the parameters it depends on, so that changing one parameter recomputes
+only the stages downstream of it::
+
+    otsu threshold -> threshold(offset, factor) -> size filter(min_size)
+        -> distance map -> dilation(radius)
+    local mean(adapt_radius) -> threshold(telo_offset) -> depth map
+        -> opening(radius)
+
+Dilations and erosions are computed from distance maps (see `morphology`),
+which are kept, so that trying another radius only costs a comparison
+(and, for openings, the final dilation).
+"""
+
+import collections
+
+import numpy as np
+
+import adaptive
+import backends
+import cafe
+import morphology
+
+
+class EncodeStages(object):
+    """Compute the stages of `cafe.encode_centro_telomeres` with caching.
+
+    Parameters
+    ----------
+    image_centro : array
+        The grayscale channel for centromeres.
+    image_telo : array
+        The grayscale channel for telomeres.
+    maxsize : int or None, optional
+        The number of results to keep for each stage. 1 is enough to
+        follow a user moving one slider at a time; None keeps every result,
+        which is useful when exploring a parameter grid.
+    final_maxsize : int or None, optional
+        The number of results to keep for the final masks,
+        `centros_dilated` and `telos_opened`. There is one of these for
+        almost every point of a parameter grid, but each is cheap to
+        compute from the kept distance maps.
+    """
+    FINAL_STAGES = ('centros_dilated', 'telos_opened')
+
+    def __init__(self, image_centro, image_telo, maxsize=1, final_maxsize=1):
+        self.image_centro = image_centro
+        self.image_telo = image_telo
+        self.maxsize = maxsize
+        self.final_maxsize = final_maxsize
+        self._cache = collections.defaultdict(collections.OrderedDict)
+
+    def _memo(self, stage, key, func, *args):
+        """Return ``func(*args)``, cached under `stage` and `key`."""
+        cache = self._cache[stage]
+        if key in cache:
+            cache[key] = result = cache.pop(key)
+            return result
+        result = func(*args)
+        cache[key] = result
+        maxsize = (self.final_maxsize if stage in self.FINAL_STAGES else
+                   self.maxsize)
+        if maxsize is not None:
+            while len(cache) > maxsize:
+                cache.popitem(last=False)
+        return result
+
+    def clear(self):
+        """Discard all cached results."""
+        self._cache.clear()
+
+    def centro_threshold(self):
+        """Otsu's threshold of the centromere image."""
+        return self._memo('centro_threshold', (), backends.threshold_otsu,
+                          self.image_centro)
+
+    def centros(self, centro_offset=0.0, centro_factor=1.0):
+        """The thresholded centromere image."""
+        return self._memo('centros', (centro_offset, centro_factor),
+                          cafe.otsu, self.image_centro, centro_offset,
+                          centro_factor, self.centro_threshold())
+
+    def centros_filtered(self, centro_offset=0.0, centro_factor=1.0,
+                         centro_min_size=36):
+        """The centromeres after removing small objects."""
+        key = (centro_offset, centro_factor, centro_min_size)
+        return self._memo('centros_filtered', key,
+                          backends.remove_small_objects,
+                          self.centros(centro_offset, centro_factor),
+                          centro_min_size)
+
+    def centros_distance(self, centro_offset=0.0, centro_factor=1.0,
+                         centro_min_size=36):
+        """The distance from each pixel to the nearest centromere."""
+        key = (centro_offset, centro_factor, centro_min_size)
+        return self._memo('centros_distance', key, morphology.distance_to,
+                          self.centros_filtered(centro_offset, centro_factor,
+                                                centro_min_size))
+
+    def centros_dilated(self, centro_offset=0.0, centro_factor=1.0,
+                        centro_min_size=36, centro_radius=10):
+        """The neighbourhood of the centromeres."""
+        key = (centro_offset, centro_factor, centro_min_size, centro_radius)
+        distance = self.centros_distance(centro_offset, centro_factor,
+                                         centro_min_size)
+        return self._memo('centros_dilated', key,
+                          lambda: distance <= centro_radius)
+
+    def telo_background(self, telo_adapt_radius=49,
+                        telo_adapt_method='gaussian'):
+        """The local mean of the telomere image."""
+        return self._memo('telo_background',
+                          (telo_adapt_radius, telo_adapt_method),
+                          cafe.adaptive_background, self.image_telo,
+                          telo_adapt_radius, telo_adapt_method)
+
+    def telos(self, telo_offset=0.0, telo_adapt_radius=49,
+              telo_adapt_method='gaussian'):
+        """The adaptively thresholded telomere image."""
+        key = (telo_offset, telo_adapt_radius, telo_adapt_method)
+        background = self.telo_background(telo_adapt_radius,
+                                          telo_adapt_method)
+        return self._memo('telos', key, adaptive.above_local_mean,
+                          self.image_telo, background, telo_offset)
+
+    def telos_depth(self, telo_offset=0.0, telo_adapt_radius=49,
+                    telo_adapt_method='gaussian'):
+        """The distance from each telomere pixel to the background."""
+        key = (telo_offset, telo_adapt_radius, telo_adapt_method)
+        return self._memo('telos_depth', key, morphology.depth,
+                          self.telos(telo_offset, telo_adapt_radius,
+                                     telo_adapt_method))
+
+    def telos_opened(self, telo_offset=0.0, telo_adapt_radius=49,
+                     telo_open_radius=4, telo_adapt_method='gaussian'):
+        """The telomeres after a binary opening."""
+        key = (telo_offset, telo_adapt_radius, telo_open_radius,
+               telo_adapt_method)
+        depth = self.telos_depth(telo_offset, telo_adapt_radius,
+                                 telo_adapt_method)
+        return self._memo('telos_opened', key, lambda: morphology.dilate(
+                                        depth > telo_open_radius,
+                                        telo_open_radius))
+
+    def encode(self, centro_offset=0.0, centro_factor=1.0,
+               centro_min_size=36, centro_radius=10,
+               telo_offset=0.0, telo_adapt_radius=49, telo_open_radius=4,
+               telo_adapt_method='gaussian'):
+        """Compute `cafe.encode_centro_telomeres` from cached stages.
+
+        The parameters and output are the same as for
+        `cafe.encode_centro_telomeres`.
+        """
+        centros = self.centros_dilated(centro_offset, centro_factor,
+                                       centro_min_size, centro_radius)
+        telos = self.telos_opened(telo_offset, telo_adapt_radius,
+                                  telo_open_radius, telo_adapt_method)
+        return 2 * centros.astype(np.uint8) + telos
@@ -0,0 +1,95 @@
+"""Evaluate the centromere/telomere segmentation over a grid of parameters.
+
+Rather than calling `cafe.encode_centro_telomeres` once per grid point,
+a sweep keeps the intermediate results of `stages.EncodeStages` for each
+image: the Otsu threshold, the local mean of the telomere image for each
+adaptive radius, and the distance maps from which every dilation and
+erosion radius is read off. Only the stages downstream of a changed
+parameter are computed again.
+"""
+
+import inspect
+import itertools as it
+
+import numpy as np
+
+import stages
+
+
+PARAMETERS = [name for name in
+              inspect.signature(stages.EncodeStages.encode).parameters
+              if name != 'self']
+
+
+def parameter_grid(params):
+    """Expand lists of parameter values into every combination.
+
+    Parameters
+    ----------
+    params : dict of string to list
+        The values of each parameter.
+
+    Returns
+    -------
+    settings : list of dict
+        One dictionary of parameter values for each point of the grid.
+        The last parameter, in alphabetical order, varies fastest.
+    """
+    names = sorted(params)
+    return [dict(zip(names, values))
+            for values in it.product(*[params[n] for n in names])]
+
+
+def encode_measures(encoded):
+    """Summarise the output of `cafe.encode_centro_telomeres`.
+
+    Parameters
+    ----------
+    encoded : array of uint8
+        The encoded regions.
+
+    Returns
+    -------
+    measures : dict
+        The number of pixels in telomeres only, in centromere
+        neighbourhoods only, and in their overlap, and the fraction of
+        telomere pixels near centromeres.
+    """
+    counts = np.bincount(encoded.ravel(), minlength=4)
+    telomeres = counts[1] + counts[3]
+    return {'telomere_area': int(counts[1]),
+            'centromere_area': int(counts[2]),
+            'overlap_area': int(counts[3]),
+            'telomere_fraction_near_centromere':
+                counts[3] / float(telomeres) if telomeres else np.nan}
+
+
+def sweep_encode(image_centro, image_telo, settings, measure=encode_measures):
+    """Segment an image with many parameter settings.
+
+    Parameters
+    ----------
+    image_centro, image_telo : array
+        The centromere and telomere channels.
+    settings : list of dict
+        Keyword arguments to `cafe.encode_centro_telomeres`, e.g. from
+        `parameter_grid`.
+    measure : callable, optional
+        A function of the encoded regions returning a dictionary of
+        measurements.
+
+    Returns
+    -------
+    rows : list of dict
+        For each setting, its parameter values and measurements.
+    """
+    # keep the shared stages for the whole grid, but only the final masks
+    # of the current point, so memory doesn't grow with the grid size
+    encoder = stages.EncodeStages(image_centro, image_telo, maxsize=None,
+                                  final_maxsize=1)
+    rows = []
+    for setting in settings:
+        row = dict(setting)
+        row.update(measure(encoder.encode(**setting)))
+        rows.append(row)
+    return rows
@@ -0,0 +1 @@
+"""Tests for cafe, run with ``python -m pytest tests``."""
@@ -0,0 +1,43 @@
+"""Fixtures shared by the tests: small synthetic images and backends."""
+
+import pytest
+
+import backends
+import imsource
+
+from benchmarks import synthetic
+
+
+SHAPE = (128, 128)
+
+
+@pytest.fixture(autouse=True)
+def default_backends(monkeypatch):
+    """Ignore the backend choices saved by ``cafe calibrate``."""
+    monkeypatch.setattr(backends, '_choices', {})
+
+
+@pytest.fixture(scope='session')
+def channels():
+    """The channels of a 128x128 synthetic image, with many spots."""
+    return synthetic.synthetic_channels(SHAPE, density=2000, seed=0)
+
+
+@pytest.fixture(scope='session')
+def channels_3d():
+    """The channels of a small synthetic z-stack."""
+    return synthetic.synthetic_channels((12, 48, 48), density=2000,
+                                        nucleus_radius=12, seed=1)
+
+
+def _write_tiff(fn, image, **kwargs):
+    write = getattr(imsource.tifffile, 'imwrite', None)
+    if write is None:  # tifffile < 2018.10
+        write = imsource.tifffile.imsave
+    write(fn, image, **kwargs)
+
+
+@pytest.fixture(scope='session')
+def write_tiff():
+    """A function writing an image to a TIFF file, with tifffile options."""
+    return _write_tiff
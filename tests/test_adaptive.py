@@ -0,0 +1,71 @@
+import numpy as np
+from numpy import testing as npt
+from scipy import ndimage as nd
+from skimage import filters
+import pytest
+
+import adaptive
+
+
+def skimage_threshold_adaptive(image, block_size, method, offset):
+    """The baseline adaptive threshold from scikit-image."""
+    try:
+        from skimage.filters import threshold_local
+    except ImportError:  # scikit-image < 0.12
+        return filters.threshold_adaptive(image, block_size, method, offset)
+    return image > threshold_local(image, block_size, method, offset)
+
+
+def exact_box_mean(image, block_size):
+    """The local mean of an integer image, from exact integer box sums."""
+    r = block_size // 2
+    sums = np.pad(image.astype(np.int64), r, mode='symmetric')
+    for axis in range(image.ndim):
+        cumsum = np.cumsum(sums, axis=axis)
+        zero = np.zeros_like(np.take(cumsum, [0], axis=axis))
+        cumsum = np.concatenate([zero, cumsum], axis=axis)
+        n = cumsum.shape[axis]
+        sums = (np.take(cumsum, range(block_size, n), axis=axis) -
+                np.take(cumsum, range(n - block_size), axis=axis))
+    return sums / float(block_size) ** image.ndim
+
+
+@pytest.mark.parametrize('block_size, offset', [(11, 0.0), (49, 0.0),
+                                                (25, -3.0)])
+def test_threshold_adaptive_gaussian(channels, block_size, offset):
+    image = channels['telomere']
+    expected = skimage_threshold_adaptive(image, block_size, 'gaussian',
+                                          offset)
+    npt.assert_array_equal(adaptive.threshold_adaptive(image, block_size,
+                                                       'gaussian', offset),
+                           expected)
+
+
+@pytest.mark.parametrize('block_size, offset', [(11, 0.0), (49, 0.0),
+                                                (25, -3.0), (15, 0.5)])
+def test_threshold_adaptive_mean(channels, block_size, offset):
+    image = channels['telomere']
+    result = adaptive.threshold_adaptive(image, block_size, 'mean', offset)
+    threshold = exact_box_mean(image, block_size) - offset
+    npt.assert_array_equal(result, image > threshold)
+    # scikit-image's float convolutions can only disagree with the exact
+    # mean for pixels within rounding error of their threshold
+    expected = skimage_threshold_adaptive(image, block_size, 'mean', offset)
+    differ = result != expected
+    tolerance = 1e-9 * float(image.max())
+    assert np.all(np.abs(image[differ] - threshold[differ]) <= tolerance)
+
+
+@pytest.mark.parametrize('block_size', [10, 50])
+def test_threshold_adaptive_gaussian_even_block_size(channels, block_size):
+    image = channels['telomere']
+    expected = image > nd.gaussian_filter(image.astype(float),
+                                          (block_size - 1) / 6.0,
+                                          mode='reflect')
+    npt.assert_array_equal(adaptive.threshold_adaptive(image, block_size),
+                           expected)
+
+
+def test_threshold_adaptive_mean_even_block_size(channels):
+    with pytest.raises(ValueError):
+        adaptive.threshold_adaptive(channels['telomere'], 10, 'mean')
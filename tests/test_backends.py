@@ -0,0 +1,56 @@
+import numpy as np
+from numpy import testing as npt
+import pytest
+
+import backends
+
+
+CASES = [((128, 128), np.uint16)] + backends.VALIDATION_CASES
+
+
+@pytest.mark.parametrize('shape, dtype', CASES)
+@pytest.mark.parametrize('operation', list(backends.REFERENCE))
+def test_implementations(operation, shape, dtype):
+    image, mask = backends.calibration_images(shape, dtype=dtype)
+    args = backends._calls(image, mask)[operation]
+    impls = backends._registry[operation]
+    reference = backends._output_mask(
+                    operation, impls[backends.REFERENCE[operation]](*args),
+                    args)
+    for name, func in impls.items():
+        npt.assert_array_equal(backends._output_mask(operation, func(*args),
+                                                     args),
+                               reference, err_msg=name)
+
+
+def test_calibrate(tmp_path, monkeypatch):
+    # an implementation that is fast, but wrong
+    wrong = lambda mask: backends.label(mask[::-1])
+    monkeypatch.setitem(backends._registry, 'label',
+                        dict(backends._registry['label'], wrong=wrong))
+    fn = str(tmp_path / 'backends.json')
+    results = backends.calibrate([(64, 64)], repeat=1, filename=fn)
+    assert results['mismatches']['label'] == ['wrong']
+    for operation, name in results['choices'].items():
+        assert name in backends._registry[operation]
+        assert name not in results['mismatches'].get(operation, [])
+    validated = [(tuple(shape), dtype)
+                 for shape, dtype in results['validated']]
+    assert validated == [((64, 64), 'uint16'), ((16, 64, 64), 'uint16'),
+                         ((256, 256), 'uint8'), ((256, 256), 'float64')]
+    assert backends.load(fn) == results['choices']
+    assert backends.chosen() == results['choices']
+
+
+def test_load_unreadable(tmp_path):
+    fn = str(tmp_path / 'backends.json')
+    assert backends.load(fn) == {}
+    with open(fn, 'w') as fout:
+        fout.write('{"choices": {"label"')
+    assert backends.load(fn) == {}
+
+
+def test_unavailable_choice(monkeypatch):
+    monkeypatch.setattr(backends, '_choices', {'label': 'missing'})
+    assert backends.get('label') is backends._registry['label']['scipy']
+    assert backends.chosen()['label'] == backends.available('label')[0]
@@ -0,0 +1,148 @@
+import time
+import random
+import threading
+from concurrent import futures
+
+import pytest
+
+import batch
+
+
+def square(x):
+    return x * x
+
+
+def slow_square(x):
+    time.sleep(random.uniform(0, 0.01))
+    return x * x
+
+
+def fail_on_three(x):
+    if x == 3:
+        raise ValueError('cannot process %i' % x)
+    return x
+
+
+class Counted(object):
+    """An iterable recording how many of its items were consumed."""
+    def __init__(self, n):
+        self.n = n
+        self.consumed = 0
+
+    def __iter__(self):
+        for i in range(self.n):
+            self.consumed += 1
+            yield i
+
+
+def test_n_jobs():
+    assert batch.n_jobs(None) == 1
+    assert batch.n_jobs(3) == 3
+    assert batch.n_jobs(0) >= 1
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_bounded_map(jobs):
+    assert list(batch.bounded_map(slow_square, range(20), jobs)) == \
+        [i * i for i in range(20)]
+
+
+def test_bounded_map_lazy():
+    items = Counted(50)
+    with futures.ThreadPoolExecutor(4) as executor:
+        for i, result in enumerate(batch.bounded_map(
+                slow_square, items, max_in_flight=3, executor=executor)):
+            assert result == i * i
+            assert items.consumed - i <= 3
+
+
+def test_bounded_map_error():
+    results = batch.bounded_map(fail_on_three, range(6), 2)
+    assert [next(results) for i in range(3)] == [0, 1, 2]
+    with pytest.raises(ValueError):
+        next(results)
+
+
+def test_prefetch():
+    items = Counted(30)
+    loaded = []
+
+    def load(x):
+        loaded.append(x)
+        return slow_square(x)
+
+    for i, result in enumerate(batch.prefetch(load, items, depth=2)):
+        assert result == i * i
+        # the item in use and at most `depth` items ahead are loaded
+        assert len(loaded) - i <= 3
+    assert sorted(loaded) == list(range(30))
+
+
+def test_prefetch_error():
+    results = batch.prefetch(fail_on_three, range(6))
+    assert [next(results) for i in range(3)] == [0, 1, 2]
+    with pytest.raises(ValueError):
+        next(results)
+
+
+def test_prefetch_no_depth():
+    thread = []
+    results = batch.prefetch(lambda x: thread.append(threading.get_ident()),
+                             range(3), depth=0)
+    list(results)
+    assert thread == [threading.get_ident()] * 3
+
+
+@pytest.mark.parametrize('max_pending', [0, 1, 4])
+def test_async_writer_order(max_pending):
+    written = []
+    with batch.AsyncWriter(max_pending) as writer:
+        for i in range(20):
+            writer.submit(written.append, i)
+    assert written == list(range(20))
+
+
+def test_async_writer_error():
+    written = []
+
+    def write(x):
+        fail_on_three(x)
+        written.append(x)
+
+    writer = batch.AsyncWriter(max_pending=8)
+    for i in range(5):
+        writer.submit(write, i)
+    with pytest.raises(ValueError):
+        writer.close()
+    # outputs after the failing one are skipped
+    assert written == [0, 1, 2]
+
+
+def test_async_writer_error_on_submit():
+    writer = batch.AsyncWriter(max_pending=1)
+    writer.submit(fail_on_three, 3)
+    with pytest.raises(ValueError):
+        # the failure is raised by a later submit at the latest
+        for i in range(100):
+            writer.submit(time.sleep, 0.001)
+    writer.close()
+
+
+def test_async_writer_backpressure():
+    release = threading.Event()
+    writer = batch.AsyncWriter(max_pending=1)
+    writer.submit(release.wait)  # being written
+    writer.submit(square, 1)  # waiting
+    submitted = threading.Event()
+
+    def submit():
+        writer.submit(square, 2)
+        submitted.set()
+
+    thread = threading.Thread(target=submit)
+    thread.start()
+    assert not submitted.wait(0.1)
+    release.set()
+    assert submitted.wait(5)
+    thread.join()
+    writer.close()
@@ -0,0 +1,23 @@
+import numpy as np
+from numpy import testing as npt
+
+import cafe
+
+from benchmarks import synthetic
+
+
+def test_get_chromatin_rgb(channels):
+    rgb = synthetic.rnapii_image(channels)[..., ::-1]
+    expected = cafe.get_chromatin(channels['chromatin'])
+    npt.assert_array_equal(cafe.get_chromatin(rgb), expected)
+    npt.assert_array_equal(cafe.get_chromatin(rgb, channel_axis=-1),
+                           expected)
+    channels_first = np.moveaxis(rgb, -1, 0)
+    npt.assert_array_equal(cafe.get_chromatin(channels_first,
+                                              channel_axis=0), expected)
+
+
+def test_get_chromatin_three_planes(channels_3d):
+    stack = channels_3d['chromatin'][:3]
+    chrs = cafe.get_chromatin(stack, size_filter=16, channel_axis=None)
+    assert chrs.shape == stack.shape
@@ -0,0 +1,162 @@
+import os
+
+import numpy as np
+from numpy import testing as npt
+import pytest
+
+import cafe_main
+import trf1
+
+from benchmarks import synthetic
+
+
+def run(*argv):
+    cafe_main.main(['cafe'] + [str(a) for a in argv])
+
+
+def not_called(*args, **kwargs):
+    raise AssertionError('an image was processed again')
+
+
+@pytest.fixture
+def trf_images(channels, tmp_path, write_tiff):
+    """Three distinct RGB images for ``cafe trf``, by filename."""
+    image = synthetic.trf_image(channels)
+    directory = tmp_path / 'images'
+    directory.mkdir()
+    images = {}
+    for name, im in [('a0', image), ('a1', image[::-1]),
+                     ('b0', np.rot90(image))]:
+        fn = str(directory / (name + '.tif'))
+        write_tiff(fn, np.ascontiguousarray(im), photometric='rgb')
+        images[fn] = im
+    return images
+
+
+def check_trf_table(table, images, conditions):
+    assert sorted(set(zip(table['filename'], table['condition']))) == \
+        sorted(conditions)
+    for fn, condition in conditions:
+        rows = table[(table['filename'] == fn) &
+                     (table['condition'] == condition)]
+        expected = trf1.trf_quantify(images[fn])
+        assert len(rows) == len(expected) > 0
+        for name, _ in trf1.TRF_FIELDS:
+            npt.assert_allclose(rows[name], expected[name], err_msg=name)
+
+
+def test_trf(trf_images, tmp_path, monkeypatch):
+    pd = pytest.importorskip('pandas')
+    pytest.importorskip('pyarrow')
+    a0, a1, b0 = sorted(trf_images)
+    directory = os.path.dirname(a0)
+    out = str(tmp_path / 'trf.parquet')
+    groups = ['-g', 'a', os.path.join(directory, 'a*.tif'),
+              '-g', 'b', os.path.join(directory, 'b*.tif'),
+              '-g', 'first', os.path.join(directory, '*0.tif')]
+    run('trf', '-o', out, *groups)
+    conditions = [(a0, 'a'), (a1, 'a'), (b0, 'b'), (a0, 'first'),
+                  (b0, 'first')]
+    check_trf_table(pd.read_parquet(out), trf_images, conditions)
+    assert len([fn for fn in os.listdir(out)
+                if fn.startswith('part-')]) == 5
+    # a rerun finds every image done
+    monkeypatch.setattr(cafe_main, 'trf_image', not_called)
+    run('trf', '-o', out, *groups)
+    # the results of images and conditions that were dropped are removed
+    run('trf', '-o', out, *groups[:3])
+    check_trf_table(pd.read_parquet(out), trf_images, [(a0, 'a'), (a1, 'a')])
+    assert sorted(os.listdir(out)) == sorted(
+                ['_manifest.json'] +
+                [cafe_main.trf_part_name(fn, 'a') for fn in (a0, a1)])
+
+
+def test_trf_changed_image(trf_images, tmp_path, write_tiff, monkeypatch):
+    pd = pytest.importorskip('pandas')
+    pytest.importorskip('pyarrow')
+    a0, a1, b0 = sorted(trf_images)
+    out = str(tmp_path / 'trf.parquet')
+    groups = ['-g', 'all', os.path.join(os.path.dirname(a0), '*.tif')]
+    run('trf', '-o', out, *groups)
+    # only a changed image is processed again
+    write_tiff(a1, np.ascontiguousarray(trf_images[b0]), photometric='rgb')
+    trf_images[a1] = trf_images[b0]
+    processed = []
+
+    def trf_image(fn, image=None):
+        processed.append(fn)
+        return trf1.trf_quantify(trf_images[fn])
+
+    monkeypatch.setattr(cafe_main, 'trf_image', trf_image)
+    run('trf', '-o', out, *groups)
+    assert processed == [a1]
+    check_trf_table(pd.read_parquet(out), trf_images,
+                    [(fn, 'all') for fn in (a0, a1, b0)])
+
+
+PRESET = {'centro_min_size': 10, 'centro_radius': 5, 'telo_offset': 0.0,
+          'telo_adapt_radius': 24, 'telo_open_radius': 1}
+
+
+@pytest.fixture
+def spot_directories(channels, tmp_path, write_tiff):
+    """Two directories of images for ``cafe interactive``."""
+    directories = []
+    for i in range(2):
+        d = tmp_path / ('cells%i' % i)
+        d.mkdir()
+        names = ['rnapii', 'telomere', 'centromere', 'chromatin']
+        for j, name in enumerate(names):
+            write_tiff(str(d / ('%i_%s.tif' % (j, name))),
+                       np.ascontiguousarray(np.rot90(channels[name], i)))
+        directories.append(str(d))
+    return directories
+
+
+def write_preset(fn, params):
+    cafe_main.interactive.save_preset(fn, params)
+    return fn
+
+
+def expected_measurements(d, params, tmp_path):
+    """The measurements of `compute_spot_stats` on directory `d`."""
+    out = tmp_path / ('expected-' + os.path.basename(d))
+    out.mkdir()
+    rgb, target = cafe_main.load_directory(d)
+    cafe_main.interactive.compute_spot_stats(rgb, target, str(out), params)
+    with open(str(out / 'measure.txt')) as fin:
+        return fin.read()
+
+
+def measurements(d):
+    with open(os.path.join(d, 'measure.txt')) as fin:
+        return fin.read()
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_interactive_headless(spot_directories, tmp_path, monkeypatch,
+                              jobs):
+    preset = write_preset(str(tmp_path / 'preset.json'), PRESET)
+    run('interactive', '--headless', '-p', preset, '-j', jobs,
+        *spot_directories)
+    for d in spot_directories:
+        assert measurements(d) == expected_measurements(d, PRESET, tmp_path)
+        assert os.path.exists(os.path.join(d, 'mask.png'))
+    # measured directories are skipped, unless the preset changes
+    measured = []
+
+    def measure_directory(d, **kwargs):
+        measured.append(d)
+        return d
+
+    monkeypatch.setattr(cafe_main, 'measure_directory', measure_directory)
+    run('interactive', '--headless', '-p', preset, *spot_directories)
+    assert measured == []
+    write_preset(preset, dict(PRESET, centro_radius=8))
+    run('interactive', '--headless', '-p', preset, *spot_directories)
+    assert measured == spot_directories
+
+
+def test_interactive_headless_requires_preset(spot_directories):
+    with pytest.raises(SystemExit):
+        run('interactive', '--headless', *spot_directories)
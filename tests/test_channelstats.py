@@ -0,0 +1,74 @@
+import numpy as np
+from numpy import testing as npt
+from skimage import exposure
+from skimage.filters import threshold_otsu
+import pytest
+
+import channelstats
+
+
+def random_image(dtype, shape=(64, 64), seed=0):
+    random = np.random.RandomState(seed)
+    if np.dtype(dtype).kind == 'f':
+        return random.normal(0.5, 0.2, shape).astype(dtype)
+    info = np.iinfo(dtype)
+    lo = max(info.min, -1000)
+    hi = min(info.max, 40000)
+    # bimodal, to have a meaningful threshold
+    image = np.where(random.rand(*shape) > 0.7,
+                     random.randint(lo + (hi - lo) // 2, hi, shape),
+                     random.randint(lo, lo + (hi - lo) // 3, shape))
+    return image.astype(dtype)
+
+
+DTYPES = [np.uint8, np.uint16, np.int8, np.int16, np.int32,
+          np.float32, np.float64]
+
+
+@pytest.mark.parametrize('dtype', DTYPES)
+def test_channel_stats(dtype):
+    image = random_image(dtype)
+    stats = channelstats.channel_stats(image)
+    hist, bin_centers = exposure.histogram(image)
+    assert stats.min == image.min() and stats.max == image.max()
+    npt.assert_array_equal(stats.hist, hist)
+    npt.assert_allclose(stats.bin_centers, bin_centers)
+
+
+@pytest.mark.parametrize('dtype', DTYPES)
+def test_threshold_otsu(dtype):
+    image = random_image(dtype)
+    npt.assert_allclose(channelstats.threshold_otsu(image),
+                        threshold_otsu(image), rtol=1e-12)
+
+
+def test_threshold_otsu_constant():
+    for image in [np.full((8, 8), 3, np.uint16), np.full((8, 8), 0.5)]:
+        with pytest.raises(ValueError):
+            channelstats.threshold_otsu(image)
+
+
+def test_merge():
+    image = random_image(np.int16)
+    top = channelstats.channel_stats(image[:20])
+    bottom = channelstats.channel_stats(image[20:])
+    merged = top.merge(bottom)
+    whole = channelstats.channel_stats(image)
+    assert (merged.min, merged.max) == (whole.min, whole.max)
+    npt.assert_array_equal(merged.hist, whole.hist)
+    npt.assert_array_equal(merged.bin_centers, whole.bin_centers)
+
+
+def baseline_rescale_to_uint8(image):
+    """The per-channel rescaling that `rescale_to_uint8` replaced."""
+    channel_mins = image.min(axis=0).min(axis=0)[np.newaxis, np.newaxis, :]
+    channel_maxs = image.max(axis=0).max(axis=0)[np.newaxis, np.newaxis, :]
+    return ((image.astype(float) - channel_mins) * 255 /
+            (channel_maxs - channel_mins)).astype(np.uint8)
+
+
+@pytest.mark.parametrize('dtype', [np.uint16, np.int16, np.float32])
+def test_rescale_to_uint8(dtype):
+    image = np.stack([random_image(dtype, seed=i) for i in range(3)], axis=-1)
+    npt.assert_array_equal(channelstats.rescale_to_uint8(image),
+                           baseline_rescale_to_uint8(image))
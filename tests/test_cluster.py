@@ -0,0 +1,90 @@
+import numpy as np
+from numpy import testing as npt
+import pytest
+
+distributed = pytest.importorskip('dask.distributed')
+
+import cafe
+import cluster
+import sweep
+import trf1
+
+from benchmarks import synthetic
+
+
+@pytest.fixture(scope='module')
+def client():
+    with distributed.Client(processes=False, n_workers=1,
+                            threads_per_worker=2) as client:
+        yield client
+
+
+@pytest.fixture
+def images(channels, tmp_path, write_tiff):
+    """Two RGB images for trf1, and the same for cafe, by filename."""
+    images = {}
+    for i in range(2):
+        for name, image in [('trf', synthetic.trf_image(channels)),
+                            ('rnapii', synthetic.rnapii_image(channels))]:
+            fn = str(tmp_path / ('%s%i.tif' % (name, i)))
+            image = np.ascontiguousarray(np.rot90(image, i))
+            write_tiff(fn, image, photometric='rgb')
+            images[fn] = image
+    return images
+
+
+def named(images, prefix):
+    return sorted(fn for fn in images if prefix in fn)
+
+
+def test_trf_dataframe(client, images):
+    first, second = named(images, 'trf')
+    # an image in two groups is measured for both conditions
+    table = cluster.trf_dataframe(client, [('a', [first, second]),
+                                           ('b', [first])])
+    assert list(table.columns[:2]) == ['filename', 'condition']
+    assert list(table['condition'].cat.categories) == ['a', 'b']
+    conditions = [(first, 'a'), (second, 'a'), (first, 'b')]
+    assert sorted(set(zip(table['filename'], table['condition']))) == \
+        sorted(conditions)
+    for fn, condition in conditions:
+        rows = table[(table['filename'] == fn) &
+                     (table['condition'] == condition)]
+        expected = trf1.trf_quantify(images[fn])
+        assert len(rows) == len(expected) > 0
+        for name, _ in trf1.TRF_FIELDS:
+            npt.assert_allclose(rows[name], expected[name], err_msg=name)
+
+
+def test_rnapii_dataframe(client, images):
+    filenames = named(images, 'rnapii')
+    table = cluster.rnapii_dataframe(client, filenames)
+    assert list(table['filename']) == [fn for fn in filenames
+                                       for region in range(2)]
+    for fn in filenames:
+        rows = table[table['filename'] == fn]
+        values = cafe.rnapii_centromere_vs_chromatin(images[fn])
+        assert list(rows['region']) == ['centromere', 'chromatin']
+        npt.assert_array_equal(rows['n'], [len(v) for v in values])
+        npt.assert_allclose(rows['mean'], [np.mean(v) for v in values])
+        npt.assert_allclose(rows['median'], [np.median(v) for v in values])
+
+
+def test_encode_dataframe(client, images):
+    filenames = named(images, 'trf')
+    params = {'centro_radius': 5, 'telo_adapt_radius': 25}
+    # telomeres in channel 1, centromeres from the TRF1 channel 0
+    table = cluster.encode_dataframe(client, filenames, **params)
+    for fn, (_, row) in zip(filenames, table.iterrows()):
+        image = images[fn]
+        expected = sweep.encode_measures(cafe.encode_centro_telomeres(
+                        image[..., 0], image[..., 1], **params))
+        for name, value in expected.items():
+            npt.assert_equal(row[name], value)
+
+
+def test_map_images():
+    # a local cluster of worker processes
+    results = cluster.map_images(len, ['a', 'bb', 'ccc', ''] * 3,
+                                 n_workers=1, max_in_flight=2)
+    assert list(results) == [1, 2, 3, 0] * 3
@@ -0,0 +1,97 @@
+import numpy as np
+from numpy import testing as npt
+import pytest
+
+import imsource
+import trf1
+
+from benchmarks import synthetic
+
+
+def write_compressed(write_tiff, fn, image, **kwargs):
+    try:
+        write_tiff(fn, image, compression='zlib', **kwargs)
+    except TypeError:  # tifffile < 2019.1
+        write_tiff(fn, image, compress=6, **kwargs)
+
+
+@pytest.fixture
+def rgb(channels):
+    return synthetic.trf_image(channels)
+
+
+def test_memory_mapped_rgb(rgb, tmp_path, write_tiff):
+    fn = str(tmp_path / 'rgb.tif')
+    write_tiff(fn, rgb, photometric='rgb')
+    with imsource.ImageSource(fn) as source:
+        assert source.memory_mapped
+        assert source.shape == rgb.shape and source.dtype == rgb.dtype
+        for c in range(3):
+            npt.assert_array_equal(source[..., c], rgb[..., c])
+        npt.assert_array_equal(source.channel(-1), rgb[..., 2])
+        npt.assert_array_equal(np.asarray(source), rgb)
+        npt.assert_array_equal(source[10:20, 5], rgb[10:20, 5])
+
+
+@pytest.mark.parametrize('compressed', [False, True])
+def test_channel_pages(rgb, tmp_path, write_tiff, compressed):
+    """Images with one channel per page are presented channels last."""
+    fn = str(tmp_path / 'pages.tif')
+    pages = np.ascontiguousarray(np.moveaxis(rgb, -1, 0))
+    if compressed:
+        write_compressed(write_tiff, fn, pages)
+    else:
+        write_tiff(fn, pages)
+    with imsource.ImageSource(fn) as source:
+        assert source.memory_mapped != compressed
+        assert source.shape == rgb.shape
+        for c in range(3):
+            npt.assert_array_equal(source[..., c], rgb[..., c])
+        npt.assert_array_equal(np.asarray(source), rgb)
+
+
+def test_compressed_rgb(rgb, tmp_path, write_tiff):
+    fn = str(tmp_path / 'rgb.tif')
+    write_compressed(write_tiff, fn, rgb, photometric='rgb')
+    with imsource.ImageSource(fn) as source:
+        assert not source.memory_mapped
+        npt.assert_array_equal(source[..., 1], rgb[..., 1])
+
+
+def test_grayscale(channels, tmp_path, write_tiff):
+    image = channels['chromatin']
+    fn = str(tmp_path / 'gray.tif')
+    write_tiff(fn, image)
+    with imsource.ImageSource(fn) as source:
+        assert source.ndim == 2
+        npt.assert_array_equal(source[..., 0], image)
+        npt.assert_array_equal(np.asarray(source), image)
+        with pytest.raises(IndexError):
+            source.channel(1)
+
+
+def test_preload(rgb, tmp_path, write_tiff):
+    fn = str(tmp_path / 'rgb.tif')
+    write_tiff(fn, rgb, photometric='rgb')
+    source = imsource.ImageSource(fn).preload([0, 2])
+    assert not source.memory_mapped
+    npt.assert_array_equal(source[..., 0], rgb[..., 0])
+    npt.assert_array_equal(source[..., 2], rgb[..., 2])
+    with pytest.raises(ValueError):
+        source[..., 1]
+    source.close()
+
+
+def test_trf_quantify(rgb, tmp_path, write_tiff):
+    """cafe and trf1 read only the channels they need from a source."""
+    fn = str(tmp_path / 'rgb.tif')
+    write_tiff(fn, rgb, photometric='rgb')
+    expected = trf1.trf_quantify(rgb)
+    with imsource.ImageSource(fn) as source:
+        props = trf1.trf_quantify(source)
+    with imsource.ImageSource(fn).preload([0, 2]) as source:
+        preloaded = trf1.trf_quantify(source)
+    for name, _ in trf1.TRF_FIELDS:
+        npt.assert_array_equal(props[name], expected[name], err_msg=name)
+        npt.assert_array_equal(preloaded[name], expected[name],
+                               err_msg=name)
@@ -0,0 +1,56 @@
+import numpy as np
+from numpy import testing as npt
+from scipy import ndimage as nd
+from skimage import measure
+
+import cafe
+import labelstats
+
+
+Q = [0.05, 0.25, 0.5, 0.75, 0.95]
+
+
+def objects(channels):
+    """Labelled centromeres, with gaps in the label IDs."""
+    centro = cafe.centromere_chromatin_masks(channels['centromere'],
+                                             channels['chromatin'])[0]
+    labels = nd.label(centro)[0]
+    return np.where(labels % 3 == 0, 0, 2 * labels)
+
+
+def test_quantile_stats(channels):
+    labels = objects(channels)
+    target = channels['rnapii']
+    stats = labelstats.quantile_stats(labels, target, Q)
+    props = measure.regionprops(labels, intensity_image=target)
+    assert len(props) > 10
+    npt.assert_array_equal(stats['label'], [p.label for p in props])
+    npt.assert_array_equal(stats['area'], [p.area for p in props])
+    npt.assert_allclose(stats['mean'], [p.mean_intensity for p in props])
+    expected = [np.percentile(target[labels == i], [100 * q for q in Q])
+                for i in stats['label']]
+    npt.assert_allclose(stats['quantiles'], expected)
+
+
+def test_quantile_stats_ties_and_single_pixels():
+    labels = np.array([[1, 1, 0, 4],
+                       [1, 1, 0, 0],
+                       [0, 0, 7, 7]])
+    image = np.array([[3, 3, 9, 5],
+                      [3, 1, 9, 9],
+                      [9, 9, 2, 2]], dtype=np.uint8)
+    stats = labelstats.quantile_stats(labels, image, Q)
+    npt.assert_array_equal(stats['label'], [1, 4, 7])
+    npt.assert_array_equal(stats['area'], [4, 1, 2])
+    npt.assert_allclose(stats['mean'], [2.5, 5, 2])
+    npt.assert_allclose(stats['quantiles'],
+                        [np.percentile(image[labels == i],
+                                       [100 * q for q in Q])
+                         for i in [1, 4, 7]])
+
+
+def test_quantile_stats_empty():
+    labels = np.zeros((8, 8), int)
+    stats = labelstats.quantile_stats(labels, np.ones((8, 8)), Q)
+    assert len(stats['label']) == len(stats['area']) == 0
+    assert stats['quantiles'].shape == (0, len(Q))
@@ -0,0 +1,96 @@
+import os
+import json
+
+import manifest
+
+
+def write(fn, contents):
+    with open(fn, 'w') as fout:
+        fout.write(contents)
+
+
+def inputs(tmp_path, n=3):
+    filenames = [str(tmp_path / ('image%i.tif' % i)) for i in range(n)]
+    for i, fn in enumerate(filenames):
+        write(fn, 'image %i' % i)
+    return filenames
+
+
+def test_resume(tmp_path):
+    filenames = inputs(tmp_path)
+    fn = str(tmp_path / 'manifest.json')
+    record = manifest.Manifest(fn, params={'bins': 10})
+    assert record.pending(filenames) == filenames
+    # interrupted after the first two files
+    for name in filenames[:2]:
+        record.record(name, result=os.path.basename(name))
+    record = manifest.Manifest(fn, params={'bins': 10})
+    assert record.pending(filenames) == filenames[2:]
+    assert record.get(filenames[0])['result'] == 'image0.tif'
+    assert manifest.Manifest(fn, params={'bins': 20}).pending(
+                filenames) == filenames
+
+
+def test_changed_files(tmp_path):
+    filenames = inputs(tmp_path)
+    fn = str(tmp_path / 'manifest.json')
+    record = manifest.Manifest(fn)
+    for name in record.pending(filenames):
+        record.record(name)
+    # touched, but unchanged
+    st = os.stat(filenames[0])
+    os.utime(filenames[0], (st.st_atime, st.st_mtime + 10))
+    # same size, other contents
+    write(filenames[1], 'image x')
+    record = manifest.Manifest(fn)
+    assert record.pending(filenames) == [filenames[1]]
+
+
+def test_snapshot_before_processing(tmp_path):
+    filenames = inputs(tmp_path, 1)
+    fn = str(tmp_path / 'manifest.json')
+    record = manifest.Manifest(fn)
+    pending = record.pending(filenames)
+    # the file changes while it is processed
+    write(filenames[0], 'image x')
+    record.record(pending[0])
+    assert manifest.Manifest(fn).pending(filenames) == filenames
+
+
+def test_journal(tmp_path):
+    filenames = inputs(tmp_path)
+    fn = str(tmp_path / 'manifest.json')
+    record = manifest.Manifest(fn)
+    for name in record.pending(filenames):
+        record.record(name)
+    # entries are appended to the journal, not to the manifest itself
+    assert not os.path.exists(fn)
+    with open(record.journal) as fin:
+        assert len(fin.readlines()) == 3
+    # a run interrupted while writing an entry
+    with open(record.journal, 'a') as fout:
+        fout.write('["%s", {"size"' % filenames[0])
+    record = manifest.Manifest(fn)
+    assert record.pending(filenames) == []
+    assert not os.path.exists(record.journal)
+    with open(fn) as fin:
+        assert len(json.load(fin)['files']) == 3
+
+
+def test_retain(tmp_path):
+    filenames = inputs(tmp_path)
+    fn = str(tmp_path / 'manifest.json')
+    record = manifest.Manifest(fn)
+    for name in record.pending(filenames):
+        record.record(name)
+    record.retain(filenames[1:])
+    record = manifest.Manifest(fn)
+    assert record.get(filenames[0]) is None
+    assert record.pending(filenames) == filenames[:1]
+
+
+def test_version_key_modules():
+    assert (manifest.version_key(modules=['manifest']) !=
+            manifest.version_key(modules=['manifest', 'batch']))
+    assert (manifest.version_key({'a': 1}) !=
+            manifest.version_key({'a': 2}))
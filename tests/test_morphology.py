@@ -0,0 +1,38 @@
+from numpy import testing as npt
+from scipy import ndimage as nd
+from skimage import filters
+import pytest
+
+import cafe
+import morphology
+
+
+def centromere_mask(channels):
+    image = channels['centromere']
+    return image > filters.threshold_otsu(image)
+
+
+@pytest.mark.parametrize('radius', [1, 3, 10])
+def test_dilate(channels, radius):
+    mask = centromere_mask(channels)
+    expected = nd.binary_dilation(mask, cafe.structuring_element(radius))
+    npt.assert_array_equal(morphology.dilate(mask, radius), expected)
+
+
+@pytest.mark.parametrize('radius, iterations', [(1, 1), (2, 2), (4, 1)])
+def test_opening(channels, radius, iterations):
+    mask = morphology.dilate(centromere_mask(channels), 2)
+    expected = nd.binary_opening(mask, cafe.structuring_element(radius),
+                                 iterations=iterations)
+    npt.assert_array_equal(morphology.opening(mask, radius, iterations),
+                           expected)
+
+
+@pytest.mark.parametrize('radius', [1, 3])
+def test_morphology_3d(channels_3d, radius):
+    mask = centromere_mask(channels_3d)
+    strel = cafe.structuring_element(radius, ndim=3)
+    npt.assert_array_equal(morphology.dilate(mask, radius),
+                           nd.binary_dilation(mask, strel))
+    npt.assert_array_equal(morphology.opening(mask, radius),
+                           nd.binary_opening(mask, strel))
@@ -0,0 +1,106 @@
+import threading
+import tracemalloc
+
+import profiling
+
+
+def work(item):
+    with profiling.stage('outer'):
+        with profiling.stage('inner'):
+            data = [0] * 100000
+    return len(data) + item
+
+
+def test_stages():
+    assert profiling.stage('a') is profiling.stage('b')
+    profiling.enable()
+    try:
+        with profiling.image('x.tif'):
+            work(0)
+    finally:
+        records = profiling.disable()
+    assert not profiling.enabled()
+    assert [r['stage'] for r in records] == ['inner', 'outer']
+    assert all(r['image'] == 'x.tif' for r in records)
+    inner, outer = records
+    assert outer['wall'] >= inner['wall']
+    assert outer['peak'] >= inner['peak'] >= 800000
+
+
+def test_other_threads_not_recorded():
+    profiling.enable()
+    try:
+        thread = threading.Thread(target=work, args=(0,))
+        thread.start()
+        thread.join()
+    finally:
+        records = profiling.disable()
+    assert records == []
+
+
+def test_profiled_threads():
+    """Concurrent profiled calls don't mix their records."""
+    n = 4
+    barrier = threading.Barrier(n)
+
+    def synchronised(item):
+        barrier.wait()
+        with profiling.stage('stage%i' % item):
+            barrier.wait()
+            result = work(item)
+            barrier.wait()
+        return result
+
+    profiled = profiling.Profiled(synchronised)
+    results = [None] * n
+
+    def run(i):
+        results[i] = profiled(i)
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(n)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for i, (result, records) in enumerate(results):
+        assert result == 100000 + i
+        assert [r['stage'] for r in records] == ['inner', 'outer',
+                                                 'stage%i' % i]
+        assert all(r['image'] == str(i) for r in records)
+    assert not tracemalloc.is_tracing()
+
+
+def test_tracing_until_last_thread():
+    profiling.enable()
+    started = threading.Event()
+    stop = threading.Event()
+    other = []
+
+    def profile_other():
+        profiling.enable()
+        started.set()
+        stop.wait()
+        other.extend(profiling.disable())
+
+    thread = threading.Thread(target=profile_other)
+    thread.start()
+    started.wait()
+    profiling.disable()
+    assert tracemalloc.is_tracing()
+    stop.set()
+    thread.join()
+    assert not tracemalloc.is_tracing()
+
+
+def test_session(tmp_path):
+    session = profiling.Session()
+    with session:
+        wrapped = session.wrap(work)
+        results = list(session.unwrap(map(wrapped, range(3))))
+    assert results == [100000, 100001, 100002]
+    assert len(session.records) == 6
+    assert 'inner' in session.summary()
+    fn = str(tmp_path / 'profile.csv')
+    session.write(fn)
+    with open(fn) as fin:
+        assert len(fin.readlines()) == 7
@@ -0,0 +1,56 @@
+import numpy as np
+from numpy import testing as npt
+
+import cafe
+import runlength
+
+from benchmarks import synthetic
+
+
+def masks(channels):
+    centro, chrom = cafe.centromere_chromatin_masks(channels['centromere'],
+                                                    channels['chromatin'])
+    shape = centro.shape
+    return [centro, chrom, np.zeros(shape, bool), np.ones(shape, bool)]
+
+
+def test_roundtrip(channels, tmp_path):
+    for i, mask in enumerate(masks(channels)):
+        encoded = runlength.encode(mask)
+        npt.assert_array_equal(np.asarray(encoded), mask)
+        assert encoded.count() == mask.sum()
+        fn = str(tmp_path / ('mask%i.npz' % i))
+        runlength.save(fn, mask)
+        npt.assert_array_equal(np.asarray(runlength.load(fn)), mask)
+
+
+def test_extract(channels):
+    rgb = synthetic.rnapii_image(channels)
+    for mask in masks(channels):
+        encoded = runlength.encode(mask)
+        npt.assert_array_equal(runlength.extract(channels['rnapii'],
+                                                 encoded),
+                               channels['rnapii'][mask])
+        # a non-contiguous channel view
+        npt.assert_array_equal(encoded.extract(rgb[..., 0]),
+                               rgb[..., 0][mask])
+
+
+def test_operators(channels):
+    centro, chrom = masks(channels)[:2]
+    a, b = runlength.encode(centro), runlength.encode(chrom)
+    npt.assert_array_equal(np.asarray(a & b), centro & chrom)
+    npt.assert_array_equal(np.asarray(a | b), centro | chrom)
+    npt.assert_array_equal(np.asarray(~a), ~centro)
+    npt.assert_array_equal(np.asarray(a & ~b), centro & ~chrom)
+
+
+def test_rnapii_with_runlength_masks(channels):
+    rgb = synthetic.rnapii_image(channels)
+    dense_masks = cafe.centromere_chromatin_masks(rgb[..., 1], rgb[..., 2])
+    dense = cafe.rnapii_centromere_vs_chromatin(rgb, masks=dense_masks)
+    encoded = cafe.rnapii_centromere_vs_chromatin(
+                    rgb, masks=tuple(runlength.encode(m)
+                                     for m in dense_masks))
+    for d, e in zip(dense, encoded):
+        npt.assert_array_equal(d, e)
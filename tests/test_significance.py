@@ -0,0 +1,110 @@
+import itertools as it
+
+import numpy as np
+from numpy import testing as npt
+import pytest
+
+import significance
+import sketch
+
+
+TEST = np.array([1.2, 2.0, 2.9, 3.1, 4.5])
+CONTROL = np.array([3.8, 5.1, 6.0, 6.2, 7.7, 9.0])
+
+
+def exact_p_value(test, control):
+    """The two-sided p-value over all relabellings of the images."""
+    values = np.concatenate([test, control])
+    observed = abs(test.mean() - control.mean())
+    extreme = n = 0
+    for members in it.combinations(range(len(values)), len(test)):
+        selected = np.zeros(len(values), bool)
+        selected[list(members)] = True
+        difference = values[selected].mean() - values[~selected].mean()
+        extreme += abs(difference) >= observed - 1e-12
+        n += 1
+    return extreme / float(n)
+
+
+def test_region_summary():
+    values = np.random.RandomState(0).rand(1000)
+    summary = significance.region_summary(values)
+    npt.assert_allclose(summary, [1000, values.sum(), (values ** 2).sum()])
+    npt.assert_allclose(significance.region_summary(
+                            sketch.Histogram.of(values)), summary)
+
+
+def test_enrichment():
+    results = [(np.array([2.0, 4.0]), np.array([1.0, 1.0, 1.0])),
+               (np.array([3.0]), np.array([2.0, 4.0])),
+               (np.zeros(0), np.array([1.0]))]
+    ratios = significance.enrichment(significance.image_summaries(results))
+    npt.assert_allclose(ratios[:2], [3.0, 1.0])
+    assert np.isnan(ratios[2])
+
+
+def test_effect_sizes():
+    effects = significance.effect_sizes(TEST, CONTROL)
+    difference = TEST.mean() - CONTROL.mean()
+    pooled = np.sqrt((4 * TEST.var(ddof=1) + 5 * CONTROL.var(ddof=1)) / 9)
+    npt.assert_allclose(effects['difference'], difference)
+    npt.assert_allclose(effects['ratio'], TEST.mean() / CONTROL.mean())
+    npt.assert_allclose(effects['cohens_d'], difference / pooled)
+    assert (effects['n_test'], effects['n_control']) == (5, 6)
+
+
+def test_permutation_test():
+    p = significance.permutation_test(TEST, CONTROL, 20000, seed=1)
+    npt.assert_allclose(p, exact_p_value(TEST, CONTROL), atol=0.01)
+    # a single, identical value per group
+    assert significance.permutation_test([1.0], [1.0], 99) == 1.0
+
+
+def test_reproducible():
+    """Results depend on the seed, but not on the number of jobs."""
+    results = [significance.bootstrap(TEST, CONTROL, 2500, seed=3, jobs=jobs,
+                                      chunk_size=1000)
+               for jobs in [1, 2]]
+    npt.assert_array_equal(results[0], results[1])
+    assert results[0].shape == (2500, 2)
+    other = significance.bootstrap(TEST, CONTROL, 2500, seed=4)
+    assert not np.array_equal(results[0], other)
+    p_values = [significance.permutation_test(TEST, CONTROL, 2500, seed=3,
+                                              jobs=jobs)
+                for jobs in [1, 2]]
+    assert p_values[0] == p_values[1]
+
+
+def test_bootstrap():
+    means = significance.bootstrap(TEST, CONTROL, 20000, seed=0)
+    # resampled means stay within each group's range, around its mean
+    assert np.all((means[:, 0] >= TEST.min()) & (means[:, 0] <= TEST.max()))
+    npt.assert_allclose(means.mean(axis=0), [TEST.mean(), CONTROL.mean()],
+                        rtol=0.01)
+    npt.assert_allclose(means[:, 0].std(),
+                        TEST.std() / np.sqrt(len(TEST)), rtol=0.05)
+
+
+def test_compare():
+    test = np.concatenate([TEST, [np.nan]])
+    result = significance.compare(test, CONTROL, 5000, seed=2)
+    assert result['n_test'] == len(TEST)
+    assert result['difference_low'] < result['difference'] < \
+        result['difference_high']
+    assert result['ratio_low'] < result['ratio'] < result['ratio_high']
+    # the p-value and the intervals come from independent streams
+    permutation_seed, bootstrap_seed = np.random.SeedSequence(2).spawn(2)
+    assert result['p_value'] == significance.permutation_test(
+                TEST, CONTROL, 5000, permutation_seed)
+    means = significance.bootstrap(TEST, CONTROL, 5000, bootstrap_seed)
+    npt.assert_allclose([result['difference_low'],
+                         result['difference_high']],
+                        np.percentile(means[:, 0] - means[:, 1],
+                                      [2.5, 97.5]))
+
+
+def test_compare_empty_group():
+    with pytest.raises(ValueError):
+        significance.compare([np.nan, np.nan], CONTROL, 100)
+    with pytest.raises(ValueError):
+        significance.permutation_test(TEST, [], 100)
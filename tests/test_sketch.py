@@ -0,0 +1,88 @@
+import numpy as np
+from numpy import testing as npt
+import pytest
+
+import sketch
+
+
+def values(n=100000, seed=0):
+    return np.random.RandomState(seed).beta(2, 5, n)
+
+
+def test_moments_and_extremes():
+    x = values()
+    h = sketch.Histogram.of(x)
+    assert h.n == len(x)
+    npt.assert_allclose(h.mean, x.mean())
+    npt.assert_allclose(h.var, x.var(), rtol=1e-8)
+    assert (h.min, h.max) == (x.min(), x.max())
+    assert h.counts.sum() == len(x)
+
+
+def test_quantile():
+    x = values()
+    h = sketch.Histogram.of(x)
+    q = [0, 0.1, 0.25, 0.5, 0.75, 0.9, 1]
+    # within one bin of the exact quantiles
+    npt.assert_allclose(h.quantile(q), np.percentile(x, np.multiply(q, 100)),
+                        atol=(h.hi - h.lo) / h.nbins)
+    assert h.quantile(0) == x.min() and h.quantile(1) == x.max()
+
+
+def test_out_of_range():
+    h = sketch.Histogram.of([-1.0, 0.5, 2.0], nbins=4)
+    npt.assert_array_equal(h.counts, [1, 0, 1, 1])
+    assert (h.min, h.max) == (-1.0, 2.0)
+
+
+def test_empty():
+    h = sketch.Histogram()
+    h.add(np.zeros(0))
+    assert h.n == 0
+    assert np.isnan(h.mean) and np.isnan(h.var) and np.isnan(h.quantile(0.5))
+    assert np.all(np.isnan(h.quantile([0.25, 0.75])))
+
+
+def test_merge():
+    x = values()
+    parts = [sketch.Histogram.of(p) for p in np.array_split(x, 5)]
+    merged = sketch.merge(parts)
+    whole = sketch.Histogram.of(x)
+    npt.assert_array_equal(merged.counts, whole.counts)
+    assert merged.n == whole.n
+    npt.assert_allclose([merged.mean, merged.var], [whole.mean, whole.var])
+    assert (merged.min, merged.max) == (whole.min, whole.max)
+    # the parts are unchanged
+    assert parts[0].n == len(np.array_split(x, 5)[0])
+
+
+def test_merge_incompatible():
+    with pytest.raises(ValueError):
+        sketch.Histogram(nbins=10) + sketch.Histogram(nbins=20)
+
+
+def test_state_roundtrip():
+    h = sketch.Histogram.of(values(), 0, 2, nbins=100)
+    restored = sketch.Histogram.from_state(h.state())
+    assert (restored.lo, restored.hi, restored.nbins) == (0, 2, 100)
+    npt.assert_array_equal(restored.counts, h.counts)
+    assert (restored.n, restored.total, restored.total_sq) == \
+        (h.n, h.total, h.total_sq)
+    assert (restored.min, restored.max) == (h.min, h.max)
+
+
+def test_box_stats():
+    x = np.concatenate([values(), [0.95, 0.99]])
+    stats = sketch.Histogram.of(x).box_stats(label='x')
+    q1, med, q3 = np.percentile(x, [25, 50, 75])
+    width = 1.0 / 4096
+    npt.assert_allclose([stats['q1'], stats['med'], stats['q3']],
+                        [q1, med, q3], atol=width)
+    npt.assert_allclose(stats['mean'], x.mean())
+    # the whiskers reach the most extreme values within 1.5 IQR, where the
+    # IQR is itself estimated
+    iqr = q3 - q1
+    inside = x[(x >= q1 - 1.5 * iqr) & (x <= q3 + 1.5 * iqr)]
+    assert stats['whislo'] == x.min() == inside.min()
+    npt.assert_allclose(stats['whishi'], inside.max(), atol=5 * width)
+    assert stats['label'] == 'x' and len(stats['fliers']) == 0
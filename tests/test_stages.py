@@ -0,0 +1,31 @@
+from numpy import testing as npt
+import pytest
+
+import cafe
+import stages
+
+
+@pytest.mark.parametrize('method', ['gaussian', 'mean'])
+def test_encode_stages_telos(channels, method):
+    image = channels['telomere']
+    cached = stages.EncodeStages(channels['centromere'], image)
+    npt.assert_array_equal(cached.telos(2.0, 25, method),
+                           cafe.threshold_adaptive(image, 25, 2.0, method))
+
+
+def test_encode_stages_final_maxsize(channels):
+    centro, telo = channels['centromere'], channels['telomere']
+    cached = stages.EncodeStages(centro, telo, maxsize=None,
+                                 final_maxsize=1)
+    for centro_radius in [3, 10]:
+        for telo_open_radius in [1, 2, 4]:
+            encoded = cached.encode(centro_radius=centro_radius,
+                                    telo_open_radius=telo_open_radius)
+            npt.assert_array_equal(encoded, cafe.encode_centro_telomeres(
+                                       centro, telo,
+                                       centro_radius=centro_radius,
+                                       telo_open_radius=telo_open_radius))
+    for stage in stages.EncodeStages.FINAL_STAGES:
+        assert len(cached._cache[stage]) == 1
+    assert len(cached._cache['centros_distance']) == 1
+    assert len(cached._cache['telos_depth']) == 1
@@ -0,0 +1,40 @@
+import numpy as np
+from numpy import testing as npt
+
+import cafe
+import sweep
+
+
+GRID = {'centro_offset': [0.0, 0.05],
+        'centro_radius': [3, 10],
+        'telo_adapt_radius': [25, 50],
+        'telo_open_radius': [1, 4]}
+
+
+def test_parameter_grid():
+    settings = sweep.parameter_grid({'b': [1, 2], 'a': ['x', 'y', 'z']})
+    assert settings == [{'a': a, 'b': b}
+                        for a in ['x', 'y', 'z'] for b in [1, 2]]
+    assert len(sweep.parameter_grid(GRID)) == 16
+
+
+def test_sweep_encode(channels):
+    centro, telo = channels['centromere'], channels['telomere']
+    settings = sweep.parameter_grid(GRID)
+    rows = sweep.sweep_encode(centro, telo, settings)
+    assert len(rows) == len(settings)
+    for setting, row in zip(settings, rows):
+        expected = sweep.encode_measures(
+                        cafe.encode_centro_telomeres(centro, telo, **setting))
+        npt.assert_equal(row, dict(setting, **expected))
+
+
+def test_encode_measures():
+    encoded = np.array([[0, 1, 1], [2, 3, 3]], np.uint8)
+    measures = sweep.encode_measures(encoded)
+    assert measures['telomere_area'] == 2
+    assert measures['centromere_area'] == 1
+    assert measures['overlap_area'] == 2
+    npt.assert_allclose(measures['telomere_fraction_near_centromere'], 0.5)
+    assert np.isnan(sweep.encode_measures(np.zeros((2, 2), np.uint8))[
+                        'telomere_fraction_near_centromere'])
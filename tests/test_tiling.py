@@ -0,0 +1,92 @@
+import numpy as np
+from numpy import testing as npt
+from scipy import ndimage as nd
+from skimage import morphology
+import pytest
+
+import cafe
+import tiling
+
+
+# tiles small enough to cut through many objects of the synthetic images
+TILE_SHAPES = [32, 40, (16, 64)]
+TILE_SHAPES_3D = [(4, 16, 16), (5, 48, 20)]
+
+
+def chromatin_mask(channels):
+    return cafe.chromatin_foreground(channels['chromatin'], 25)
+
+
+@pytest.mark.parametrize('tile_shape', TILE_SHAPES)
+def test_encode_centro_telomeres(channels, tile_shape):
+    centro, telo = channels['centromere'], channels['telomere']
+    out = np.empty(centro.shape, np.uint8)
+    tiling.encode_centro_telomeres(centro, telo, out=out,
+                                   tile_shape=tile_shape)
+    npt.assert_array_equal(out, cafe.encode_centro_telomeres(centro, telo))
+
+
+@pytest.mark.parametrize('tile_shape', TILE_SHAPES)
+def test_get_chromatin(channels, tile_shape, tmp_path):
+    image = channels['chromatin']
+    out = np.empty(image.shape, bool)
+    tiling.get_chromatin(image, 25, size_filter=64, out=out,
+                         tile_shape=tile_shape, tmpdir=str(tmp_path))
+    npt.assert_array_equal(out, cafe.get_chromatin(image, 25,
+                                                   size_filter=64))
+
+
+@pytest.mark.parametrize('tile_shape', TILE_SHAPES)
+def test_remove_small_objects(channels, tile_shape, tmp_path):
+    mask = chromatin_mask(channels)
+    out = np.empty(mask.shape, bool)
+    tiling.remove_small_objects(mask, 64, out, tile_shape, str(tmp_path))
+    npt.assert_array_equal(out, morphology.remove_small_objects(mask, 64))
+
+
+@pytest.mark.parametrize('tile_shape', TILE_SHAPES)
+def test_label(channels, tile_shape):
+    mask = chromatin_mask(channels)
+    expected, n = nd.label(mask)
+    out = np.empty(mask.shape, np.int64)
+    labels, sizes = tiling.label(mask, out, tile_shape)
+    npt.assert_array_equal(labels, expected)
+    npt.assert_array_equal(sizes, np.bincount(expected.ravel()))
+    assert len(sizes) == n + 1
+
+
+def test_label_empty():
+    mask = np.zeros((40, 40), bool)
+    labels, sizes = tiling.label(mask, np.empty(mask.shape, np.int64), 16)
+    npt.assert_array_equal(labels, 0)
+    npt.assert_array_equal(sizes, [mask.size])
+
+
+@pytest.mark.parametrize('tile_shape', TILE_SHAPES_3D)
+def test_label_3d(channels_3d, tile_shape):
+    mask = chromatin_mask(channels_3d)
+    out = np.empty(mask.shape, np.int64)
+    labels, sizes = tiling.label(mask, out, tile_shape)
+    npt.assert_array_equal(labels, nd.label(mask)[0])
+
+
+@pytest.mark.parametrize('tile_shape', TILE_SHAPES_3D)
+def test_encode_centro_telomeres_3d(channels_3d, tile_shape):
+    centro, telo = channels_3d['centromere'], channels_3d['telomere']
+    kwargs = dict(centro_min_size=8, centro_radius=2, telo_adapt_radius=9,
+                  telo_open_radius=1)
+    out = np.empty(centro.shape, np.uint8)
+    tiling.encode_centro_telomeres(centro, telo, out=out,
+                                   tile_shape=tile_shape, **kwargs)
+    npt.assert_array_equal(out, cafe.encode_centro_telomeres(centro, telo,
+                                                             **kwargs))
+
+
+@pytest.mark.parametrize('tile_shape', TILE_SHAPES_3D)
+def test_get_chromatin_3d(channels_3d, tile_shape, tmp_path):
+    image = channels_3d['chromatin']
+    out = np.empty(image.shape, bool)
+    kwargs = dict(background_diameter=9, opening_size=1, size_filter=16)
+    tiling.get_chromatin(image, out=out, tile_shape=tile_shape,
+                         tmpdir=str(tmp_path), **kwargs)
+    npt.assert_array_equal(out, cafe.get_chromatin(image, **kwargs))
@@ -0,0 +1,72 @@
+import numpy as np
+from numpy import testing as npt
+from scipy import ndimage as nd
+from skimage import filters, measure
+import pytest
+
+import trf1
+
+from benchmarks import synthetic
+
+
+def baseline_trf_quantify(im):
+    """`trf1.trf_quantify` as computed with ``measure.regionprops``."""
+    trf, chrom = im[..., 0], im[..., 2]
+    objs = nd.label(trf > filters.threshold_otsu(trf))[0]
+    trfprops = measure.regionprops(objs, trf)
+    chrprops = measure.regionprops(objs, chrom)
+    preprops = measure.regionprops(objs, trf.astype(float) / (chrom + 1))
+    sizes = np.array([p.area for p in trfprops])
+    rmean = np.array([p.mean_intensity for p in trfprops])
+    means = np.array([p.mean_intensity / q.mean_intensity
+                      for p, q in zip(trfprops, chrprops)])
+    return {'size': sizes,
+            'raw_mean': rmean,
+            'raw_total': sizes * rmean,
+            'raw_max': [p.max_intensity for p in trfprops],
+            'post_mean': means,
+            'post_total': sizes * means,
+            'post_max': [p.max_intensity / q.max_intensity
+                         for p, q in zip(trfprops, chrprops)],
+            'pre_mean': [p.mean_intensity for p in preprops],
+            'pre_total': sizes * rmean,
+            'pre_max': [p.max_intensity for p in preprops],
+            'eccentricity': [p.eccentricity for p in trfprops]}
+
+
+def assert_props_equal(props, expected):
+    assert len(props) == len(expected['size']) > 0
+    for name, _ in trf1.TRF_FIELDS:
+        npt.assert_allclose(props[name], expected[name], rtol=1e-10,
+                            atol=1e-12, err_msg=name)
+
+
+def test_trf_quantify(channels):
+    im = synthetic.trf_image(channels)
+    assert_props_equal(trf1.trf_quantify(im), baseline_trf_quantify(im))
+
+
+@pytest.mark.parametrize('whis', [1.5, 0.5, 3.0])
+def test_box_stats(whis):
+    from matplotlib import cbook
+    random = np.random.RandomState(0)
+    sizes = [1, 2, 5, 100, 1000]
+    values = [random.standard_cauchy(n) for n in sizes]
+    # ties, and a group with a constant value
+    values += [np.round(random.normal(size=50)), np.full(7, 2.5)]
+    groups = np.concatenate([np.full(len(v), 10 * i)
+                             for i, v in enumerate(values)])
+    shuffle = random.permutation(len(groups))
+    group_ids, stats = trf1.box_stats(groups[shuffle],
+                                      np.concatenate(values)[shuffle], whis)
+    npt.assert_array_equal(group_ids, 10 * np.arange(len(values)))
+    expected = cbook.boxplot_stats(values, whis=whis)
+    for s, e in zip(stats, expected):
+        for key in ['med', 'q1', 'q3', 'mean', 'whislo', 'whishi']:
+            npt.assert_allclose(s[key], e[key], err_msg=key)
+        assert len(s['fliers']) == 0
+
+
+def test_box_stats_empty():
+    group_ids, stats = trf1.box_stats([], [])
+    assert len(group_ids) == 0 and stats == []
@@ -0,0 +1,32 @@
+from numpy import testing as npt
+
+import cafe
+import trf1
+import volume
+
+from benchmarks import synthetic
+
+
+def test_trf_quantify(channels_3d, tmp_path, write_tiff):
+    image = synthetic.trf_image(channels_3d)
+    fn = str(tmp_path / 'stack.tif')
+    write_tiff(fn, image, photometric='rgb')
+    with volume.TiffStack(fn, window=2) as stack:
+        assert stack.shape == image.shape
+        props = volume.trf_quantify(stack, slab_depth=4)
+    expected = trf1.trf_quantify(image)
+    assert len(props) == len(expected) > 0
+    for name, _ in trf1.TRF_FIELDS:
+        npt.assert_allclose(props[name], expected[name], rtol=1e-10,
+                            atol=1e-12, err_msg=name)
+
+
+def test_get_chromatin(channels_3d, tmp_path, write_tiff):
+    image = synthetic.trf_image(channels_3d)
+    fn = str(tmp_path / 'stack.tif')
+    write_tiff(fn, image, photometric='rgb')
+    with volume.TiffStack(fn) as stack:
+        chrs = volume.get_chromatin(stack.channel(2), slab_depth=4,
+                                    size_filter=16)
+        expected = cafe.get_chromatin(image[..., 2], size_filter=16)
+        npt.assert_array_equal(chrs, expected)
@@ -0,0 +1,509 @@
+"""Tiled, out-of-core versions of the segmentation functions in `cafe`.
+
+Images are processed in tiles with overlapping halos, so that only a few
+tiles are in memory at any time, and outputs are written to memory-mapped
+arrays. Neighbourhood operations (adaptive thresholding, dilation, opening)
+are exact as long as the halo is at least the radius of influence of the
+filters involved. Global operations are computed in streaming fashion:
+Otsu's threshold from a histogram accumulated over tiles, and object size
+filtering from connected components merged across tile boundaries.
+
+The results are identical to those of the in-memory functions in `cafe`.
+"""
+
+import os
+import itertools
+import tempfile
+
+import numpy as np
+from scipy import ndimage as nd
+from scipy import sparse
+from scipy.sparse import csgraph
+
+import cafe
+import adaptive
+import channelstats
+import morphology
+
+
+DEFAULT_TILE_SHAPE = (2048, 2048)
+
+
+def _as_tuple(value, ndim):
+    if np.isscalar(value):
+        return (int(value),) * ndim
+    return tuple(int(v) for v in value)
+
+
+def tile_slices(shape, tile_shape):
+    """Generate the slices of non-overlapping tiles covering an array.
+
+    Parameters
+    ----------
+    shape : tuple of int
+        The shape of the array.
+    tile_shape : int or tuple of int
+        The shape of each tile. Tiles at the end of an axis may be smaller.
+
+    Yields
+    ------
+    core : tuple of slice
+        The slices of one tile, in raster order.
+    """
+    tile_shape = _as_tuple(tile_shape, len(shape))
+    starts = [range(0, s, t) for s, t in zip(shape, tile_shape)]
+    for corner in itertools.product(*starts):
+        yield tuple(slice(c, min(c + t, s))
+                    for c, t, s in zip(corner, tile_shape, shape))
+
+
+def halo_slices(core, halo, shape):
+    """Extend a tile by a halo, clipped to the array bounds.
+
+    Parameters
+    ----------
+    core : tuple of slice
+        The tile, as produced by `tile_slices`.
+    halo : int or tuple of int
+        The halo width along each axis.
+    shape : tuple of int
+        The shape of the array.
+
+    Returns
+    -------
+    outer : tuple of slice
+        The slices of the tile plus halo in the array.
+    inner : tuple of slice
+        The position of the tile within the `outer` region.
+    """
+    halo = _as_tuple(halo, len(shape))
+    outer = tuple(slice(max(c.start - h, 0), min(c.stop + h, s))
+                  for c, h, s in zip(core, halo, shape))
+    inner = tuple(slice(c.start - o.start, c.stop - o.start)
+                  for c, o in zip(core, outer))
+    return outer, inner
+
+
+def clip_halo(halo, shape):
+    """Limit a halo to what can be read along each axis of an array.
+
+    Parameters
+    ----------
+    halo : int or tuple of int
+        The halo width along each axis.
+    shape : tuple of int
+        The shape of the array.
+
+    Returns
+    -------
+    halo : tuple of int
+        The halo along each axis, at most one less than its length. A
+        larger halo would read the same pixels.
+    """
+    return tuple(min(h, max(s - 1, 0))
+                 for h, s in zip(_as_tuple(halo, len(shape)), shape))
+
+
+def encode_halo(centro_radius=10, telo_adapt_radius=49, telo_open_radius=4,
+                telo_adapt_method='gaussian'):
+    """The halo needed by `encode_centro_telomeres`."""
+    telo_halo = (adaptive.radius(telo_adapt_radius, telo_adapt_method) +
+                 2 * telo_open_radius)
+    return max(centro_radius, telo_halo)
+
+
+def chromatin_halo(background_diameter=51, opening_size=2, opening_iter=2,
+                   background_method='gaussian'):
+    """The halo needed by `get_chromatin`."""
+    return (adaptive.radius(background_diameter, background_method) +
+            2 * opening_iter * opening_size)
+
+
+def map_tiles(func, images, out, halo, tile_shape=DEFAULT_TILE_SHAPE):
+    """Apply a neighbourhood function to images tile by tile.
+
+    Parameters
+    ----------
+    func : callable
+        A function taking one array per input image and returning an
+        array of the same shape.
+    images : list of array-like
+        The input images, all with the same shape. Any object supporting
+        ``shape`` and slicing works, such as a memory-mapped array.
+    out : array
+        The output array, with the same shape as the images.
+    halo : int or tuple of int
+        The number of pixels of context that `func` needs around each
+        pixel to compute the same value it would on the whole image.
+    tile_shape : int or tuple of int, optional
+        The shape of each tile, excluding the halo.
+
+    Returns
+    -------
+    out : array
+        The output array.
+    """
+    shape = out.shape
+    halo = clip_halo(halo, shape)
+    for core in tile_slices(shape, tile_shape):
+        outer, inner = halo_slices(core, halo, shape)
+        result = func(*[np.asarray(image[outer]) for image in images])
+        out[core] = result[inner]
+    return out
+
+
+def empty(shape, dtype, out=None, tmpdir=None):
+    """Create a memory-mapped output array.
+
+    Parameters
+    ----------
+    shape : tuple of int
+        The shape of the array.
+    dtype : numpy dtype
+        The type of the array.
+    out : string or array, optional
+        If an array, it is returned unchanged. If a string, a new ``.npy``
+        file with this name is created and memory-mapped. If None, a
+        temporary file is created in `tmpdir`; it is not deleted
+        automatically.
+    tmpdir : string, optional
+        The directory for temporary files.
+
+    Returns
+    -------
+    out : array
+        The output array.
+    """
+    if out is None:
+        fd, out = tempfile.mkstemp(suffix='.npy', dir=tmpdir)
+        os.close(fd)
+    if isinstance(out, str):
+        out = np.lib.format.open_memmap(out, mode='w+', dtype=dtype,
+                                        shape=tuple(shape))
+    return out
+
+
+def streamed_min_max(image, tile_shape=DEFAULT_TILE_SHAPE):
+    """Find the minimum and maximum of an image, one tile at a time."""
+    image_min = image_max = None
+    for core in tile_slices(image.shape, tile_shape):
+        tile = np.asarray(image[core])
+        tmin, tmax = tile.min(), tile.max()
+        image_min = tmin if image_min is None else min(image_min, tmin)
+        image_max = tmax if image_max is None else max(image_max, tmax)
+    return image_min, image_max
+
+
+def streamed_histogram(image, nbins=256, tile_shape=DEFAULT_TILE_SHAPE):
+    """Compute an image histogram one tile at a time.
+
+    The output is the same as that of ``skimage.exposure.histogram``:
+    integer images have one bin per integer value (starting at the
+    smallest value present), while floating point images use `nbins`
+    bins spanning the image range.
+
+    Parameters
+    ----------
+    image : array-like
+        The input image.
+    nbins : int, optional
+        The number of bins for floating point images.
+    tile_shape : int or tuple of int, optional
+        The shape of the tiles read into memory.
+
+    Returns
+    -------
+    hist : array of int
+        The histogram counts.
+    bin_centers : array
+        The center value of each bin.
+    """
+    if np.issubdtype(image.dtype, np.integer):
+        # integer histograms have fixed bins, so they can be merged in a
+        # single pass over the tiles
+        stats = None
+        for core in tile_slices(image.shape, tile_shape):
+            tile_stats = channelstats.channel_stats(np.asarray(image[core]))
+            stats = tile_stats if stats is None else stats.merge(tile_stats)
+        return stats.hist, stats.bin_centers
+    image_min, image_max = streamed_min_max(image, tile_shape)
+    hist = np.zeros(nbins, dtype=np.int64)
+    for core in tile_slices(image.shape, tile_shape):
+        tile_hist, bin_edges = np.histogram(np.asarray(image[core]),
+                                            bins=nbins,
+                                            range=(image_min, image_max))
+        hist += tile_hist
+    bin_centers = (bin_edges[:-1] + bin_edges[1:]) / 2.
+    return hist, bin_centers
+
+
+def _first_pixels(labels, n, offset, shape):
+    """The flat index in `shape` of the first pixel of each label of a tile.
+
+    `nd.label` numbers labels in order of their first pixel, so label
+    ``i + 1`` starts at the ``i``-th pixel where the running maximum
+    label increases.
+    """
+    flat = labels.ravel()
+    nonzero = np.flatnonzero(flat)
+    values = flat[nonzero]
+    new = np.empty(len(values), bool)
+    new[:1] = True
+    new[1:] = values[1:] > np.maximum.accumulate(values)[:-1]
+    coords = np.unravel_index(nonzero[new][:n], labels.shape)
+    return np.ravel_multi_index([c + o for c, o in zip(coords, offset)],
+                                shape)
+
+
+def label(mask, out, tile_shape=DEFAULT_TILE_SHAPE):
+    """Label the connected components of a mask, one tile at a time.
+
+    Components are found with face connectivity, as with ``nd.label``
+    and ``remove_small_objects`` defaults. Each tile is labelled
+    independently, after which labels touching across tile boundaries
+    are merged using the connected components of the label adjacency
+    graph. Finally, components are numbered in order of their first
+    pixel, so the output is identical to that of ``nd.label``.
+
+    Parameters
+    ----------
+    mask : array-like of bool
+        The input mask.
+    out : array of int
+        The output label array, with the same shape as `mask`.
+    tile_shape : int or tuple of int, optional
+        The shape of the tiles read into memory.
+
+    Returns
+    -------
+    out : array of int
+        The label array.
+    sizes : array of int
+        The number of pixels of each label. ``sizes[0]`` is the size of
+        the background.
+    """
+    shape = mask.shape
+    tile_shape = _as_tuple(tile_shape, len(shape))
+    n_labels = 0
+    tile_counts = [np.zeros(1, dtype=np.int64)]
+    tile_firsts = [np.zeros(1, dtype=np.int64)]
+    for core in tile_slices(shape, tile_shape):
+        labels, n = nd.label(np.asarray(mask[core]))
+        counts = np.bincount(labels.ravel(), minlength=n + 1)
+        tile_counts[0][0] += counts[0]
+        tile_counts.append(counts[1:])
+        tile_firsts.append(_first_pixels(labels, n,
+                                         [c.start for c in core], shape))
+        labels = labels.astype(out.dtype)
+        labels[labels > 0] += n_labels
+        out[core] = labels
+        n_labels += n
+    counts = np.concatenate(tile_counts)
+    firsts = np.concatenate(tile_firsts)
+    # find pairs of labels touching across each tile boundary
+    rows, cols = [], []
+    for axis, (s, t) in enumerate(zip(shape, tile_shape)):
+        for boundary in range(t, s, t):
+            before = np.asarray(np.take(out, boundary - 1, axis=axis)).ravel()
+            after = np.asarray(np.take(out, boundary, axis=axis)).ravel()
+            touching = (before > 0) & (after > 0)
+            rows.append(before[touching])
+            cols.append(after[touching])
+    if rows:
+        rows, cols = np.concatenate(rows), np.concatenate(cols)
+    else:
+        rows = cols = np.zeros(0, dtype=np.int64)
+    graph = sparse.coo_matrix((np.ones(len(rows)), (rows, cols)),
+                              shape=(n_labels + 1, n_labels + 1))
+    n_components, components = csgraph.connected_components(graph,
+                                                             directed=False)
+    # number the components in order of their first pixel, keeping the
+    # background, whose "first pixel" is set to -1, at 0
+    firsts[0] = -1
+    component_firsts = np.full(n_components, np.iinfo(np.int64).max,
+                               dtype=np.int64)
+    np.minimum.at(component_firsts, components, firsts)
+    rank = np.empty(n_components, dtype=np.int64)
+    rank[np.argsort(component_firsts)] = np.arange(n_components)
+    components = rank[components]
+    sizes = np.bincount(components, weights=counts).astype(np.int64)
+    for core in tile_slices(shape, tile_shape):
+        out[core] = components[np.asarray(out[core])]
+    return out, sizes
+
+
+def remove_small_objects(mask, min_size, out, tile_shape=DEFAULT_TILE_SHAPE,
+                         tmpdir=None):
+    """Remove connected components smaller than `min_size` from a mask.
+
+    This is a tiled version of ``skimage.morphology.remove_small_objects``
+    with the default connectivity.
+
+    Parameters
+    ----------
+    mask : array-like of bool
+        The input mask.
+    min_size : int
+        Components with fewer pixels than this are removed.
+    out : array of bool
+        The output array. It may be the same as `mask`.
+    tile_shape : int or tuple of int, optional
+        The shape of the tiles read into memory.
+    tmpdir : string, optional
+        The directory for the temporary label array.
+
+    Returns
+    -------
+    out : array of bool
+        The filtered mask.
+    """
+    fd, labels_fn = tempfile.mkstemp(suffix='.npy', dir=tmpdir)
+    os.close(fd)
+    try:
+        labels = empty(mask.shape, np.int64, labels_fn)
+        labels, sizes = label(mask, labels, tile_shape)
+        keep = sizes >= min_size
+        keep[0] = False
+        for core in tile_slices(mask.shape, tile_shape):
+            out[core] = keep[np.asarray(labels[core])]
+        del labels
+    finally:
+        os.remove(labels_fn)
+    return out
+
+
+def encode_centro_telomeres(image_centro, image_telo,
+                            centro_offset=0.0, centro_factor=1.0,
+                            centro_min_size=36, centro_radius=10,
+                            telo_offset=0.0, telo_adapt_radius=49,
+                            telo_open_radius=4, telo_adapt_method='gaussian',
+                            out=None, tile_shape=DEFAULT_TILE_SHAPE,
+                            tmpdir=None):
+    """Tiled version of `cafe.encode_centro_telomeres`.
+
+    Parameters
+    ----------
+    image_centro, image_telo : array-like, shape (M, N)
+        The centromere and telomere channels, e.g. memory-mapped arrays.
+    centro_*, telo_* : optional
+        See `cafe.encode_centro_telomeres`.
+    out : string or array, optional
+        Where to write the output. See `empty`.
+    tile_shape : int or tuple of int, optional
+        The shape of the tiles read into memory, excluding halos.
+    tmpdir : string, optional
+        The directory for temporary arrays.
+
+    Returns
+    -------
+    encoded_regions : array of uint8, shape (M, N)
+        The memory-mapped output, identical to that of
+        `cafe.encode_centro_telomeres`.
+    """
+    shape = image_centro.shape
+    out = empty(shape, np.uint8, out, tmpdir)
+    hist, bin_centers = streamed_histogram(image_centro,
+                                           tile_shape=tile_shape)
+    threshold = channelstats.threshold_otsu_histogram(hist, bin_centers)
+    fd, centros_fn = tempfile.mkstemp(suffix='.npy', dir=tmpdir)
+    os.close(fd)
+    try:
+        centros = empty(shape, bool, centros_fn)
+        map_tiles(lambda im: cafe.otsu(im, centro_offset, centro_factor,
+                                       threshold=threshold),
+                  [image_centro], centros, 0, tile_shape)
+        remove_small_objects(centros, centro_min_size, centros, tile_shape,
+                             tmpdir)
+        halo = encode_halo(centro_radius, telo_adapt_radius,
+                           telo_open_radius, telo_adapt_method)
+
+        def encode_tile(centros_tile, telo_tile):
+            centros_tile = morphology.dilate(centros_tile, centro_radius)
+            telos = cafe.telomere_mask(telo_tile, telo_offset,
+                                       telo_adapt_radius, telo_open_radius,
+                                       telo_adapt_method)
+            return 2 * centros_tile.astype(np.uint8) + telos
+
+        map_tiles(encode_tile, [centros, image_telo], out, halo,
+                  tile_shape)
+        del centros
+    finally:
+        os.remove(centros_fn)
+    return out
+
+
+def get_centromere_neighbourhood(im, dilation_size=3, threshold=None,
+                                 out=None, tile_shape=DEFAULT_TILE_SHAPE,
+                                 tmpdir=None):
+    """Tiled version of `cafe.get_centromere_neighbourhood`.
+
+    Parameters
+    ----------
+    im : array-like, shape (M, N[, P])
+        The centromere image, e.g. a memory-mapped array.
+    dilation_size : int, optional
+        See `cafe.get_centromere_neighbourhood`.
+    threshold : float, optional
+        Use this threshold instead of Otsu's threshold, which is
+        otherwise computed from a streamed histogram.
+    out : string or array, optional
+        Where to write the output. See `empty`.
+    tile_shape : int or tuple of int, optional
+        The shape of the tiles read into memory, excluding halos.
+    tmpdir : string, optional
+        The directory for temporary arrays.
+
+    Returns
+    -------
+    centro : array of bool
+        The memory-mapped output, identical to that of
+        `cafe.get_centromere_neighbourhood`.
+    """
+    out = empty(im.shape, bool, out, tmpdir)
+    if threshold is None:
+        hist, bin_centers = streamed_histogram(im, tile_shape=tile_shape)
+        threshold = channelstats.threshold_otsu_histogram(hist, bin_centers)
+    map_tiles(lambda tile: morphology.dilate(tile > threshold,
+                                             dilation_size),
+              [im], out, dilation_size, tile_shape)
+    return out
+
+
+def get_chromatin(im, background_diameter=51, opening_size=2,
+                  opening_iter=2, size_filter=256,
+                  background_method='gaussian', channel_axis='auto',
+                  out=None, tile_shape=DEFAULT_TILE_SHAPE, tmpdir=None):
+    """Tiled version of `cafe.get_chromatin`.
+
+    Parameters
+    ----------
+    im : array-like, shape (M, N)
+        The chromatin grayscale image, e.g. a memory-mapped array.
+    background_diameter, opening_size, opening_iter, size_filter : optional
+    background_method, channel_axis : optional
+        See `cafe.get_chromatin`.
+    out : string or array, optional
+        Where to write the output. See `empty`.
+    tile_shape : int or tuple of int, optional
+        The shape of the tiles read into memory, excluding halos.
+    tmpdir : string, optional
+        The directory for temporary arrays.
+
+    Returns
+    -------
+    chrs : array of bool, shape (M, N)
+        The memory-mapped output, identical to that of
+        `cafe.get_chromatin`.
+    """
+    im = cafe.chromatin_channel(im, channel_axis)
+    out = empty(im.shape, bool, out, tmpdir)
+    halo = chromatin_halo(background_diameter, opening_size, opening_iter,
+                          background_method)
+    map_tiles(lambda tile: cafe.chromatin_foreground(tile,
+                                                     background_diameter,
+                                                     opening_size,
+                                                     opening_iter,
+                                                     background_method),
+              [im], out, halo, tile_shape)
+    remove_small_objects(out, size_filter, out, tile_shape, tmpdir)
+    return out
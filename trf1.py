@@ -1,16 +1,31 @@
 import numpy as np
-from scipy import ndimage as nd
+from scipy import special
 from matplotlib import pyplot as plt
-from skimage import filters, measure
-import toolz as tz
+from matplotlib import colors as mcolors
+
+import backends
+import labelstats
+import profiling
+
 
 def threshold(im):
-    return im > filters.threshold_otsu(im)
+    return im > backends.threshold_otsu(im)
+
+
+TRF_FIELDS = [('size', np.int64),
+              ('raw_mean', float), ('raw_total', float), ('raw_max', float),
+              ('post_mean', float), ('post_total', float),
+              ('post_max', float),
+              ('pre_mean', float), ('pre_total', float), ('pre_max', float),
+              ('eccentricity', float)]
 
 
 def trf_quantify(im):
     """Quantify the TRF1 blobs in an image.
 
+    All properties are computed in a single pass over the pixels of the
+    thresholded blobs, without building per-blob Python objects.
+
     Parameters
     ----------
     im : array of shape (M, N[, P], 3)
@@ -20,54 +35,141 @@ def trf_quantify(im):
 
     Returns
     -------
-    props : list of list of float
+    props : structured array, dtype `TRF_FIELDS`
         The desired properties measured for each blob in the image:
-        blob size, raw mean intensity, raw total intensity, raw max
-        intensity, 
-        and eccentricity.
+        blob size; raw mean, total and max intensity; the same,
+        normalised by the chromatin mean/max in the blob (post-);
+        the same, computed on the image normalised by chromatin
+        intensity (pre-); and eccentricity.
     """
     trf = im[..., 0]
-    objs = nd.label(threshold(trf))[0]
-    trfprops = measure.regionprops(objs, trf)
-    # non-intensity features
-    sizes = [p.area for p in trfprops]
-    eccen = [p.eccentricity for p in trfprops]
+    chrom = im[..., 2]
+    with profiling.stage('otsu'):
+        mask = threshold(trf)
+    with profiling.stage('label'):
+        objs = backends.label(mask)[0]
+    with profiling.stage('regionprops'):
+        index, starts, _ = labelstats.sort_labels(objs)
+        sizes = labelstats.object_sizes(starts, len(index))
+        trf_values = trf.ravel()[index]
+        chrom_values = chrom.ravel()[index]
+        stats = [labelstats.pixel_stats(trf_values, starts),
+                 labelstats.pixel_stats(chrom_values, starts),
+                 labelstats.pixel_stats(trf_values.astype(float) /
+                                        (chrom_values + 1), starts)]
+    with profiling.stage('eccentricity'):
+        ecc = labelstats.eccentricity(objs.shape, index, starts)
+    return trf_props(sizes, *stats, eccentricity=ecc)
+
+
+def trf_props(sizes, raw, chrom, pre, eccentricity):
+    """Assemble the `trf_quantify` table from per-blob statistics.
+
+    Parameters
+    ----------
+    sizes : array of int
+        The size of each blob.
+    raw, chrom, pre : tuple of (array of float, array)
+        The total and maximum intensity in each blob of the TRF1 channel,
+        the chromatin channel, and the TRF1 channel divided by
+        (chromatin + 1), respectively.
+    eccentricity : array of float
+        The eccentricity of each blob.
+
+    Returns
+    -------
+    props : structured array, dtype `TRF_FIELDS`
+        See `trf_quantify`.
+    """
+    props = np.zeros(len(sizes), dtype=TRF_FIELDS)
+    props['size'] = sizes
+    props['eccentricity'] = eccentricity
     # unnormalised properties (raw)
-    rmean = [p.mean_intensity for p in trfprops]
-    rtotl = [s * m for s, m in zip(sizes, rmean)]
-    rmaxs = [p.max_intensity for p in trfprops]
+    rtotl, rmaxs = raw
+    props['raw_mean'] = rtotl / sizes
+    props['raw_total'] = sizes * props['raw_mean']
+    props['raw_max'] = rmaxs
     # post-normalised properties
-    chrom = im[..., 2]
-    chrprops = measure.regionprops(objs, chrom)
-    means = [p.mean_intensity / q.mean_intensity
-             for p, q in zip(trfprops, chrprops)]
-    total = [s * m for s, m in zip(sizes, means)]
-    maxes = [p.max_intensity / q.max_intensity
-             for p, q in zip(trfprops, chrprops)]
-    # pre-normalised properties
-    trf = trf.astype(float) / (chrom + 1)
-    trfprops = measure.regionprops(objs, trf)
-    nmean = [p.mean_intensity for p in trfprops]
-    ntotl = [s * m for s, m in zip(sizes, rmean)]
-    nmaxs = [p.max_intensity for p in trfprops]
-    return list(zip(sizes, rmean, rtotl, rmaxs,
-                           means, total, maxes,
-                           nmean, ntotl, nmaxs, eccen))
-
-
-def boxplot(im_nums, kd, values):
+    ctotl, cmaxs = chrom
+    props['post_mean'] = props['raw_mean'] / (ctotl / sizes)
+    props['post_total'] = sizes * props['post_mean']
+    props['post_max'] = rmaxs / cmaxs
+    # pre-normalised properties, computed only on the blob pixels
+    ntotl, nmaxs = pre
+    props['pre_mean'] = ntotl / sizes
+    # the pre-normalised total has always been computed from the raw mean
+    props['pre_total'] = sizes * props['raw_mean']
+    props['pre_max'] = nmaxs
+    return props
+
+
+def box_stats(groups, values, whis=1.5):
+    """Compute box plot statistics of values grouped by a key.
+
+    A single sort of all values by group and value gives the statistics
+    of every group, with the conventions of ``plt.boxplot``.
+
+    Parameters
+    ----------
+    groups : array of int
+        The group of each value, e.g. its image number.
+    values : array of float
+        The values.
+    whis : float, optional
+        Whiskers extend to the most extreme value within `whis` times the
+        interquartile range of the box.
+
+    Returns
+    -------
+    group_ids : array of int
+        The groups present in `groups`, in increasing order.
+    stats : list of dict
+        The box statistics of each group, in the format expected by
+        ``plt.bxp``. Outliers are not included.
+    """
+    groups = np.asarray(groups)
+    values = np.asarray(values, dtype=float)
+    order = np.lexsort((values, groups))
+    values = values[order]
+    group_ids, starts, counts = np.unique(groups[order], return_index=True,
+                                          return_counts=True)
+    if len(values) == 0:
+        return group_ids, []
+    q1, med, q3 = labelstats.quantiles(values, starts, [0.25, 0.5, 0.75]).T
+    means = np.add.reduceat(values, starts) / counts
+    iqr = q3 - q1
+    group = np.repeat(np.arange(len(starts)), counts)
+    whislo = np.minimum.reduceat(
+            np.where(values >= (q1 - whis * iqr)[group], values, np.inf),
+            starts)
+    whishi = np.maximum.reduceat(
+            np.where(values <= (q3 + whis * iqr)[group], values, -np.inf),
+            starts)
+    stats = [{'med': med[i], 'q1': q1[i], 'q3': q3[i], 'mean': means[i],
+              'whislo': min(whislo[i], q1[i]),
+              'whishi': max(whishi[i], q3[i]), 'fliers': np.zeros(0)}
+             for i in range(len(starts))]
+    return group_ids, stats
+
+
+def boxplot(im_nums, kd, values, whis=1.5):
     """Show a boxplot with samples grouped by `im_nums` and coloured by `kd`.
 
-    All three input lists should have the same length.
+    All three input lists should have the same length. The box statistics
+    are computed with `box_stats` and drawn with ``plt.bxp``, so the time
+    to draw the plot depends on the number of images, not of samples.
+    Outliers are not drawn.
 
     Parameters
     ----------
-    im_nums : list of int
+    im_nums : list or array of int
         The image number for this blob.
-    kd : list of string
+    kd : list or array of string
         The status of a blob as either knockdown or control.
-    values : list of float
+    values : list or array of float
         The actual values to be plotted.
+    whis : float, optional
+        The whisker length, as in ``plt.boxplot``.
 
     Returns
     -------
@@ -76,23 +178,82 @@ def boxplot(im_nums, kd, values):
     """
     palette = ['blue', 'orange', 'darkgreen', 'purple']
     fig = plt.figure(figsize=(12, 3))
-    values_by_image = {}
-    for im_num, val in zip(im_nums, values):
-        values_by_image.setdefault(im_num, []).append(val)
-    image_kind = {im : k for im, k in zip(im_nums, kd)}
-    x_vals = np.unique(im_nums)
-    kinds = sorted(list(set(kd)))
-    for c, k in zip(palette, kinds):
-        to_plot = [[]] * len(x_vals)
-        for i in x_vals:
-            if image_kind[i] == k:
-                to_plot[i] = values_by_image[i]
-        _ = plt.boxplot(to_plot, labels=x_vals, boxprops={'color': c})
+    ax = fig.gca()
+    im_nums = np.asarray(im_nums)
+    kd = np.asarray(kd)
+    x_vals, stats = box_stats(im_nums, values, whis)
+    image_kind = kd[np.unique(im_nums, return_index=True)[1]]
+    positions = np.arange(1, len(x_vals) + 1)
+    for c, k in zip(palette, np.unique(kd)):
+        selected = np.flatnonzero(image_kind == k)
+        ax.bxp([stats[i] for i in selected], positions=positions[selected],
+               boxprops={'color': c}, showfliers=False, manage_ticks=False)
+    ax.set_xticks(positions)
+    ax.set_xticklabels([str(x) for x in x_vals])
+    ax.set_xlim(0.5, len(x_vals) + 0.5)
     return fig
 
 
-def scatter(kd, control, colors=['orange', 'blue'], **kwargs):
-    """Show a jittered scatterplot of the measurements.
+def jitter_density(groups, bins=256, jitter=0.2, xbins=16, range=None):
+    """Compute the expected density of a jittered scatterplot.
+
+    Group ``i`` is placed at x = i, with Gaussian jitter of standard
+    deviation `jitter`, as in a jittered scatterplot. Rather than drawing
+    random positions for every value, the values of each group are
+    binned, and the bins are spread along x by the jitter distribution.
+
+    Parameters
+    ----------
+    groups : list of array of float
+        The values of each group.
+    bins : int, optional
+        The number of bins along y.
+    jitter : float, optional
+        The standard deviation of the jitter.
+    xbins : int, optional
+        The number of bins along x per unit, i.e. per group.
+    range : (float, float), optional
+        The range of y values covered. Values outside it are counted in
+        the first or last bin. Default: from 0 to the largest value + 1.
+
+    Returns
+    -------
+    counts : array of int, shape (len(groups), bins)
+        The number of values of each group in each y bin.
+    weights : array of float, shape (nx, len(groups))
+        The fraction of the jittered points of each group falling in each
+        x bin. ``weights[:, members].dot(counts[members]).T`` is the
+        expected number of points of the groups `members` in each (y, x)
+        bin.
+    xedges, yedges : array of float
+        The bin edges.
+    """
+    lengths = [len(g) for g in groups]
+    ys = np.concatenate([np.ravel(g) for g in groups] or
+                        [np.zeros(0)]).astype(float)
+    if range is None:
+        range = (0, (ys.max() if len(ys) else 0) + 1)
+    yedges = np.linspace(range[0], range[1], bins + 1)
+    ybin = np.clip(np.searchsorted(yedges, ys, side='right') - 1,
+                   0, bins - 1)
+    group = np.repeat(np.arange(len(groups)), lengths)
+    counts = np.bincount(group * bins + ybin, minlength=len(groups) * bins)
+    counts = counts.reshape(len(groups), bins)
+    xedges = np.linspace(-1, len(groups), (len(groups) + 1) * xbins + 1)
+    cdf = special.ndtr((xedges[:, np.newaxis] - np.arange(len(groups))) /
+                       jitter)
+    weights = np.diff(cdf, axis=0)
+    return counts, weights, xedges, yedges
+
+
+def scatter(kd, control, colors=['orange', 'blue'], bins=256, jitter=0.2,
+            **kwargs):
+    """Show the density of a jittered scatterplot of the measurements.
+
+    The density is computed by `jitter_density` and drawn with
+    ``pcolormesh``, in shades of the color of each kind of image on a
+    logarithmic scale, so the time to draw the plot depends on the
+    number of images and bins, not of measurements.
 
     Parameters
     ----------
@@ -105,24 +266,36 @@ def scatter(kd, control, colors=['orange', 'blue'], **kwargs):
     colors : list of two matplotlib colorspecs, optional
         The colors corresponding to AUKB-KD (0) and control (1) data
         points on the scatterplot.
+    bins : int, optional
+        The number of bins along the y axis.
+    jitter : float, optional
+        The standard deviation of the horizontal spread of each image.
     
     Additional Parameters
     ---------------------
     **kwargs : keyword arguments
         Additional keyword arguments passed directly to
-        ``plt.scatter``.
+        ``plt.pcolormesh``.
 
     Returns
     -------
-    fig : matplotlib axes
-        The returned value from the call to ``plt.scatter``.
+    ax : matplotlib axes
+        The axes of the plot.
     """
-    xs = list(tz.concat([i + 0.2 * np.random.randn(n)
-                         for i, n in enumerate(map(len, kd + control))]))
-    color_vector = ([colors[0]] * sum(map(len, kd)) +
-                    [colors[1]] * sum(map(len, control)))
-    ys = list(tz.concat(kd + control))
-    fig = plt.scatter(xs, ys, c=color_vector, **kwargs)
-    plt.xlim(0, max(xs) + 1)
-    plt.ylim(0, max(ys) + 1)
-    return fig
+    groups = list(kd) + list(control)
+    counts, weights, xedges, yedges = jitter_density(groups, bins, jitter)
+    ax = plt.gca()
+    norm = kwargs.pop('norm', None)
+    members = [slice(0, len(kd)), slice(len(kd), len(groups))]
+    for color, m in zip(colors, members):
+        density = weights[:, m].dot(counts[m]).T
+        cmap = mcolors.LinearSegmentedColormap.from_list(
+                str(color), [mcolors.to_rgba(color, 0),
+                             mcolors.to_rgba(color, 1)])
+        # bins expecting less than 0.1 point are transparent
+        ax.pcolormesh(xedges, yedges, density, cmap=cmap,
+                      norm=norm or mcolors.LogNorm(vmin=0.1, clip=True),
+                      **kwargs)
+    ax.set_xlim(-0.5, len(groups) - 0.5)
+    ax.set_ylim(yedges[0], yedges[-1])
+    return ax
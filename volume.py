@@ -0,0 +1,299 @@
+"""Segmentation and quantification of z-stacks, loaded a few planes at a time.
+
+The in-memory functions in `cafe` and `trf1` work on 3D arrays directly,
+using ball-shaped structuring elements and 3D labelling. The functions in
+this module give the same results on stacks that are too big to load at
+once: planes are read lazily from multi-page TIFF files and processed in
+slabs along z with `tiling`, so only a sliding window of planes is in
+memory at any time.
+"""
+
+import os
+import collections
+import tempfile
+
+import numpy as np
+
+try:
+    from skimage.external import tifffile
+except ImportError:
+    import tifffile
+
+import channelstats
+import tiling
+import labelstats
+import trf1
+
+
+def _normalise_key(key, ndim):
+    """Expand an indexing key into a tuple with one entry per axis."""
+    if not isinstance(key, tuple):
+        key = (key,)
+    if any(k is Ellipsis for k in key):
+        i = [k is Ellipsis for k in key].index(True)
+        n_missing = ndim - (len(key) - 1)
+        key = key[:i] + (slice(None),) * n_missing + key[i + 1:]
+    return key + (slice(None),) * (ndim - len(key))
+
+
+class TiffStack(object):
+    """A multi-page TIFF file presented as a lazily-loaded array.
+
+    Each page is one z-plane, of shape (M, N) or (M, N, C). Planes are
+    read from disk when they are first indexed, and the most recently used
+    `window` planes are kept in memory.
+
+    Parameters
+    ----------
+    filename : string
+        The input file.
+    window : int, optional
+        The number of planes to keep in memory. When processing slabs of
+        depth ``d`` with a halo ``h``, ``d + 2 * h`` avoids reading any
+        plane twice. The functions of this module enlarge it as needed.
+    """
+    def __init__(self, filename, window=16):
+        self.filename = filename
+        self.window = window
+        self._tif = tifffile.TiffFile(filename)
+        self._planes = collections.OrderedDict()
+        first = self.plane(0)
+        self.dtype = first.dtype
+        self.shape = (len(self._tif.pages),) + first.shape
+        self.ndim = len(self.shape)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def plane(self, z):
+        """Return plane `z`, reading it from disk if necessary."""
+        if z in self._planes:
+            self._planes[z] = plane = self._planes.pop(z)
+            return plane
+        plane = self._tif.pages[z].asarray()
+        self._planes[z] = plane
+        while len(self._planes) > self.window:
+            self._planes.popitem(last=False)
+        return plane
+
+    def __getitem__(self, key):
+        key = _normalise_key(key, self.ndim)
+        z, rest = key[0], key[1:]
+        if isinstance(z, slice):
+            planes = [self.plane(i)[rest]
+                      for i in range(*z.indices(len(self)))]
+            if not planes:
+                return np.zeros((0,) + self.shape[1:], self.dtype)[
+                                                    (slice(None),) + rest]
+            return np.stack(planes)
+        return self.plane(z)[rest]
+
+    def __array__(self, dtype=None):
+        return np.asarray(self[:], dtype=dtype)
+
+    def channel(self, c):
+        """Return a lazy view of channel `c` of a multichannel stack."""
+        return ChannelView(self, c)
+
+    def close(self):
+        """Release the file and all cached planes."""
+        self._planes.clear()
+        self._tif.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ChannelView(object):
+    """A single channel of a `TiffStack`, itself lazily loaded.
+
+    Parameters
+    ----------
+    stack : `TiffStack`
+        A stack with shape (P, M, N, C).
+    channel : int
+        The channel to view.
+    """
+    def __init__(self, stack, channel):
+        self.stack = stack
+        self.channel = channel
+        self.shape = stack.shape[:-1]
+        self.dtype = stack.dtype
+        self.ndim = len(self.shape)
+
+    def __getitem__(self, key):
+        return self.stack[_normalise_key(key, self.ndim) + (self.channel,)]
+
+    def __array__(self, dtype=None):
+        return np.asarray(self[:], dtype=dtype)
+
+
+def slab_shape(shape, depth):
+    """The tile shape for processing a volume in slabs of `depth` planes."""
+    return (depth,) + tuple(shape[1:])
+
+
+def _select(kwargs, func):
+    """The keyword arguments in `kwargs` that `func` accepts."""
+    names = func.__code__.co_varnames[:func.__code__.co_argcount]
+    return dict((k, v) for k, v in kwargs.items() if k in names)
+
+
+def fit_window(stack, slab_depth, halo):
+    """Enlarge the plane cache of a stack to hold a slab and its halo.
+
+    The halo of the isotropic filters used in `cafe` is often deeper than
+    a slab (about 40 planes for the default telomere threshold), so with
+    a smaller window every slab would read its planes from disk again.
+
+    Parameters
+    ----------
+    stack : `TiffStack` or `ChannelView`
+        The stack. Other arrays are left alone.
+    slab_depth : int
+        The number of planes processed at once, excluding halos.
+    halo : int or tuple of int
+        The halo along each axis.
+    """
+    stack = getattr(stack, 'stack', stack)
+    if isinstance(stack, TiffStack):
+        halo_z = tiling.clip_halo(halo, stack.shape)[0]
+        stack.window = max(stack.window,
+                           min(slab_depth + 2 * halo_z, len(stack)))
+
+
+def encode_centro_telomeres(stack_centro, stack_telo, slab_depth=8,
+                            out=None, tmpdir=None, **kwargs):
+    """Find centromeres, telomeres and their overlap in a lazy z-stack.
+
+    Parameters
+    ----------
+    stack_centro, stack_telo : array-like, shape (P, M, N)
+        The centromere and telomere channels, e.g. `ChannelView` objects.
+    slab_depth : int, optional
+        The number of planes processed at once, excluding halos.
+    out : string or array, optional
+        Where to write the output. See `tiling.empty`.
+    tmpdir : string, optional
+        The directory for temporary arrays.
+    **kwargs : keyword arguments
+        Segmentation parameters for `cafe.encode_centro_telomeres`.
+
+    Returns
+    -------
+    encoded_regions : array of uint8, shape (P, M, N)
+        The memory-mapped output.
+    """
+    fit_window(stack_telo, slab_depth,
+               tiling.encode_halo(**_select(kwargs, tiling.encode_halo)))
+    return tiling.encode_centro_telomeres(stack_centro, stack_telo,
+                                          out=out, tmpdir=tmpdir,
+                                          tile_shape=slab_shape(
+                                              stack_centro.shape, slab_depth),
+                                          **kwargs)
+
+
+def get_centromere_neighbourhood(stack, slab_depth=8, out=None, tmpdir=None,
+                                 **kwargs):
+    """Lazy z-stack version of `cafe.get_centromere_neighbourhood`.
+
+    See `encode_centro_telomeres` for the parameters.
+    """
+    fit_window(stack, slab_depth, kwargs.get('dilation_size', 3))
+    return tiling.get_centromere_neighbourhood(stack, out=out, tmpdir=tmpdir,
+                                               tile_shape=slab_shape(
+                                                   stack.shape, slab_depth),
+                                               **kwargs)
+
+
+def get_chromatin(stack, slab_depth=8, out=None, tmpdir=None, **kwargs):
+    """Lazy z-stack version of `cafe.get_chromatin`.
+
+    See `encode_centro_telomeres` for the parameters.
+    """
+    fit_window(stack, slab_depth,
+               tiling.chromatin_halo(**_select(kwargs,
+                                               tiling.chromatin_halo)))
+    kwargs.setdefault('channel_axis', None)
+    return tiling.get_chromatin(stack, out=out, tmpdir=tmpdir,
+                                tile_shape=slab_shape(stack.shape,
+                                                      slab_depth),
+                                **kwargs)
+
+
+def trf_quantify(stack, slab_depth=8, tmpdir=None):
+    """Lazy z-stack version of `trf1.trf_quantify`.
+
+    Blobs are labelled in 3D across slabs, and their statistics are
+    accumulated one slab at a time.
+
+    Parameters
+    ----------
+    stack : `TiffStack`, shape (P, M, N, 3)
+        The input stack. Channel 0 should contain TRF1 signal, while
+        channel 2 should contain chromatin signal.
+    slab_depth : int, optional
+        The number of planes processed at once.
+    tmpdir : string, optional
+        The directory for temporary arrays.
+
+    Returns
+    -------
+    props : structured array, dtype `trf1.TRF_FIELDS`
+        The blob properties, with blobs in the same order as
+        ``trf1.trf_quantify(np.asarray(stack))``.
+    """
+    trf, chrom = stack.channel(0), stack.channel(2)
+    shape = trf.shape
+    tile_shape = slab_shape(shape, slab_depth)
+    hist, bin_centers = tiling.streamed_histogram(trf, tile_shape=tile_shape)
+    threshold = channelstats.threshold_otsu_histogram(hist, bin_centers)
+    workdir = tempfile.mkdtemp(dir=tmpdir)
+    mask_fn = os.path.join(workdir, 'mask.npy')
+    labels_fn = os.path.join(workdir, 'labels.npy')
+    try:
+        mask = tiling.empty(shape, bool, mask_fn)
+        tiling.map_tiles(lambda tile: tile > threshold, [trf], mask, 0,
+                         tile_shape)
+        labels = tiling.empty(shape, np.int64, labels_fn)
+        labels, sizes = tiling.label(mask, labels, tile_shape)
+        del mask
+        n = len(sizes)
+        totals = [np.zeros(n) for _ in range(3)]
+        maxima = [np.full(n, -np.inf) for _ in range(3)]
+        sums = np.zeros((n, len(shape)))
+        products = np.zeros((n, len(shape), len(shape)))
+        for core in tiling.tile_slices(shape, tile_shape):
+            slab_labels = np.asarray(labels[core])
+            index, starts, ids = labelstats.sort_labels(slab_labels)
+            if len(ids) == 0:
+                continue
+            offset = tuple(c.start for c in core)
+            trf_values = np.asarray(trf[core]).ravel()[index]
+            chrom_values = np.asarray(chrom[core]).ravel()[index]
+            channels = [trf_values, chrom_values,
+                        trf_values.astype(float) / (chrom_values + 1)]
+            for total, maximum, values in zip(totals, maxima, channels):
+                t, m = labelstats.pixel_stats(values, starts)
+                total[ids] += t
+                maximum[ids] = np.maximum(maximum[ids], m)
+            s, p = labelstats.coordinate_moments(slab_labels.shape, index,
+                                                 starts, offset)
+            sums[ids] += s
+            products[ids] += p
+        del labels
+    finally:
+        for fn in (mask_fn, labels_fn):
+            if os.path.exists(fn):
+                os.remove(fn)
+        os.rmdir(workdir)
+    # `tiling.label` numbers blobs in raster order, as `nd.label` does
+    sizes = sizes[1:]
+    ecc = labelstats.eccentricity_from_moments(sizes, sums[1:],
+                                               products[1:])
+    return trf1.trf_props(sizes,
+                          *[(t[1:], m[1:]) for t, m in zip(totals, maxima)],
+                          eccentricity=ecc)